@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+
+import os
+import sys
+import zlib
+import argparse
+import numpy as np
+import polars as pl
+from datetime import date, datetime, timedelta, timezone
+
+REPO_ROOT_DIRECTORY_PATH = os.path.commonpath([os.getcwd(), os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))])
+BYBIT_DIRECTORY_PATH     = os.path.abspath(os.path.join(os.path.dirname(__file__), '../bybit'))
+LIBRARIES_DIRECTORY_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../libs/python'))
+
+sys.path.append(BYBIT_DIRECTORY_PATH)
+sys.path.append(LIBRARIES_DIRECTORY_PATH)
+
+import data_config as dc
+import file_utils as fu
+import utils as u
+
+
+DEFAULT_SYMBOLS       = ['BTCUSDT']
+DEFAULT_DAYS          = 3
+DEFAULT_TICKS_PER_DAY = 1_000_000
+DEFAULT_SEED          = 42
+DEFAULT_DATE_BEGIN    = '2024-01-01'
+
+START_PRICES = {
+	'BTCUSDT' : 42000.0,
+	'ETHUSDT' : 2300.0,
+}
+DEFAULT_START_PRICE = 100.0
+
+PRICE_TICK_SIZE = 0.5
+SIZE_STEP       = 0.001
+
+
+def valid_date(s):
+
+	try:
+		return date.fromisoformat(s)
+
+	except ValueError:
+		raise argparse.ArgumentTypeError(f"Invalid data: '{s}'. The correct format has: YYYY-MM-DD.")
+
+
+def get_tick_directions():
+
+	changes    = pl.col('price').diff().sign().cast(pl.Int8).fill_null(0)
+	last_moves = changes.replace(0, None).forward_fill().fill_null(1)
+
+	return (
+		pl.when(changes > 0).then(pl.lit('PlusTick'))
+		.when(changes < 0).then(pl.lit('MinusTick'))
+		.when(last_moves > 0).then(pl.lit('ZeroPlusTick'))
+		.otherwise(pl.lit('ZeroMinusTick'))
+	)
+
+
+def get_trade_ids(rng, tick_count):
+
+	ids = pl.Series(np.frombuffer(rng.bytes(16 * tick_count), dtype='S16')).bin.encode('hex')
+
+	return pl.concat_str([ids.str.slice(0, 8), ids.str.slice(8, 4), ids.str.slice(12, 4), ids.str.slice(16, 4), ids.str.slice(20, 12)], separator='-')
+
+
+def generate_day_ticks(symbol, day, ticks_per_day, seed=DEFAULT_SEED):
+
+	# Every day has its own seeded stream, so any single file can be regenerated on its own
+	rng         = np.random.default_rng([seed, zlib.crc32(symbol.encode()), day.toordinal()])
+	day_start   = datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc).timestamp()
+	timestamps  = np.round(day_start + np.sort(rng.uniform(0, u.SECONDS_IN_DAY, ticks_per_day)), 4)
+	start_price = START_PRICES.get(symbol, DEFAULT_START_PRICE)
+	steps       = rng.choice([-1, 0, 1], size=ticks_per_day, p=[0.3, 0.4, 0.3])
+	prices      = np.maximum(start_price + np.cumsum(steps) * PRICE_TICK_SIZE, PRICE_TICK_SIZE)
+	sizes       = np.maximum(np.round(rng.exponential(0.05, ticks_per_day) / SIZE_STEP) * SIZE_STEP, SIZE_STEP).round(3)
+
+	df = pl.DataFrame({
+		'timestamp' : timestamps,
+		'symbol'    : pl.repeat(symbol, ticks_per_day, dtype=pl.Utf8, eager=True),
+		'side'      : np.where(rng.random(ticks_per_day) < 0.5, 'Buy', 'Sell'),
+		'size'      : sizes,
+		'price'     : prices,
+	})
+	df = df.with_columns(
+		get_tick_directions().alias('tickDirection'),
+		get_trade_ids(rng, ticks_per_day).alias('trdMatchID'),
+		(pl.col('price') * pl.col('size') * 1e8).round().cast(pl.Int64).alias('grossValue'),
+		pl.col('size').alias('homeNotional'),
+		(pl.col('price') * pl.col('size')).alias('foreignNotional'),
+	)
+
+	# Public dumps list the newest trade first
+	return df.reverse().select(u.TICK_SCHEMA.keys())
+
+
+def get_tick_file_path(directory_path, symbol, day, file_format):
+
+	return os.path.join(directory_path, symbol, f'{symbol}.{day.isoformat()}.{file_format}')
+
+
+def generate_tick_files(symbols, date_begin, days, ticks_per_day, formats, output_directory_path, seed=DEFAULT_SEED):
+
+	file_paths = {file_format: [] for file_format in formats}
+	for symbol in symbols:
+		for day in [date_begin + timedelta(days=idx) for idx in range(days)]:
+			df = generate_day_ticks(symbol, day, ticks_per_day, seed)
+			for file_format in formats:
+				file_path = get_tick_file_path(output_directory_path[file_format], symbol, day, file_format)
+				fu.create_local_folder(os.path.dirname(file_path))
+				if file_format == 'csv':
+					df.write_csv(file_path)
+				else:
+					u.write_tick_parquet(u.cast_tick_columns(df), file_path)
+				file_paths[file_format].append(file_path)
+
+	return file_paths
+
+
+def main():
+
+	parser = argparse.ArgumentParser(description='Synthetic ByBit trade data generator')
+	parser.add_argument('-s', '--symbols',
+		nargs   = '+',
+		default = DEFAULT_SYMBOLS,
+		type    = str,
+		help    = 'symbols',
+	)
+	parser.add_argument('-b', '--date_begin',
+		type    = valid_date,
+		default = valid_date(DEFAULT_DATE_BEGIN),
+		help    = 'Date of the first generated day (YYYY-MM-DD)',
+	)
+	parser.add_argument('-d', '--days',
+		type    = int,
+		default = DEFAULT_DAYS,
+		help    = 'Number of generated days per symbol',
+	)
+	parser.add_argument('-n', '--ticks_per_day',
+		type    = int,
+		default = DEFAULT_TICKS_PER_DAY,
+		help    = 'Number of generated trades per day',
+	)
+	parser.add_argument('-e', '--exports',
+		nargs   = '+',
+		default = ['csv'],
+		choices = ['csv', 'parquet'],
+		help    = 'Write daily files as CSV (like the public dumps) and/or typed Parquet',
+	)
+	parser.add_argument('-o', '--output_directory_path',
+		type    = str,
+		help    = 'Output tick directory path (per format default: DATA/1-TICK_CSV, DATA/1-TICK_PARQUET)',
+	)
+	parser.add_argument('--seed',
+		type    = int,
+		default = DEFAULT_SEED,
+		help    = 'Seed of the generator, the same seed always produces the same files',
+	)
+	args = parser.parse_args()
+
+	output_directory_path = {
+		'csv'     : args.output_directory_path or os.path.join(REPO_ROOT_DIRECTORY_PATH, dc.BASE_DIRECTORY__DATA, dc.DIRECTORY_NAME__TICK_CSV),
+		'parquet' : args.output_directory_path or os.path.join(REPO_ROOT_DIRECTORY_PATH, dc.BASE_DIRECTORY__DATA, dc.DIRECTORY_NAME__TICK_PARQUET),
+	}
+	file_paths = generate_tick_files(args.symbols, args.date_begin, args.days, args.ticks_per_day, args.exports, output_directory_path, args.seed)
+	for file_format, format_file_paths in file_paths.items():
+		print(f'Files written : {len(format_file_paths)} {file_format} files in {output_directory_path[file_format]}')
+
+
+if __name__ == '__main__':
+	main()
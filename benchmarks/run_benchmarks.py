@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+
+
+import os
+import sys
+import time
+import shutil
+import psutil
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
+
+REPO_ROOT_DIRECTORY_PATH = os.path.commonpath([os.getcwd(), os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))])
+BYBIT_DIRECTORY_PATH     = os.path.abspath(os.path.join(os.path.dirname(__file__), '../bybit'))
+LIBRARIES_DIRECTORY_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../libs/python'))
+
+sys.path.append(BYBIT_DIRECTORY_PATH)
+sys.path.append(LIBRARIES_DIRECTORY_PATH)
+
+import data_config as dc
+import domain as d
+import utils as u
+import generate_tick_data as g
+import bar_builder as bb
+import tick_archive as ta
+import tick_replay as tr
+import convert_duckdb_to_files as cdf
+import aggregate_raw_tick_to_ohlcv_into_database as adb
+
+
+DEFAULT_REPEATS   = 3
+DEFAULT_TOLERANCE = 0.2
+
+RSS_SAMPLE_INTERVAL = 0.01
+
+DATABASE_TIMEFRAMES = sorted(adb.ALLOWED_TIMEFRAMES, key=lambda tf: 0 if tf == 'tick' else d.timeframe_to_seconds(tf))
+
+INFORMATION_BARS = ['tick_1000', 'volume_100', 'dollar_1000000', 'imbalance_50']
+
+
+def measure(repeats, function, *args):
+
+	# The fastest repeat is reported, since slower ones only add noise from the rest of the machine
+	best_seconds, result = None, None
+	for _ in range(repeats):
+		started = time.perf_counter()
+		result  = function(*args)
+		seconds = time.perf_counter() - started
+		best_seconds = seconds if best_seconds is None else min(best_seconds, seconds)
+
+	return best_seconds, result
+
+
+def benchmark_read_and_concat_dataframes(dataset, file_format):
+
+	seconds, df = measure(dataset['repeats'], u.read_and_concat_dataframes, dataset['file_paths'][file_format], dataset['symbol'], file_format)
+
+	return {f'read_and_concat_dataframes.{file_format}': {'seconds': seconds, 'ticks': df.height}}
+
+
+def benchmark_get_interval_info(dataset):
+
+	df         = u.read_and_concat_dataframes(dataset['file_paths']['parquet'], dataset['symbol'], 'parquet')
+	seconds, _ = measure(dataset['repeats'], u.get_interval_info, df)
+
+	return {'get_interval_info': {'seconds': seconds, 'ticks': df.height}}
+
+
+def benchmark_aggregate_ohlcv(dataset):
+
+	df      = u.read_and_concat_dataframes(dataset['file_paths']['parquet'], dataset['symbol'], 'parquet')
+	results = {}
+	for timeframe in dc.OHLCV_TIMEFRAMES:
+		seconds, bars_df = measure(dataset['repeats'], u.aggregate_ohlcv, df, timeframe, dataset['symbol'])
+		results[f'aggregate_ohlcv.{timeframe}'] = {'seconds': seconds, 'ticks': df.height, 'bars': bars_df.height}
+
+	seconds, bars_dfs = measure(dataset['repeats'], u.aggregate_ohlcv_timeframes, df, dc.OHLCV_TIMEFRAMES, dataset['symbol'])
+	results['aggregate_ohlcv_timeframes'] = {'seconds': seconds, 'ticks': df.height, 'bars': sum(bars_df.height for bars_df in bars_dfs.values())}
+
+	return results
+
+
+def benchmark_aggregate_information_bars(dataset):
+
+	df      = u.read_and_concat_dataframes(dataset['file_paths']['parquet'], dataset['symbol'], 'parquet')
+	results = {}
+	for bar_name in INFORMATION_BARS:
+		seconds, bars_df = measure(dataset['repeats'], u.aggregate_ohlcv, df, bar_name, dataset['symbol'])
+		results[f'information_bars.{bar_name}'] = {'seconds': seconds, 'ticks': df.height, 'bars': bars_df.height}
+
+	return results
+
+
+def write_replay_sources(dataset):
+
+	df                   = u.read_and_concat_dataframes(dataset['file_paths']['parquet'], dataset['symbol'], 'parquet', fixed_point=True, native_datetime=True)
+	min_date, max_date   = u.get_interval_info(df)
+	run_name             = f'{dataset["symbol"]}.{min_date}_1_{max_date}'.replace('-', '')
+	parquet_file_path    = os.path.join(dataset['work_directory_path'], 'replay_parquet', run_name, f'{run_name}.parquet')
+	os.makedirs(os.path.dirname(parquet_file_path), exist_ok=True)
+	df.write_parquet(parquet_file_path)
+
+	archive_writer = ta.open_archive_writer(os.path.join(dataset['work_directory_path'], 'replay_archive', dataset['symbol']), dataset['symbol'], ta.get_price_tick(df.get_column('price').to_numpy()))
+	ta.write_archive_ticks(archive_writer, df)
+	ta.close_archive_writer(archive_writer)
+
+	return {
+		'parquet' : os.path.join(dataset['work_directory_path'], 'replay_parquet'),
+		'archive' : os.path.join(dataset['work_directory_path'], 'replay_archive'),
+	}
+
+
+def consume_replay(symbol, base_path):
+
+	# Summing a column makes lazily mapped pages count towards the replay
+	tick_count, volume = 0, 0
+	for batch in tr.replay_ticks([symbol], base_paths=base_path):
+		tick_count += len(batch['timestamp'])
+		volume     += int(batch['size'].sum())
+
+	return tick_count
+
+
+def benchmark_replay_ticks(dataset):
+
+	results = {}
+	for source, base_path in write_replay_sources(dataset).items():
+		seconds, tick_count = measure(dataset['repeats'], consume_replay, dataset['symbol'], base_path)
+		results[f'replay_ticks.{source}'] = {'seconds': seconds, 'ticks': tick_count}
+
+	return results
+
+
+def build_replay_bars(symbol, base_path):
+
+	return bb.build_bars(tr.replay_ticks([symbol], base_paths=base_path))
+
+
+def benchmark_bar_builder(dataset):
+
+	base_path         = write_replay_sources(dataset)['archive']
+	seconds, bars_dfs = measure(dataset['repeats'], build_replay_bars, dataset['symbol'], base_path)
+
+	return {'bar_builder': {'seconds': seconds, 'ticks': dataset['tick_count'], 'bars': sum(bars_df.height for bars_df in bars_dfs.values())}}
+
+
+def get_database_bar_count(db_conn):
+
+	return sum(
+		db_conn.execute(f'SELECT count(*) FROM aggr_{timeframe}').fetchone()[0]
+		for timeframe in DATABASE_TIMEFRAMES
+		if timeframe != 'tick'
+	)
+
+
+def ingest_database(database_file_path, file_paths, symbol, engine):
+
+	if os.path.exists(database_file_path):
+		os.remove(database_file_path)
+
+	db_conn = u.connect_duckdb(database_file_path)
+	adb.create_tables(db_conn, DATABASE_TIMEFRAMES)
+	adb.create_ledger_table(db_conn)
+	if engine == 'sql':
+		adb.ingest_files(db_conn, file_paths, 'parquet', symbol, DATABASE_TIMEFRAMES, adb.aggregate_with_duckdb)
+	else:
+		for file_path in file_paths:
+			adb.ingest_files(db_conn, [file_path], 'parquet', symbol, DATABASE_TIMEFRAMES, adb.aggregate_with_polars)
+	bar_count = get_database_bar_count(db_conn)
+	db_conn.close()
+
+	return bar_count
+
+
+def benchmark_database_ingest(dataset, engine):
+
+	database_file_path = os.path.join(dataset['work_directory_path'], f'ingest_{engine}.duckdb')
+	seconds, bar_count = measure(dataset['repeats'], ingest_database, database_file_path, dataset['file_paths']['parquet'], dataset['symbol'], engine)
+
+	return {f'database_ingest.{engine}': {'seconds': seconds, 'ticks': dataset['tick_count'], 'bars': bar_count}}
+
+
+def export_database(database_file_path, output_directory_path, table_names_to_query):
+
+	if os.path.exists(output_directory_path):
+		shutil.rmtree(output_directory_path)
+
+	cdf.export_database(database_file_path, 'benchmark', table_names_to_query, {'csv': True, 'parquet': True}, {'_': output_directory_path}, 'file')
+
+
+def benchmark_convert_duckdb_to_files(dataset):
+
+	database_file_path = os.path.join(dataset['work_directory_path'], 'export.duckdb')
+	bar_count          = ingest_database(database_file_path, dataset['file_paths']['parquet'], dataset['symbol'], 'sql')
+	seconds, _         = measure(
+		dataset['repeats'],
+		export_database,
+		database_file_path,
+		os.path.join(dataset['work_directory_path'], 'export'),
+		cdf.get_table_names_to_query(DATABASE_TIMEFRAMES),
+	)
+
+	return {'convert_duckdb_to_files': {'seconds': seconds, 'ticks': dataset['tick_count'], 'bars': bar_count}}
+
+
+BENCHMARKS = {
+	'read_csv'                : (benchmark_read_and_concat_dataframes, ('csv',)),
+	'read_parquet'            : (benchmark_read_and_concat_dataframes, ('parquet',)),
+	'interval_info'           : (benchmark_get_interval_info, ()),
+	'aggregate_ohlcv'         : (benchmark_aggregate_ohlcv, ()),
+	'information_bars'        : (benchmark_aggregate_information_bars, ()),
+	'replay_ticks'            : (benchmark_replay_ticks, ()),
+	'bar_builder'             : (benchmark_bar_builder, ()),
+	'database_ingest_polars'  : (benchmark_database_ingest, ('polars',)),
+	'database_ingest_sql'     : (benchmark_database_ingest, ('sql',)),
+	'convert_duckdb_to_files' : (benchmark_convert_duckdb_to_files, ()),
+}
+
+
+def run_isolated_benchmark(function, args):
+
+	# Runs in a fresh process, so peak RSS belongs to this benchmark alone
+	process  = psutil.Process()
+	peak_rss = [process.memory_info().rss]
+	stopped  = threading.Event()
+
+	def sample_rss():
+		while not stopped.wait(RSS_SAMPLE_INTERVAL):
+			peak_rss[0] = max(peak_rss[0], process.memory_info().rss)
+
+	sampler = threading.Thread(target=sample_rss, daemon=True)
+	sampler.start()
+	try:
+		results, _, _ = u.run_captured_work_unit(function, args)
+	finally:
+		stopped.set()
+		sampler.join()
+
+	peak_rss_bytes = max(peak_rss[0], process.memory_info().rss)
+	for result in results.values():
+		result['peak_rss_bytes']   = peak_rss_bytes
+		result['ticks_per_second'] = result['ticks'] / result['seconds'] if result['seconds'] else None
+		if 'bars' in result:
+			result['bars_per_second'] = result['bars'] / result['seconds'] if result['seconds'] else None
+
+	return results
+
+
+def run_benchmarks(dataset, benchmark_names):
+
+	results = {}
+	context = multiprocessing.get_context('spawn')
+	for idx, benchmark_name in enumerate(benchmark_names, start=1):
+		print(f'[{idx}/{len(benchmark_names)}] Running {benchmark_name}', flush=True)
+		function, args = BENCHMARKS[benchmark_name]
+		with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+			results.update(executor.submit(run_isolated_benchmark, function, (dataset, *args)).result())
+
+	return results
+
+
+def format_rate(value):
+
+	return f'{value:>14,.0f}' if value is not None else f'{"-":>14}'
+
+
+def print_results(results, baseline_results):
+
+	print(f'\n{"benchmark":<36} {"seconds":>10} {"ticks/s":>14} {"bars/s":>14} {"peak RSS MB":>12} {"vs baseline":>12}')
+	for name, result in results.items():
+		baseline_result = baseline_results.get(name)
+		change          = f'{result["seconds"] / baseline_result["seconds"] - 1:>+12.1%}' if baseline_result and baseline_result['seconds'] else f'{"-":>12}'
+		print(
+			f'{name:<36} {result["seconds"]:>10.4f} {format_rate(result["ticks_per_second"])} {format_rate(result.get("bars_per_second"))}'
+			f' {result["peak_rss_bytes"] / 1024 / 1024:>12.1f} {change}'
+		)
+
+
+def find_regressions(results, baseline_results, tolerance):
+
+	regressions = []
+	for name, result in results.items():
+		baseline_result = baseline_results.get(name)
+		if not baseline_result:
+			continue
+		for metric in ['seconds', 'peak_rss_bytes']:
+			if baseline_result[metric] and result[metric] > baseline_result[metric] * (1 + tolerance):
+				regressions.append(f'{name}: {metric} {baseline_result[metric]:.4g} -> {result[metric]:.4g}')
+
+	return regressions
+
+
+def main():
+
+	parser = argparse.ArgumentParser(description='ByBit pipeline benchmarks on synthetic trade data')
+	parser.add_argument('-s', '--symbol',
+		type    = str,
+		default = g.DEFAULT_SYMBOLS[0],
+		help    = 'Symbol of the generated data',
+	)
+	parser.add_argument('-d', '--days',
+		type    = int,
+		default = g.DEFAULT_DAYS,
+		help    = 'Number of generated days',
+	)
+	parser.add_argument('-n', '--ticks_per_day',
+		type    = int,
+		default = g.DEFAULT_TICKS_PER_DAY,
+		help    = 'Number of generated trades per day',
+	)
+	parser.add_argument('-r', '--repeats',
+		type    = int,
+		default = DEFAULT_REPEATS,
+		help    = 'Number of timed repeats, the fastest one is reported',
+	)
+	parser.add_argument('-k', '--benchmarks',
+		nargs   = '+',
+		default = list(BENCHMARKS.keys()),
+		choices = list(BENCHMARKS.keys()),
+		help    = 'Benchmarks to run',
+	)
+	parser.add_argument('-w', '--work_directory_path',
+		type    = str,
+		help    = 'Directory of the generated data and outputs (default: a temporary directory)',
+	)
+	parser.add_argument('-o', '--output_file_path',
+		type    = str,
+		help    = 'Write the results as JSON, e.g. to save a new baseline',
+	)
+	parser.add_argument('-c', '--baseline_file_path',
+		type    = str,
+		help    = 'Compare against a saved baseline and fail on regressions',
+	)
+	parser.add_argument('-t', '--tolerance',
+		type    = float,
+		default = DEFAULT_TOLERANCE,
+		help    = 'Allowed relative slowdown or RSS growth against the baseline',
+	)
+	parser.add_argument('--seed',
+		type    = int,
+		default = g.DEFAULT_SEED,
+		help    = 'Seed of the generator',
+	)
+	args = parser.parse_args()
+
+	settings = {
+		'symbol'        : args.symbol,
+		'days'          : args.days,
+		'ticks_per_day' : args.ticks_per_day,
+		'repeats'       : args.repeats,
+		'seed'          : args.seed,
+	}
+
+	with tempfile.TemporaryDirectory() as temporary_directory_path:
+		work_directory_path = args.work_directory_path or temporary_directory_path
+		tick_directory_path = os.path.join(work_directory_path, 'ticks')
+		print(f'Generating {args.days} days of {args.ticks_per_day} ticks into {tick_directory_path}', flush=True)
+		file_paths = g.generate_tick_files(
+			[args.symbol], g.valid_date(g.DEFAULT_DATE_BEGIN), args.days, args.ticks_per_day, ['csv', 'parquet'],
+			{'csv': tick_directory_path, 'parquet': tick_directory_path}, args.seed,
+		)
+		dataset = {
+			'symbol'              : args.symbol,
+			'file_paths'          : file_paths,
+			'tick_count'          : args.days * args.ticks_per_day,
+			'repeats'             : args.repeats,
+			'work_directory_path' : work_directory_path,
+		}
+		results = run_benchmarks(dataset, args.benchmarks)
+
+	baseline = u.read_json_file(args.baseline_file_path, default={}) if args.baseline_file_path else {}
+	if baseline and baseline.get('settings') != settings:
+		print(f'\nBaseline was recorded with other settings: {baseline.get("settings")}')
+	print_results(results, baseline.get('results', {}))
+
+	if args.output_file_path:
+		u.write_json_file(args.output_file_path, {'settings': settings, 'date': date.today().isoformat(), 'results': results})
+		print(f'\nResults written : {args.output_file_path}')
+
+	if regressions := find_regressions(results, baseline.get('results', {}), args.tolerance):
+		print(f'\nRegressions over {args.tolerance:.0%}:')
+		for regression in regressions:
+			print(f'\t{regression}')
+		exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -18,12 +18,55 @@ import data_config as dc
 import file_utils as fu
 import arg_utils as au
 import errors as e
+import aggregation_cache as ac
+import instrumentation as i
 import utils as u
 
 
 ALLOWED_TIMEFRAMES  = ['tick'] + dc.OHLCV_TIMEFRAMES
 
 
+def read_ticks(process_detail):
+
+	with i.stage('read', format=process_detail['input_format']) as record:
+		ticks_df = u.scan_polars_dataframe(process_detail['input_files'], process_detail['input_format']).collect()
+		record.update(rows_out=ticks_df.height, bytes_read=i.get_file_size(process_detail['input_files']))
+
+	return ticks_df
+
+
+def process_directory(process_detail, timeframes, layout, cache):
+
+	inputs_key   = cache.get_inputs_key(process_detail['input_files'], process_detail['symbol'], input_format=process_detail['input_format'])
+	aggregations = cache.aggregate_ohlcv_timeframes(inputs_key, lambda: read_ticks(process_detail), [tf for tf in timeframes if tf != 'tick'], process_detail['symbol'])
+	for aggr_timeframe, aggr_df in aggregations.items():
+
+		print(f'\tDimensions of {aggr_timeframe:>4}: {aggr_df.shape}')
+
+		if layout == 'hive':
+			file_paths = u.write_hive_partitions(aggr_df, process_detail['outbase_path'], process_detail['symbol'], aggr_timeframe, process_detail['output_format'])
+			print(f'\tFiles written {aggr_timeframe:>4}: {len(file_paths)} {process_detail["output_format"]} partitions in {process_detail["outbase_path"]}')
+			continue
+
+		fu.create_local_folder(process_detail['outdir_path'])
+
+		file_name_base = os.path.join(process_detail['outdir_path'], f'{process_detail["subdir_name"]}.{aggr_timeframe}')
+
+		if 'csv' == process_detail['output_format']:
+			file_name = f'{file_name_base}.csv'
+			with i.stage('write', timeframe=aggr_timeframe, format='csv') as record:
+				u.format_output_columns(aggr_df).write_csv(file_name)
+				record.update(rows_in=aggr_df.height, bytes_written=i.get_file_size(file_name))
+			print(f'\tFile written  {aggr_timeframe:>4}: {file_name}')
+
+		if 'parquet' == process_detail['output_format']:
+			file_name = f'{file_name_base}.parquet'
+			with i.stage('write', timeframe=aggr_timeframe, format='parquet') as record:
+				aggr_df.write_parquet(file_name)
+				record.update(rows_in=aggr_df.height, bytes_written=i.get_file_size(file_name))
+			print(f'\tFile written  {aggr_timeframe:>4}: {file_name}')
+
+
 def main():
 
 	parser = argparse.ArgumentParser(description='ByBit preprocessed tick data to OHLCV data aggregator')
@@ -36,7 +79,7 @@ def main():
 	parser.add_argument('-t', '--timeframes',
 		nargs    = '+',
 		type     = str,
-		help     = f'TimeFrames: {ALLOWED_TIMEFRAMES}',
+		help     = f'TimeFrames: {ALLOWED_TIMEFRAMES}, or information bars <type>_<threshold> of the types {u.INFORMATION_BAR_TYPES}',
         default  = ALLOWED_TIMEFRAMES,
 	)
 	parser.add_argument('-i', '--input_directory_path',
@@ -59,9 +102,23 @@ def main():
 		type    = au.supported_file_formats,
 		help    = f'Export output as any of the supported formats: {au.ALLOWED_FORMATS}'
 	)
+	parser.add_argument('-w', '--workers',
+		type    = int,
+		default = 1,
+		help    = 'Number of worker processes'
+	)
+	parser.add_argument('-l', '--layout',
+		default = 'file',
+		choices = u.OUTPUT_LAYOUTS,
+		help    = 'Write one file per timeframe, or symbol=/timeframe=/date=/part.<format> partitions overwriting whole days'
+	)
+
+	ac.add_arguments(parser)
+	i.add_arguments(parser)
 
 	args                                = parser.parse_args()
-	timeframes                          = au.handle_timeframe_args(args, ALLOWED_TIMEFRAMES)
+	i.configure(args, 'aggregate_preprocessed_tick_to_ohlcv')
+	timeframes                          = au.handle_timeframe_args(args, ALLOWED_TIMEFRAMES + [tf for tf in args.timeframes if u.is_information_bar(tf)])
 	input_formats                       = au.handle_formats_args(args.formats, 'parquet')
 	output_formats                      = au.handle_formats_args(args.exports, 'parquet')
 	import_args, input_directory_paths  = au.handle_input_args(
@@ -83,6 +140,20 @@ def main():
 	for symbol, input_format in itertools.product(args.symbols, input_formats):
 
 		input_directory      = input_directory_paths.get(input_format, input_directory_paths.get('_'))
+		hive_input_files     = u.locate_hive_partitions(input_directory, symbol, 'tick', input_format)
+		if hive_input_files:
+			for output_format in output_formats:
+				process_details.append({
+					'input_format' : input_format,
+					'output_format': output_format,
+					'symbol'       : symbol,
+					'subdir_name'  : f'symbol={symbol}',
+					'indir_path'   : os.path.join(input_directory, f'symbol={symbol}'),
+					'outdir_path'  : os.path.join(output_directory_path[output_format], f'symbol={symbol}'),
+					'outbase_path' : output_directory_path[output_format],
+					'input_files'  : hive_input_files,
+				})
+
 		matching_directories = fu.list_subdirectories_with_matching_prefix(input_directory, f'{symbol}.')
 		for symbol_interval_input_subdirectory_path in matching_directories:
 
@@ -91,6 +162,8 @@ def main():
 				symbol_interval                          = os.path.basename(os.path.dirname(symbol_interval_input_subdirectory_path))
 				symbol_interval_output_subdirectory_path = os.path.join(output_directory_path[output_format], symbol_interval)
 				input_files                              = fu.read_file_paths_by_extension(symbol_interval_input_subdirectory_path, f'{symbol_interval}.{input_format}')
+				if not input_files:
+					input_files = fu.read_file_paths_by_extension(symbol_interval_input_subdirectory_path, f'{symbol}.*.{input_format}')
 
 				process_details.append({
 					'input_format' : input_format,
@@ -99,35 +172,27 @@ def main():
 					'subdir_name'  : symbol_interval,
 					'indir_path'   : symbol_interval_input_subdirectory_path,
 					'outdir_path'  : symbol_interval_output_subdirectory_path,
-					'input_file'   : input_files[0] if len(input_files) == 1 else None,
+					'outbase_path' : output_directory_path[output_format],
+					'input_files'  : input_files,
 				})
 
-	for process_idx, process_detail in enumerate(process_details, start=1):
+	cache      = ac.from_arguments(args)
+	work_units = []
+	for process_detail in process_details:
 
-		print(f'\n[{process_idx}/{len(process_details)}] Processing to {process_detail["output_format"]}: {process_detail["indir_path"]}')
-		if process_detail["input_file"] is None:
+		if not process_detail["input_files"]:
 			print(f'No input file was found for {process_detail["indir_path"]}')
 			continue
 
-		fu.create_local_folder(process_detail['outdir_path'])
-
-		ticks_df = u.read_polars_dataframe(process_detail['input_file'], process_detail['input_file'].split('.')[-1])
-		for aggr_timeframe in [tf for tf in timeframes if tf != 'tick']:
+		work_units.append({
+			'label'    : f'Processing to {process_detail["output_format"]}: {process_detail["indir_path"]}',
+			'weight'   : sum(os.path.getsize(input_file) for input_file in process_detail['input_files']),
+			'function' : process_directory,
+			'args'     : (process_detail, timeframes, args.layout, cache),
+		})
 
-			aggr_df = u.aggregate_ohlcv(ticks_df, aggr_timeframe, symbol)
-			print(f'\tDimensions of {aggr_timeframe:>4}: {aggr_df.shape}')
-
-			file_name_base = os.path.join(process_detail['outdir_path'], f'{process_detail["subdir_name"]}.{aggr_timeframe}')
-
-			if 'csv' == process_detail['output_format']:
-				file_name = f'{file_name_base}.csv'
-				aggr_df.write_csv(file_name)
-				print(f'\tFile written  {aggr_timeframe:>4}: {file_name}')
-
-			if 'parquet' == process_detail['output_format']:
-				file_name = f'{file_name_base}.parquet'
-				aggr_df.write_parquet(file_name)
-				print(f'\tFile written  {aggr_timeframe:>4}: {file_name}')
+	for work_unit, result in u.run_work_units(work_units, args.workers):
+		pass
 
 
 if __name__ == "__main__":
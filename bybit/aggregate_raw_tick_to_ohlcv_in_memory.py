@@ -3,7 +3,9 @@
 
 import os
 import sys
+import shutil
 import argparse
+import itertools
 import polars as pl
 from decimal import Decimal
 
@@ -17,11 +19,190 @@ import data_config as dc
 import file_utils as fu
 import arg_utils as au
 import errors as e
+import aggregation_cache as ac
+import catalog as c
+import instrumentation as i
 import utils as u
 
 
 ALLOWED_TIMEFRAMES  = ['tick'] + dc.OHLCV_TIMEFRAMES
 
+STREAMING_DIRECTORY_SUFFIX = 'streaming'
+
+
+def get_tick_loader(symbol, input_files, input_format, fixed_point, native_datetime):
+
+	# Ticks are read on first use only, so runs served from the cache never touch them
+	ticks = {}
+	def load_ticks():
+		if 'df' not in ticks:
+			ticks['df'] = u.read_and_concat_dataframes(input_files, symbol, input_format, fixed_point, native_datetime)
+			print(f'\tDimensions of tick: {ticks["df"].shape}')
+		return ticks['df']
+
+	return load_ticks
+
+
+def process_symbol(symbol, input_entries, input_format, timeframes, exports, output_directory_path, fixed_point, native_datetime, layout, cache):
+
+	input_files        = [input_entry['file_path'] for input_entry in input_entries]
+	load_ticks         = get_tick_loader(symbol, input_files, input_format, fixed_point, native_datetime)
+	inputs_key         = cache.get_inputs_key(input_files, symbol, input_format=input_format, fixed_point=fixed_point, native_datetime=native_datetime)
+	min_date, max_date = c.get_interval_info(input_entries)
+	date_info          = f'{min_date}_{len(input_files)}_{max_date}'.replace('-', '')
+
+	results = []
+	if 'tick' in timeframes:
+		results.append({
+			'timeframe' : 'tick',
+			'dataframe' : load_ticks(),
+			'file_name' : f'{symbol}.{date_info}.tick',
+		})
+	aggregations = cache.aggregate_ohlcv_timeframes(inputs_key, load_ticks, [tf for tf in timeframes if tf != 'tick'], symbol)
+	for aggr_timeframe, aggr_df in aggregations.items():
+		aggregation = {
+			'timeframe' : aggr_timeframe,
+			'dataframe' : aggr_df,
+			'file_name' : f'{symbol}.{date_info}.{aggr_timeframe}',
+		}
+		print(f'\tDimensions of {aggr_timeframe:>4}: {aggregation["dataframe"].shape}')
+		results.append(aggregation)
+
+	if layout == 'hive':
+		for export_format, result in itertools.product(exports, results):
+			file_paths = u.write_hive_partitions(result['dataframe'], output_directory_path[export_format], symbol, result['timeframe'], export_format)
+			print(f'\tFiles written {result["timeframe"]:>4}: {len(file_paths)} {export_format} partitions in {output_directory_path[export_format]}')
+		return
+
+	if 'csv' in exports:
+		csv_directory_path = os.path.join(output_directory_path['csv'], f'{symbol}.{date_info}')
+		fu.create_local_folder(csv_directory_path)
+		for result in results:
+			file_name = f"{result['file_name']}.csv"
+			file_path = os.path.join(csv_directory_path, file_name)
+			with i.stage('write', timeframe=result['timeframe'], format='csv') as record:
+				u.format_output_columns(result['dataframe']).write_csv(file_path)
+				record.update(rows_in=result['dataframe'].height, bytes_written=i.get_file_size(file_path))
+			print(f'\tFile written  {result["timeframe"]:>4}: {file_path}')
+
+	if 'parquet' in exports:
+		parquet_directory_path = os.path.join(output_directory_path['parquet'], f'{symbol}.{date_info}')
+		fu.create_local_folder(parquet_directory_path)
+		for result in results:
+			file_name = f"{result['file_name']}.parquet"
+			file_path = os.path.join(parquet_directory_path, file_name)
+			with i.stage('write', timeframe=result['timeframe'], format='parquet') as record:
+				result['dataframe'].write_parquet(file_path)
+				record.update(rows_in=result['dataframe'].height, bytes_written=i.get_file_size(file_path))
+			print(f'\tFile written  {result["timeframe"]:>4}: {file_path}')
+
+
+def merge_pending_rows(pending_df, df, timeframe):
+
+	if pending_df is None or pending_df.is_empty():
+		return df
+
+	if timeframe == 'tick' or df.is_empty() or pending_df['datetime'][-1] != df['datetime'][0]:
+		return pl.concat([pending_df, df])
+
+	# A bar spanning the chunk edge was aggregated in both chunks, so both halves are combined
+	boundary_df = pl.concat([pending_df.tail(1), df.head(1)]).select([
+		pl.col('datetime').first(),
+		pl.col('open').first(),
+		pl.col('high').max(),
+		pl.col('low').min(),
+		pl.col('close').last(),
+		pl.col('volume').sum(),
+	])
+
+	return pl.concat([pending_df.head(-1), boundary_df, df.slice(1)])
+
+
+def split_completed_rows(df):
+
+	# Rows of the last day may still grow with the next chunk, so they are held back
+	date      = pl.col('datetime').cast(pl.Utf8).str.slice(0, 10)
+	last_date = df.select(date.last()).item()
+
+	return df.filter(date < last_date), df.filter(date == last_date)
+
+
+def format_streaming_rows(df, fixed_point, native_datetime):
+
+	if not fixed_point:
+		df = u.format_fixed_point_columns(df)
+	if not native_datetime:
+		df = u.format_datetime_columns(df)
+
+	return df
+
+
+def write_streaming_rows(df, symbol, timeframe, exports, output_directory_path, layout, frame_writers):
+
+	if df.is_empty():
+		return
+
+	for export_format in exports:
+		if layout == 'hive':
+			u.write_hive_partitions(df, output_directory_path[export_format], symbol, timeframe, export_format)
+			continue
+
+		if (timeframe, export_format) not in frame_writers:
+			streaming_directory_path = os.path.join(output_directory_path[export_format], f'{symbol}.{STREAMING_DIRECTORY_SUFFIX}')
+			fu.create_local_folder(streaming_directory_path)
+			frame_writers[(timeframe, export_format)] = u.open_frame_writer(
+				os.path.join(streaming_directory_path, f'{symbol}.{timeframe}.{export_format}'),
+				export_format,
+				timeframe = timeframe,
+			)
+		u.write_frame_rows(frame_writers[(timeframe, export_format)], df)
+
+
+def process_symbol_streaming(symbol, input_entries, input_format, timeframes, exports, output_directory_path, fixed_point, native_datetime, layout, cache):
+
+	pending_dfs   = dict.fromkeys(timeframes)
+	frame_writers = {}
+	dates         = []
+	for input_entry in sorted(input_entries, key=lambda input_entry: input_entry['file_path']):
+		input_file = input_entry['file_path']
+		if input_entry['min_timestamp'] is None:
+			continue
+		dates.extend(c.get_interval_info([input_entry]))
+
+		load_ticks = get_tick_loader(symbol, [input_file], input_format, fixed_point, native_datetime)
+		inputs_key = cache.get_inputs_key([input_file], symbol, input_format=input_format, fixed_point=fixed_point, native_datetime=native_datetime, native_ticks=True)
+
+		chunk_dfs = {'tick': load_ticks()} if 'tick' in timeframes else {}
+		chunk_dfs.update(cache.aggregate_ohlcv_timeframes(inputs_key, lambda: u.to_native_ticks(load_ticks()).collect(), [tf for tf in timeframes if tf != 'tick'], symbol))
+		for timeframe, chunk_df in chunk_dfs.items():
+			completed_df, pending_dfs[timeframe] = split_completed_rows(merge_pending_rows(pending_dfs[timeframe], chunk_df, timeframe))
+			completed_df = format_streaming_rows(completed_df, fixed_point, native_datetime)
+			write_streaming_rows(completed_df, symbol, timeframe, exports, output_directory_path, layout, frame_writers)
+		print(f'\tChunk processed: {input_file}')
+
+	if not dates:
+		print(f'\tNo ticks of {symbol}')
+		return
+
+	for timeframe, pending_df in pending_dfs.items():
+		pending_df = format_streaming_rows(pending_df, fixed_point, native_datetime)
+		write_streaming_rows(pending_df, symbol, timeframe, exports, output_directory_path, layout, frame_writers)
+	if layout == 'hive':
+		for export_format in exports:
+			print(f'\tPartitions written: {export_format} partitions in {output_directory_path[export_format]}')
+		return
+
+	# The run is named after the date range of all its chunks, like the non-streaming run
+	date_info = f'{min(dates)}_{len(input_entries)}_{max(dates)}'.replace('-', '')
+	for (timeframe, export_format), frame_writer in frame_writers.items():
+		output_directory = os.path.join(output_directory_path[export_format], f'{symbol}.{date_info}')
+		file_path        = os.path.join(output_directory, f'{symbol}.{date_info}.{timeframe}.{export_format}')
+		fu.create_local_folder(output_directory)
+		os.replace(u.close_frame_writer(frame_writer), file_path)
+		print(f'\tFile written  {timeframe:>4}: {file_path} ({frame_writer["rows"]} rows)')
+	for streaming_directory_path in {os.path.join(output_directory_path[export_format], f'{symbol}.{STREAMING_DIRECTORY_SUFFIX}') for export_format in exports}:
+		shutil.rmtree(streaming_directory_path)
+
 
 def main():
 
@@ -35,7 +216,7 @@ def main():
 	parser.add_argument('-t', '--timeframes',
 		nargs    = '+',
 		type     = str,
-		help     = f'TimeFrames: {ALLOWED_TIMEFRAMES}',
+		help     = f'TimeFrames: {ALLOWED_TIMEFRAMES}, or information bars <type>_<threshold> of the types {u.INFORMATION_BAR_TYPES}',
         default  = ALLOWED_TIMEFRAMES,
 	)
 
@@ -59,7 +240,32 @@ def main():
 		type    = str,
 		help    = 'Output OHLCV directory path'
 	)
+	parser.add_argument('-q', '--fixed_point',
+		action  = 'store_true',
+		help    = 'Keep prices, sizes and volumes as scaled integers (formatted only in CSV exports)'
+	)
+	parser.add_argument('-d', '--native_datetime',
+		action  = 'store_true',
+		help    = 'Keep datetime as a native temporal column (formatted only in CSV exports)'
+	)
+	parser.add_argument('-w', '--workers',
+		type    = int,
+		default = 1,
+		help    = 'Number of worker processes'
+	)
+	parser.add_argument('-l', '--layout',
+		default = 'file',
+		choices = u.OUTPUT_LAYOUTS,
+		help    = 'Write one file per timeframe, or symbol=/timeframe=/date=/part.<format> partitions overwriting whole days'
+	)
+	parser.add_argument('-m', '--streaming',
+		action  = 'store_true',
+		help    = 'Process one input file at a time and append outputs as they are produced, keeping memory flat'
+	)
+	ac.add_arguments(parser)
+	i.add_arguments(parser)
 	args = parser.parse_args()
+	i.configure(args, 'aggregate_raw_tick_to_ohlcv_in_memory')
 	import_args, input_directory_path   = au.handle_input_args(
 		args,
 		repo_root_directory    = REPO_ROOT_DIRECTORY_PATH,
@@ -75,14 +281,19 @@ def main():
 		base_directory_parquet = dc.DIRECTORY_NAME__AGGR_PARQUET,
 	)
 
-	bad_timeframes = [tf for tf in args.timeframes if tf not in ALLOWED_TIMEFRAMES]
+	bad_timeframes = [tf for tf in args.timeframes if tf not in ALLOWED_TIMEFRAMES and not u.is_information_bar(tf)]
 	if bad_timeframes:
 		print(f'TimeFrames not supported: {bad_timeframes}')
 		return
 
+	# Information bars run over the whole tick sequence, so they cannot be restarted per chunk
+	if args.streaming and any(u.is_information_bar(tf) for tf in args.timeframes):
+		print(f'Information bars are not supported in streaming mode: {[tf for tf in args.timeframes if u.is_information_bar(tf)]}')
+		return
+
 	if not args.timeframes:
 		timeframes = ALLOWED_TIMEFRAMES
-	timeframes     = [tf for tf in args.timeframes if tf in ALLOWED_TIMEFRAMES]
+	timeframes     = [tf for tf in args.timeframes if tf in ALLOWED_TIMEFRAMES or u.is_information_bar(tf)]
 
 	if not args.exports:
 		exports = au.ALLOWED_FORMATS
@@ -93,54 +304,24 @@ def main():
 		print(f'Missing input directory: {input_directory_path[input_format]}')
 		return
 
-	for symbol_idx, symbol in enumerate(args.symbols):
-
-		symbol_dir_path = os.path.join(input_directory_path[input_format], symbol)
-		print(f'[{symbol_idx+1}/{len(args.symbols)}] Processing {symbol_dir_path}')
+	cache      = ac.from_arguments(args)
+	work_units = []
+	for symbol in args.symbols:
 
 		input_folder_path = os.path.join(input_directory_path[input_format], symbol)
-		input_files       = fu.read_file_paths_by_extension(input_folder_path, f'*.{input_format}')
-		if len(input_files) == 0:
+		input_entries     = c.locate_files(input_folder_path, input_format)
+		if len(input_entries) == 0:
 			continue
 
-		df_tick            = u.read_and_concat_dataframes(input_files, symbol, input_format)
-		min_date, max_date = u.get_interval_info(df_tick)
-		date_info          = f'{min_date}_{len(input_files)}_{max_date}'.replace('-', '')
-		print(f'\tDimensions of tick: {df_tick.shape}')
-
-		results = []
-		if 'tick' in timeframes:
-			results.append({
-				'timeframe' : 'tick',
-				'dataframe' : df_tick,
-				'file_name' : f'{symbol}.{date_info}.tick',
-			})
-		for aggr_timeframe in [tf for tf in timeframes if tf != 'tick']:
-			aggregation = {
-				'timeframe' : aggr_timeframe,
-				'dataframe' : u.aggregate_ohlcv(df_tick, aggr_timeframe, symbol),
-				'file_name' : f'{symbol}.{date_info}.{aggr_timeframe}',
-			}
-			print(f'\tDimensions of {aggr_timeframe:>4}: {aggregation["dataframe"].shape}')
-			results.append(aggregation)
-
-		if 'csv' in exports:
-			csv_directory_path = os.path.join(output_directory_path['csv'], f'{symbol}.{date_info}')
-			fu.create_local_folder(csv_directory_path)
-			for result in results:
-				file_name = f"{result['file_name']}.csv"
-				file_path = os.path.join(csv_directory_path, file_name)
-				result['dataframe'].write_csv(file_path)
-				print(f'\tFile written  {result["timeframe"]:>4}: {file_path}')
-
-		if 'parquet' in exports:
-			parquet_directory_path = os.path.join(output_directory_path['parquet'], f'{symbol}.{date_info}')
-			fu.create_local_folder(parquet_directory_path)
-			for result in results:
-				file_name = f"{result['file_name']}.parquet"
-				file_path = os.path.join(parquet_directory_path, file_name)
-				result['dataframe'].write_parquet(file_path)
-				print(f'\tFile written  {result["timeframe"]:>4}: {file_path}')
+		work_units.append({
+			'label'    : f'Processing {input_folder_path}',
+			'weight'   : sum(input_entry['size'] for input_entry in input_entries),
+			'function' : process_symbol_streaming if args.streaming else process_symbol,
+			'args'     : (symbol, input_entries, input_format, timeframes, exports, output_directory_path, args.fixed_point, args.native_datetime, args.layout, cache),
+		})
+
+	for work_unit, result in u.run_work_units(work_units, args.workers):
+		pass
 
 
 if __name__ == '__main__':
@@ -3,11 +3,9 @@
 
 import os
 import sys
-import duckdb
+import glob
 import argparse
 import itertools
-import polars as pl
-from decimal import Decimal
 from datetime import datetime
 
 REPO_ROOT_DIRECTORY_PATH = os.path.commonpath([os.getcwd(), os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))])
@@ -21,11 +19,24 @@ import file_utils as fu
 import arg_utils as au
 import errors as e
 import domain as d
+import catalog as c
+import instrumentation as i
 import utils as u
 
 
 ALLOWED_TIMEFRAMES = set(['tick'] + [tf for tf in dc.OHLCV_TIMEFRAMES if d.timeframe_to_seconds(tf) <= 24*60*60])
 
+ALLOWED_ENGINES = ['polars', 'sql']
+
+LEDGER_TABLE_NAME = 'ingest_ledger'
+
+PRICE_TYPE  = f'DECIMAL(18, {u.PRICE_SCALE})'
+VOLUME_TYPE = f'DECIMAL(18, {u.VOLUME_SCALE})'
+SIDE_TYPE   = f"ENUM({', '.join(repr(side) for side in u.TICK_SIDES)})"
+
+TICK_COLUMNS  = ['datetime', 'price', 'size', 'side']
+OHLCV_COLUMNS = ['datetime', 'open', 'high', 'low', 'close', 'volume']
+
 
 OUTPUT_COLUMN_ORDER = [
 	'datetime',
@@ -46,40 +57,306 @@ def valid_date(s):
 
 def read_dataframe(file_path, file_format, symbol):
 
-	df = u.read_polars_dataframe(file_path, file_format)
-	df = df.drop(['trdMatchID', 'grossValue', 'homeNotional', 'foreignNotional'])
-	df = df.filter(pl.col('symbol') == symbol)
-	df = df.sort('timestamp')
-	df = df.with_columns([
-		(pl.col('timestamp').cast(pl.Decimal(None, 9)) * 1_000_000_000).cast(pl.Int64).cast(pl.Datetime('ns')).cast(pl.Utf8).map_elements(lambda x: x[:-3], return_dtype=pl.Utf8).alias('datetime'),
-		pl.col('price').map_elements(lambda x: str(Decimal(x).quantize(Decimal(dc.PRICE_PRECISION))), return_dtype=pl.Utf8),
-		pl.col('timestamp').map_elements(lambda x: str(Decimal(x).quantize(Decimal(dc.TIMESTAMP_PRECISION))), return_dtype=pl.Utf8),
-	])
-	df  = df.select(OUTPUT_COLUMN_ORDER)
+	df = u.read_and_concat_dataframes([file_path], symbol, file_format, fixed_point=True, native_datetime=True)
+	df = df.select(OUTPUT_COLUMN_ORDER)
 
 	return df
 
 
-def get_ordered_files_from_date_interval(matching_files, interval_begin, interval_end):
+def create_tables(db_conn, timeframes):
+
+	if 'tick' in timeframes:
+		db_conn.execute(f"""
+			CREATE TABLE IF NOT EXISTS tick (
+				datetime TIMESTAMP NOT NULL,
+				price    {PRICE_TYPE},
+				size     {VOLUME_TYPE},
+				side     {SIDE_TYPE}
+			)
+		""")
+
+	for aggr_timeframe in [tf for tf in timeframes if tf != 'tick']:
+		db_conn.execute(f"""
+			CREATE TABLE IF NOT EXISTS aggr_{aggr_timeframe} (
+				datetime TIMESTAMP NOT NULL,
+				open     {PRICE_TYPE},
+				high     {PRICE_TYPE},
+				low      {PRICE_TYPE},
+				close    {PRICE_TYPE},
+				volume   {VOLUME_TYPE}
+			)
+		""")
+
+
+def from_fixed_point_sql(column, scale):
+
+	return f"CAST(CAST({column} AS DECIMAL(18, 0)) * CAST('{10 ** -scale:.{scale}f}' AS DECIMAL(18, {scale})) AS DECIMAL(18, {scale})) AS {column}"
+
+
+def replace_dates(db_conn, table_name, columns, source, dates):
+
+	# Rows are replaced by whole days of the ingested ticks instead of upserted by key, so tables need no index
+	# and stay in datetime order, which keeps the zone maps of their row groups selective. Days between them
+	# belong to other files and are kept, and bars of at most a day that open the day before are replaced one by one
+	with i.stage('write', table=table_name) as record:
+		if dates:
+			db_conn.execute(f"""
+				DELETE FROM {table_name}
+				WHERE datetime >= CAST(? AS TIMESTAMP) - INTERVAL 1 DAY AND datetime < CAST(? AS TIMESTAMP) + INTERVAL 1 DAY
+				AND (list_contains(?, CAST(datetime AS DATE)) OR datetime IN (SELECT datetime FROM {source}))
+			""", [min(dates), max(dates), dates])
+		record['rows_in'] = db_conn.execute(f"""
+			INSERT INTO {table_name} ({', '.join(columns)})
+			SELECT {', '.join(columns)}
+			FROM {source}
+			ORDER BY datetime
+		""").fetchone()[0]
+
+
+def get_duckdb_source(file_paths, file_format):
+
+	file_list = ', '.join(f"'{file_path}'" for file_path in file_paths)
+	if file_format == 'csv':
+		return f'read_csv([{file_list}], header = true, all_varchar = true, filename = true)'
+
+	elif file_format == 'parquet':
+		return f'read_parquet([{file_list}], filename = true)'
+
+	else:
+		raise NotImplementedError(f'Unknown format: {file_format}')
+
+
+def aggregate_with_duckdb(db_conn, file_paths, file_format, symbol, timeframes):
+
+	ohlcv_names = [tf for tf in timeframes if tf != 'tick']
+
+	# Ticks are loaded once into a temp table that the deletes, the tick insert and every bar level reuse,
+	# its rowid keeps the scan order, and epoch microseconds are rounded from doubles like the polars engine does
+	with i.stage('read', format=file_format) as record:
+		record['rows_in'] = db_conn.execute(f"""
+			CREATE OR REPLACE TEMP TABLE tick_source AS
+			SELECT
+				make_timestamp(CAST(round(CAST(timestamp AS DOUBLE) * 1000000) AS BIGINT)) AS datetime,
+				CAST(price AS DECIMAL(18, {u.PRICE_SCALE}))                                AS price,
+				CAST(side AS VARCHAR)                                                       AS side,
+				CAST(size AS DECIMAL(18, {u.VOLUME_SCALE}))                                 AS size,
+				filename                                                                    AS file_path
+			FROM {get_duckdb_source(file_paths, file_format)}
+			WHERE CAST(symbol AS VARCHAR) = '{symbol}'
+		""").fetchone()[0]
+
+	try:
+		dates = [row[0] for row in db_conn.execute('SELECT DISTINCT CAST(datetime AS DATE) FROM tick_source ORDER BY 1').fetchall()]
+		if 'tick' in timeframes:
+			replace_dates(db_conn, 'tick', TICK_COLUMNS, 'tick_source', dates)
+
+		for aggr_timeframe, rollup_source in u.get_rollup_sources(ohlcv_names).items():
+			# Trades share timestamps, so open and close are ordered by the scan position too, like the stable sort of the polars engine
+			bucket = f"time_bucket(INTERVAL {d.timeframe_to_seconds(aggr_timeframe)} SECOND, datetime, TIMESTAMP '1970-01-01')"
+			if rollup_source is None:
+				select = f"""
+					SELECT
+						{bucket}                                     AS datetime,
+						arg_min(price, struct_pack(datetime, rowid)) AS open,
+						max(price)                                   AS high,
+						min(price)                                   AS low,
+						arg_max(price, struct_pack(datetime, rowid)) AS close,
+						sum(size)                                    AS volume,
+						min(struct_pack(datetime, rowid))            AS open_key,
+						max(struct_pack(datetime, rowid))            AS close_key
+					FROM tick_source
+				"""
+			else:
+				select = f"""
+					SELECT
+						{bucket}                  AS datetime,
+						arg_min(open, open_key)   AS open,
+						max(high)                 AS high,
+						min(low)                  AS low,
+						arg_max(close, close_key) AS close,
+						sum(volume)               AS volume,
+						min(open_key)             AS open_key,
+						max(close_key)            AS close_key
+					FROM bars_{rollup_source}
+				"""
+			with i.stage('aggregate', timeframe=aggr_timeframe) as record:
+				record['rows_out'] = db_conn.execute(f"""
+					CREATE OR REPLACE TEMP TABLE bars_{aggr_timeframe} AS
+					{select}
+					GROUP BY 1
+					ORDER BY 1
+				""").fetchone()[0]
+			replace_dates(db_conn, f'aggr_{aggr_timeframe}', OHLCV_COLUMNS, f'bars_{aggr_timeframe}', dates)
+
+		row_counts = dict.fromkeys(file_paths, 0) | dict(db_conn.execute("""
+			SELECT file_path, count(*)
+			FROM tick_source
+			GROUP BY file_path
+		""").fetchall())
+
+	finally:
+		for aggr_timeframe in ohlcv_names:
+			db_conn.execute(f'DROP TABLE IF EXISTS bars_{aggr_timeframe}')
+		db_conn.execute('DROP TABLE IF EXISTS tick_source')
+
+	return row_counts
+
+
+def aggregate_with_polars(db_conn, file_paths, file_format, symbol, timeframes):
+
+	ohlcv_names = [tf for tf in timeframes if tf != 'tick']
+	row_counts  = {}
+	for file_path in file_paths:
+		ticks_df = read_dataframe(file_path, file_format, symbol)
+		aggregate_dataframe_with_polars(db_conn, ticks_df, symbol, timeframes, ohlcv_names)
+		row_counts[file_path] = ticks_df.height
+
+	return row_counts
+
+
+def aggregate_dataframe_with_polars(db_conn, ticks_df, symbol, timeframes, ohlcv_names):
+
+	dates = ticks_df['datetime'].dt.date().unique().sort().to_list()
+	if 'tick' in timeframes:
+		db_conn.register('ticks_df', ticks_df.to_arrow())
+		db_conn.execute(f"""
+			CREATE OR REPLACE TEMP VIEW tick_source AS
+			SELECT
+				datetime,
+				{from_fixed_point_sql('price', u.PRICE_SCALE)},
+				{from_fixed_point_sql('size', u.VOLUME_SCALE)},
+				CAST(side AS VARCHAR) AS side
+			FROM ticks_df
+		""")
+		replace_dates(db_conn, 'tick', TICK_COLUMNS, 'tick_source', dates)
+		db_conn.unregister('ticks_df')
+
+	aggregations = u.aggregate_ohlcv_timeframes(ticks_df, ohlcv_names, symbol)
+	for aggr_timeframe, aggr_df in aggregations.items():
+		db_conn.register('aggr_df', aggr_df.to_arrow())
+		db_conn.execute(f"""
+			CREATE OR REPLACE TEMP VIEW bars_source AS
+			SELECT
+				datetime,
+				{from_fixed_point_sql('open', u.PRICE_SCALE)},
+				{from_fixed_point_sql('high', u.PRICE_SCALE)},
+				{from_fixed_point_sql('low', u.PRICE_SCALE)},
+				{from_fixed_point_sql('close', u.PRICE_SCALE)},
+				{from_fixed_point_sql('volume', u.VOLUME_SCALE)}
+			FROM aggr_df
+		""")
+		replace_dates(db_conn, f'aggr_{aggr_timeframe}', OHLCV_COLUMNS, 'bars_source', dates)
+		db_conn.unregister('aggr_df')
+
+
+def create_ledger_table(db_conn):
+
+	db_conn.execute(f"""
+		CREATE TABLE IF NOT EXISTS {LEDGER_TABLE_NAME} (
+			file_name    VARCHAR,
+			file_path    VARCHAR,
+			size         BIGINT,
+			mtime_ns     BIGINT,
+			sha256       VARCHAR,
+			row_count    BIGINT,
+			timeframes   VARCHAR[],
+			committed_at TIMESTAMP
+		)
+	""")
+
+
+def read_ledger(db_conn):
+
+	cursor  = db_conn.execute(f'SELECT * FROM {LEDGER_TABLE_NAME}')
+	columns = [column[0] for column in cursor.description]
+
+	return {
+		ledger_entry['file_name'] : ledger_entry
+		for ledger_entry in [dict(zip(columns, row)) for row in cursor.fetchall()]
+	}
+
+
+def is_ledger_entry_current(ledger_entry, file_path, timeframes):
+
+	if not ledger_entry or not set(timeframes) <= set(ledger_entry['timeframes']):
+		return False
+
+	file_stat = u.get_file_stat(file_path)
+	if all(ledger_entry[key] == value for key, value in file_stat.items()):
+		return True
+
+	return ledger_entry['sha256'] == u.get_file_hash(file_path)
+
+
+def write_ledger_entries(db_conn, ledger, row_counts, timeframes):
+
+	for file_path, row_count in row_counts.items():
+		ledger_entry = ledger.get(os.path.basename(file_path))
+		file_stat    = u.get_file_stat(file_path)
+		# Entries are deleted and inserted again, since DuckDB cannot update a list column under an index
+		db_conn.execute(f'DELETE FROM {LEDGER_TABLE_NAME} WHERE file_name = ?', [os.path.basename(file_path)])
+		db_conn.execute(f"""
+			INSERT INTO {LEDGER_TABLE_NAME}
+			VALUES (?, ?, ?, ?, ?, ?, ?, CAST(now() AS TIMESTAMP))
+		""", [
+			os.path.basename(file_path),
+			os.path.abspath(file_path),
+			file_stat['size'],
+			file_stat['mtime_ns'],
+			u.get_file_hash(file_path),
+			row_count,
+			sorted(set(timeframes) | set(ledger_entry['timeframes'] if ledger_entry else [])),
+		])
+
+
+def ingest_files(db_conn, file_paths, file_format, symbol, timeframes, aggregate):
+
+	ledger = read_ledger(db_conn)
+	db_conn.execute('BEGIN TRANSACTION')
+	try:
+		with i.stage('ingest', format=file_format) as record:
+			row_counts = aggregate(db_conn, file_paths, file_format, symbol, timeframes)
+			write_ledger_entries(db_conn, ledger, row_counts, timeframes)
+			db_conn.execute('COMMIT')
+			record.update(rows_in=sum(row_counts.values()), bytes_read=i.get_file_size(file_paths))
+
+	except:
+		db_conn.execute('ROLLBACK')
+		raise
+
+
+def locate_symbol_database(output_directory_path, symbol):
+
+	database_file_paths = glob.glob(os.path.join(output_directory_path, f'{symbol}.*.duckdb'))
+
+	return max(database_file_paths, key=os.path.getmtime) if database_file_paths else None
+
 
-	if interval_begin:
-		matching_files = {
-			file_date : file_path
-			for file_date, file_path in matching_files.items()
-			if interval_begin <= datetime.strptime(file_date, '%Y-%m-%d')
-		}
+def get_database_file_name(db_conn, symbol):
 
-	if interval_end:
-		matching_files = {
-			file_date : file_path
-			for file_date, file_path in matching_files.items()
-			if datetime.strptime(file_date, '%Y-%m-%d') <= interval_end
-		}
+	min_date, date_count, max_date = db_conn.execute(f"""
+		SELECT min(file_date), count(DISTINCT file_date), max(file_date)
+		FROM (SELECT split_part(file_name, '.', 2) AS file_date FROM {LEDGER_TABLE_NAME})
+	""").fetchone()
+	if not date_count:
+		return None
+
+	return f'{symbol}.{min_date}_{date_count}_{max_date}.duckdb'.replace('-', '')
+
+
+def get_ordered_files_from_date_interval(input_directory_path, input_format, interval_begin, interval_end):
+
+	catalog_entries = c.locate_files(
+		input_directory_path,
+		input_format,
+		interval_begin.date().isoformat() if interval_begin else None,
+		interval_end.date().isoformat() if interval_end else None,
+	)
 
-	min_date = min(matching_files.keys()) if matching_files else None
-	max_date = max(matching_files.keys()) if matching_files else None
+	min_date = min(catalog_entry['date'] for catalog_entry in catalog_entries) if catalog_entries else None
+	max_date = max(catalog_entry['date'] for catalog_entry in catalog_entries) if catalog_entries else None
 
-	return list(reversed(sorted([file_name for file_name in matching_files.values()]))), min_date, max_date
+	return list(reversed(sorted([catalog_entry['file_path'] for catalog_entry in catalog_entries]))), min_date, max_date
 
 
 def main():
@@ -124,8 +401,16 @@ def main():
 		type     = au.supported_file_formats,
 		help     = f'Import input as one of the supported formats: {au.ALLOWED_FORMATS}',
 	)
+	parser.add_argument('-g', '--engine',
+		default = 'polars',
+		choices = ALLOWED_ENGINES,
+		help    = 'Aggregate in Python with Polars file by file, or inside DuckDB with SQL over the whole date range',
+	)
+
+	i.add_arguments(parser)
 
 	args                                = parser.parse_args()
+	i.configure(args, 'aggregate_raw_tick_to_ohlcv_into_database')
 	timeframes                          = au.handle_timeframe_args(args, ALLOWED_TIMEFRAMES)
 	input_formats                       = au.handle_formats_args(args.formats, 'parquet')
 	import_args, input_directory_paths  = au.handle_input_args(
@@ -143,12 +428,7 @@ def main():
 		matching_directories = fu.list_subdirectories_with_matching_prefix(input_directory, symbol)
 		for symbol_input_subdirectory_path in matching_directories:
 
-			input_files = {
-				(file_date := os.path.basename(item).split('.')[1]) : item
-				for item in fu.read_file_paths_by_extension(symbol_input_subdirectory_path, f'*.{input_format}')
-			}
-
-			files_with_matching_date, min_date, max_date = get_ordered_files_from_date_interval(input_files, args.interval_begin, args.interval_end)
+			files_with_matching_date, min_date, max_date = get_ordered_files_from_date_interval(symbol_input_subdirectory_path, input_format, args.interval_begin, args.interval_end)
 
 			processing_details.append({
 				'input_format' : input_format,
@@ -164,58 +444,44 @@ def main():
 
 		print(f'\n[{process_idx}/{len(processing_details)}] Processing: {process_detail["indir_path"]}')
 		if not process_detail['input_files']:
-			print(f'\tNo input file was found for symbol \'{symbol}\' in interval {str(args.interval_begin)[:-9]}...{str(args.interval_end)[:-9]}')
+			print(f'\tNo input file was found for symbol \'{process_detail["symbol"]}\' in interval {str(args.interval_begin)[:-9]}...{str(args.interval_end)[:-9]}')
 			continue
 
-		ohlcv_names = [tf for tf in timeframes if tf != 'tick']
-		db_conn     = duckdb.connect(os.path.join(args.output_directory_path, process_detail['db_file_name']))
-
-		if 'tick' in timeframes:
-			db_conn.execute(f"""
-				CREATE TABLE IF NOT EXISTS tick (
-					datetime TEXT,
-					price    TEXT,
-					size     TEXT,
-					side     TEXT
-				);
-			""")
-
-		for aggr_timeframe in ohlcv_names:
-			db_conn.execute(f"""
-				CREATE TABLE IF NOT EXISTS aggr_{aggr_timeframe} (
-					datetime TEXT PRIMARY KEY,
-					open     TEXT,
-					high     TEXT,
-					low      TEXT,
-					close    TEXT,
-					volume   TEXT
-				)
-			""")
-
-		print()
-		for file_idx, file_path in enumerate(process_detail['input_files'], start=1):
-			ticks_df = read_dataframe(file_path, process_detail['input_format'], symbol)
-
-			if 'tick' in timeframes:
-				db_conn.register('ticks_df', ticks_df.to_arrow())
-				db_conn.execute(f"""
-					INSERT INTO tick (datetime, open, high, low, close, volume)
-					SELECT datetime, open, high, low, close, volume
-					FROM ticks_df
-				""")
-				db_conn.unregister('ticks_df')
-
-			for aggr_timeframe in ohlcv_names:
-				aggr_df = u.aggregate_ohlcv(ticks_df, aggr_timeframe, symbol)
-				db_conn.execute(f"""
-					INSERT INTO aggr_{aggr_timeframe} (datetime, open, high, low, close, volume)
-					SELECT datetime, open, high, low, close, volume
-					FROM aggr_df
-					ON CONFLICT (datetime) DO NOTHING
-				""")
-				db_conn.unregister('aggr_df')
-
-			print("\033[F\033[K" + f"\t{file_idx}/{len(process_detail['input_files'])}", flush=True)
+		symbol             = process_detail['symbol']
+		database_file_path = locate_symbol_database(args.output_directory_path, symbol) or os.path.join(args.output_directory_path, process_detail['db_file_name'])
+		db_conn            = u.connect_duckdb(database_file_path)
+		create_tables(db_conn, timeframes)
+		create_ledger_table(db_conn)
+
+		ledger        = read_ledger(db_conn)
+		pending_files = [
+			file_path
+			for file_path in process_detail['input_files']
+			if not is_ledger_entry_current(ledger.get(os.path.basename(file_path)), file_path, timeframes)
+		]
+		print(f"\tUp to date : {len(process_detail['input_files']) - len(pending_files)} files in {database_file_path}")
+
+		if args.engine == 'sql':
+			if pending_files:
+				ingest_files(db_conn, pending_files, process_detail['input_format'], symbol, timeframes, aggregate_with_duckdb)
+			print(f"\tAggregated {len(pending_files)} files with SQL")
+
+		else:
+			print()
+			for file_idx, file_path in enumerate(pending_files, start=1):
+				ingest_files(db_conn, [file_path], process_detail['input_format'], symbol, timeframes, aggregate_with_polars)
+				print("\033[F\033[K" + f"\t{file_idx}/{len(pending_files)}", flush=True)
+
+		database_file_name = get_database_file_name(db_conn, symbol)
+		db_conn.close()
+
+		renamed_file_path = os.path.join(os.path.dirname(database_file_path), database_file_name or os.path.basename(database_file_path))
+		if renamed_file_path != database_file_path:
+			if fu.file_exists(renamed_file_path):
+				print(f'\tKept {database_file_path}, {renamed_file_path} already exists')
+			else:
+				os.replace(database_file_path, renamed_file_path)
+				print(f'\tRenamed to {renamed_file_path}')
 
 	print()
 
@@ -0,0 +1,198 @@
+import os
+import sys
+import glob
+import json
+import hashlib
+import contextlib
+import polars as pl
+
+REPO_ROOT_DIRECTORY_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+LIBRARIES_DIRECTORY_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../libs/python'))
+
+sys.path.append(LIBRARIES_DIRECTORY_PATH)
+
+import data_config as dc
+import instrumentation as i
+import utils as u
+
+
+# Bump when cached frames change meaning without a change of utils.py
+CACHE_VERSION = 1
+
+CACHE_DIRECTORY_NAME  = 'AGGR_CACHE'
+HASHES_DIRECTORY_NAME = 'hashes'
+DEFAULT_CACHE_BYTES   = 4 * 1024 * 1024 * 1024
+
+CODE_VERSION = {}
+
+
+def get_code_version():
+
+	# The aggregation lives in utils, so any edit of it invalidates every entry
+	if 'sha256' not in CODE_VERSION:
+		CODE_VERSION['sha256'] = u.get_file_hash(u.__file__)
+
+	return CODE_VERSION['sha256']
+
+
+def add_arguments(parser):
+
+	parser.add_argument('--cache_directory_path',
+		default = os.path.join(REPO_ROOT_DIRECTORY_PATH, dc.BASE_DIRECTORY__DATA, CACHE_DIRECTORY_NAME),
+		type    = str,
+		help    = 'Directory of cached aggregations, keyed by input content, timeframe and precision settings',
+	)
+	parser.add_argument('--cache_bytes',
+		default = DEFAULT_CACHE_BYTES,
+		type    = int,
+		help    = f'Disk budget of the cache, least recently used entries are evicted beyond it (default: {DEFAULT_CACHE_BYTES})',
+	)
+	parser.add_argument('--no_cache',
+		dest   = 'cache',
+		action = 'store_false',
+		help   = 'Always aggregate from ticks and do not store the results',
+	)
+
+
+def from_arguments(args):
+
+	return AggregationCache(args.cache_directory_path if args.cache else None, args.cache_bytes)
+
+
+class AggregationCache:
+
+	def __init__(self, directory_path=None, max_bytes=DEFAULT_CACHE_BYTES):
+
+		self.directory_path = directory_path
+		self.max_bytes      = max_bytes
+
+	def get_file_hash(self, file_path):
+
+		# Hashes are remembered per input file, so unchanged files are not read again
+		file_key       = hashlib.sha256(os.path.abspath(file_path).encode()).hexdigest()
+		hash_file_path = os.path.join(self.directory_path, HASHES_DIRECTORY_NAME, f'{file_key}.json')
+		file_stat      = u.get_file_stat(file_path)
+		hash_entry     = u.read_json_file(hash_file_path, {})
+		if all(hash_entry.get(key) == value for key, value in file_stat.items()):
+			os.utime(hash_file_path)
+			return hash_entry['sha256']
+
+		os.makedirs(os.path.dirname(hash_file_path), exist_ok=True)
+		hash_entry = {**file_stat, 'sha256': u.get_file_hash(file_path)}
+		u.write_json_file(hash_file_path, hash_entry)
+
+		return hash_entry['sha256']
+
+	def get_inputs_key(self, file_paths, symbol, **parameters):
+
+		if self.directory_path is None:
+			return None
+
+		key_content = {
+			'version'    : CACHE_VERSION,
+			'code'       : get_code_version(),
+			'precision'  : [dc.PRICE_PRECISION, dc.VOLUME_PRECISION, dc.TIMESTAMP_PRECISION],
+			'symbol'     : symbol,
+			'parameters' : parameters,
+			'inputs'     : [self.get_file_hash(file_path) for file_path in file_paths],
+		}
+
+		return hashlib.sha256(json.dumps(key_content, sort_keys=True).encode()).hexdigest()
+
+	def get_entry_path(self, inputs_key, name):
+
+		return os.path.join(self.directory_path, inputs_key[:2], f'{inputs_key}.{name}.parquet')
+
+	def get(self, inputs_key, name):
+
+		if inputs_key is None:
+			return None
+
+		entry_path = self.get_entry_path(inputs_key, name)
+		try:
+			df = pl.read_parquet(entry_path)
+			os.utime(entry_path)
+		except FileNotFoundError:
+			return None
+
+		return df
+
+	def get_cached_intervals(self, inputs_key):
+
+		entry_names = [
+			os.path.basename(entry_path)[len(inputs_key) + 1:-len('.parquet')]
+			for entry_path in glob.glob(self.get_entry_path(inputs_key, '*'))
+		]
+
+		return [entry_name for entry_name in entry_names if not u.is_information_bar(entry_name)]
+
+	def put(self, inputs_key, name, df):
+
+		if inputs_key is None:
+			return
+
+		entry_path          = self.get_entry_path(inputs_key, name)
+		temporary_file_path = f'{entry_path}.{os.getpid()}.tmp'
+		os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+		df.write_parquet(temporary_file_path)
+		os.replace(temporary_file_path, entry_path)
+
+	def evict(self):
+
+		if self.directory_path is None:
+			return
+
+		# Hits refresh the modification time, so the oldest entries are the least recently used,
+		# and remembered input hashes share the budget since they grow with every input file seen
+		entries = []
+		for entry_path in [
+			*glob.glob(os.path.join(self.directory_path, '*', '*.parquet')),
+			*glob.glob(os.path.join(self.directory_path, HASHES_DIRECTORY_NAME, '*.json')),
+		]:
+			with contextlib.suppress(FileNotFoundError):
+				entry_stat = os.stat(entry_path)
+				entries.append((entry_stat.st_mtime_ns, entry_stat.st_size, entry_path))
+		size_bytes = sum(size for _, size, _ in entries)
+		for _, size, entry_path in sorted(entries):
+			if size_bytes <= self.max_bytes:
+				break
+			with contextlib.suppress(FileNotFoundError):
+				os.remove(entry_path)
+			size_bytes -= size
+
+	def aggregate_ohlcv_timeframes(self, inputs_key, load_ticks, intervals, symbol):
+
+		if inputs_key is None:
+			return u.aggregate_ohlcv_timeframes(load_ticks(), intervals, symbol)
+
+		output_dfs = {}
+		for interval in dict.fromkeys(intervals):
+			with i.stage('cache', timeframe=interval) as record:
+				output_dfs[interval] = self.get(inputs_key, interval)
+				record['rows_out']   = output_dfs[interval].height if output_dfs[interval] is not None else 0
+
+		missing_intervals = [interval for interval, output_df in output_dfs.items() if output_df is None]
+		if missing_intervals:
+			# Missing timeframes roll up from cached finer ones where they can, and only the rest read the ticks
+			cached_intervals = [interval for interval in self.get_cached_intervals(inputs_key) if interval not in missing_intervals]
+			rollup_sources   = u.get_rollup_sources(cached_intervals + [interval for interval in missing_intervals if not u.is_information_bar(interval)])
+			bars_dfs         = {}
+			needs_ticks      = False
+			for interval in missing_intervals:
+				rollup_source = rollup_sources.get(interval)
+				while rollup_source is not None and rollup_source not in cached_intervals:
+					rollup_source = rollup_sources[rollup_source]
+				if rollup_source is not None and rollup_source not in bars_dfs:
+					source_df = output_dfs.get(rollup_source)
+					source_df = source_df if source_df is not None else self.get(inputs_key, rollup_source)
+					if source_df is not None:
+						bars_dfs[rollup_source] = source_df
+				# Entries evicted meanwhile fall back to the ticks
+				needs_ticks = needs_ticks or rollup_source not in bars_dfs
+
+			for interval, output_df in u.aggregate_ohlcv_timeframes(load_ticks() if needs_ticks else None, missing_intervals, symbol, bars_dfs).items():
+				self.put(inputs_key, interval, output_df)
+				output_dfs[interval] = output_df
+			self.evict()
+
+		return output_dfs
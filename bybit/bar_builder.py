@@ -0,0 +1,255 @@
+import os
+import sys
+import numpy as np
+import polars as pl
+
+LIBRARIES_DIRECTORY_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../libs/python'))
+
+sys.path.append(LIBRARIES_DIRECTORY_PATH)
+
+import data_config as dc
+import domain as d
+import utils as u
+
+
+# Weeks start on Monday like dt.truncate does, and 1970-01-01 was a Thursday
+WEEK_ORIGIN_SECONDS = -3 * u.SECONDS_IN_DAY
+
+BAR_COLUMNS = ['datetime', 'open', 'high', 'low', 'close', 'volume']
+
+
+class Bar:
+
+	__slots__ = ('timeframe', 'start', 'end', 'open', 'high', 'low', 'close', 'volume')
+
+	def __init__(self, timeframe, start, end, open_price, high_price, low_price, close_price, volume):
+
+		self.timeframe = timeframe
+		self.start     = start
+		self.end       = end
+		self.open      = open_price
+		self.high      = high_price
+		self.low       = low_price
+		self.close     = close_price
+		self.volume    = volume
+
+	def __repr__(self):
+
+		return f'Bar({self.timeframe}, {self.start}, {self.open}, {self.high}, {self.low}, {self.close}, {self.volume})'
+
+
+class BarLevel:
+
+	__slots__ = ('timeframe', 'units', 'origin', 'bar', 'dependents')
+
+	def __init__(self, timeframe):
+
+		self.timeframe  = timeframe
+		self.units      = d.timeframe_to_seconds(timeframe) * 10 ** u.TIMESTAMP_SCALE
+		self.origin     = (WEEK_ORIGIN_SECONDS if timeframe.endswith('w') else 0) * 10 ** u.TIMESTAMP_SCALE
+		self.bar        = None
+		self.dependents = []
+
+	def get_start(self, timestamp):
+
+		return timestamp - (timestamp - self.origin) % self.units
+
+
+class BarBuilder:
+
+	# Only the finest timeframes see ticks, coarser ones are rolled up from closed bars like in aggregate_ohlcv_timeframes
+	__slots__ = ('levels', 'roots', 'on_bar', 'closed_bars', 'last_timestamp')
+
+	def __init__(self, timeframes=None, on_bar=None):
+
+		timeframes = list(dict.fromkeys(timeframes or dc.OHLCV_TIMEFRAMES))
+		if information_bars := [timeframe for timeframe in timeframes if u.is_information_bar(timeframe)]:
+			raise ValueError(f'Information bars are not supported by the bar builder: {information_bars}')
+
+		self.levels = {timeframe: BarLevel(timeframe) for timeframe in timeframes}
+		self.roots  = []
+		for timeframe, rollup_source in u.get_rollup_sources(timeframes).items():
+			if rollup_source is None:
+				self.roots.append(self.levels[timeframe])
+			else:
+				self.levels[rollup_source].dependents.append(self.levels[timeframe])
+
+		self.on_bar         = on_bar
+		self.closed_bars    = []
+		self.last_timestamp = None
+
+	def emit(self, bar):
+
+		if self.on_bar is None:
+			self.closed_bars.append(bar)
+		else:
+			self.on_bar(bar)
+
+	def pop_closed_bars(self):
+
+		closed_bars, self.closed_bars = self.closed_bars, []
+
+		return closed_bars
+
+	def close_bar(self, level, timestamp):
+
+		bar, level.bar = level.bar, None
+		self.emit(bar)
+		for dependent in level.dependents:
+			self.add_bar(dependent, bar, timestamp)
+
+	def add_bar(self, level, child, timestamp):
+
+		bar = level.bar
+		if bar is None:
+			start     = level.get_start(child.start)
+			level.bar = Bar(level.timeframe, start, start + level.units, child.open, child.high, child.low, child.close, child.volume)
+		else:
+			bar.high    = max(bar.high, child.high)
+			bar.low     = min(bar.low, child.low)
+			bar.close   = child.close
+			bar.volume += child.volume
+
+		# Buckets nest, so a coarser bar can only end when the finer bar that closes it has been added
+		if timestamp is None or timestamp >= level.bar.end:
+			self.close_bar(level, timestamp)
+
+	def check_order(self, timestamp):
+
+		if self.last_timestamp is not None and timestamp < self.last_timestamp:
+			raise ValueError(f'Ticks must arrive in timestamp order: {timestamp} after {self.last_timestamp}')
+
+	def add_tick(self, timestamp, price, size):
+
+		self.check_order(timestamp)
+		self.last_timestamp = timestamp
+		for level in self.roots:
+			bar = level.bar
+			if bar is not None and timestamp < bar.end:
+				if price > bar.high:
+					bar.high = price
+				elif price < bar.low:
+					bar.low = price
+				bar.close   = price
+				bar.volume += size
+				continue
+
+			if bar is not None:
+				self.close_bar(level, timestamp)
+			start     = level.get_start(timestamp)
+			level.bar = Bar(level.timeframe, start, start + level.units, price, price, price, price, size)
+
+	def add_ticks(self, timestamps, prices, sizes):
+
+		# A micro-batch is reduced per bucket with numpy, so Python work grows with bars rather than ticks
+		timestamps, prices, sizes = np.asarray(timestamps), np.asarray(prices), np.asarray(sizes)
+		if not len(timestamps):
+			return
+
+		self.check_order(timestamps[0])
+		if np.any(timestamps[1:] < timestamps[:-1]):
+			raise ValueError('Ticks must arrive in timestamp order')
+		self.last_timestamp = timestamps[-1].item()
+
+		for level in self.roots:
+			starts         = timestamps - (timestamps - level.origin) % level.units
+			segment_begins = np.flatnonzero(np.diff(starts, prepend=starts[0] - 1))
+			segment_ends   = np.append(segment_begins[1:], len(timestamps)) - 1
+			segments       = zip(
+				starts[segment_begins].tolist(),
+				timestamps[segment_begins].tolist(),
+				prices[segment_begins].tolist(),
+				np.maximum.reduceat(prices, segment_begins).tolist(),
+				np.minimum.reduceat(prices, segment_begins).tolist(),
+				prices[segment_ends].tolist(),
+				np.add.reduceat(sizes, segment_begins).tolist(),
+			)
+			for start, timestamp, open_price, high_price, low_price, close_price, volume in segments:
+				bar = level.bar
+				if bar is not None and timestamp < bar.end:
+					bar.high    = max(bar.high, high_price)
+					bar.low     = min(bar.low, low_price)
+					bar.close   = close_price
+					bar.volume += volume
+					continue
+
+				if bar is not None:
+					self.close_bar(level, timestamp)
+				level.bar = Bar(level.timeframe, start, start + level.units, open_price, high_price, low_price, close_price, volume)
+
+	def add_batch(self, batch):
+
+		# Replay batches interleave symbols, and one builder keeps the bars of one symbol
+		symbols = batch.get('symbol')
+		if symbols is not None and len(symbols) and np.any(symbols != symbols[0]):
+			raise ValueError('A bar builder takes the ticks of one symbol, replay symbols one at a time')
+		self.add_ticks(batch['timestamp'], batch['price'], batch['size'])
+
+	def add_frame(self, df):
+
+		# Frames of read_and_concat_dataframes are accepted in any precision and datetime setting
+		df = u.to_native_ticks(df).select([
+			pl.col('timestamp') if df.schema['timestamp'].is_integer() else u.to_fixed_point('timestamp', u.TIMESTAMP_SCALE),
+			pl.col('price'),
+			pl.col('size'),
+		]).collect()
+		self.add_ticks(df.get_column('timestamp').to_numpy(), df.get_column('price').to_numpy(), df.get_column('size').to_numpy())
+
+	def flush(self):
+
+		# Open bars are closed as they are, which a historical rebuild needs at the end of its ticks
+		for level in self.roots:
+			if level.bar is not None:
+				self.close_bar(level, None)
+
+
+def to_bars_frame(bars, fixed_point=True, native_datetime=True):
+
+	bars_df = pl.DataFrame(
+		[(bar.start, bar.open, bar.high, bar.low, bar.close, bar.volume) for bar in bars],
+		schema = {column: pl.Int64 for column in BAR_COLUMNS},
+		orient = 'row',
+	)
+	bars_df = bars_df.with_columns(
+		(pl.col('datetime') * 10 ** (6 - u.TIMESTAMP_SCALE)).cast(pl.Datetime('us')),
+	)
+	if not fixed_point:
+		bars_df = u.format_fixed_point_columns(bars_df)
+	if not native_datetime:
+		bars_df = u.format_datetime_columns(bars_df)
+
+	return bars_df
+
+
+def build_bars(tick_batches, timeframes=None):
+
+	builder = BarBuilder(timeframes)
+	for batch in tick_batches:
+		builder.add_batch(batch)
+	builder.flush()
+
+	bars = {timeframe: [] for timeframe in builder.levels}
+	for bar in builder.pop_closed_bars():
+		bars[bar.timeframe].append(bar)
+
+	return {timeframe: to_bars_frame(timeframe_bars) for timeframe, timeframe_bars in bars.items()}
+
+
+async def stream_bars(tick_batches, timeframes=None):
+
+	# Batches may come from a live trade feed or from tick_replay, closed bars are yielded as soon as they are known
+	builder = BarBuilder(timeframes)
+	if hasattr(tick_batches, '__aiter__'):
+		async for batch in tick_batches:
+			builder.add_batch(batch)
+			for bar in builder.pop_closed_bars():
+				yield bar
+	else:
+		for batch in tick_batches:
+			builder.add_batch(batch)
+			for bar in builder.pop_closed_bars():
+				yield bar
+
+	builder.flush()
+	for bar in builder.pop_closed_bars():
+		yield bar
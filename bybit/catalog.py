@@ -0,0 +1,185 @@
+import os
+import re
+import sys
+import glob
+import polars as pl
+import pyarrow.parquet as pq
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+LIBRARIES_DIRECTORY_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../libs/python'))
+
+sys.path.append(LIBRARIES_DIRECTORY_PATH)
+
+import utils as u
+
+
+CATALOG_FILE_NAME = 'catalog.json'
+
+FILE_DATE_PATTERN = r'(\d{4}-\d{2}-\d{2})'
+
+TIMESTAMP_COLUMN = 'timestamp'
+
+CSV_TAIL_BYTES  = 64 * 1024
+CSV_CHUNK_BYTES = 1024 * 1024
+
+
+def get_timestamp_date(timestamp):
+
+	# Decimal keeps the exact text of the timestamp, so float rounding cannot move a trade across midnight
+	microseconds = int(Decimal(str(timestamp)) * 1_000_000)
+
+	return (datetime(1970, 1, 1) + timedelta(microseconds=microseconds)).date().isoformat()
+
+
+def read_csv_edge_lines(file_path):
+
+	with open(file_path, 'rb') as in_file:
+		header_line = in_file.readline()
+		first_line  = in_file.readline()
+		in_file.seek(max(in_file.tell(), os.path.getsize(file_path) - CSV_TAIL_BYTES))
+		tail_lines  = in_file.read().splitlines()
+
+	return header_line.decode(), first_line.decode(), tail_lines[-1].decode() if tail_lines else ''
+
+
+def count_csv_rows(file_path):
+
+	# Line breaks are counted in raw chunks, which is far cheaper than parsing and only runs for new or changed files
+	line_count = 0
+	last_chunk = b''
+	with open(file_path, 'rb') as in_file:
+		while chunk := in_file.read(CSV_CHUNK_BYTES):
+			line_count += chunk.count(b'\n')
+			last_chunk  = chunk
+
+	# The header is not a row, and the last line may lack its line break
+	return max(0, line_count - 1 + int(bool(last_chunk) and not last_chunk.endswith(b'\n')))
+
+
+def read_csv_file_statistics(file_path):
+
+	# Dumps are ordered by time, so the first and the last trade bound the file without parsing it
+	header_line, first_line, last_line = read_csv_edge_lines(file_path)
+	column_idx = header_line.strip().split(',').index(TIMESTAMP_COLUMN)
+	timestamps = [line.strip().split(',')[column_idx] for line in [first_line, last_line] if line.strip()]
+	if not timestamps:
+		return {'rows': 0, 'min_timestamp': None, 'max_timestamp': None}
+
+	return {
+		'rows'          : count_csv_rows(file_path),
+		'min_timestamp' : min(timestamps, key=Decimal),
+		'max_timestamp' : max(timestamps, key=Decimal),
+	}
+
+
+def read_parquet_file_statistics(file_path):
+
+	metadata = pq.ParquetFile(file_path).metadata
+	if not metadata.num_rows:
+		return {'rows': 0, 'min_timestamp': None, 'max_timestamp': None}
+
+	column_idx = metadata.schema.names.index(TIMESTAMP_COLUMN)
+	statistics = [metadata.row_group(idx).column(column_idx).statistics for idx in range(metadata.num_row_groups)]
+
+	if all(statistics_entry is not None and statistics_entry.has_min_max for statistics_entry in statistics):
+		min_timestamps = [statistics_entry.min for statistics_entry in statistics]
+		max_timestamps = [statistics_entry.max for statistics_entry in statistics]
+	else:
+		# Files written without statistics fall back to the timestamp column alone
+		timestamps_df  = pl.scan_parquet(file_path).select(
+			pl.col(TIMESTAMP_COLUMN).cast(pl.Float64).min().alias('min'),
+			pl.col(TIMESTAMP_COLUMN).cast(pl.Float64).max().alias('max'),
+		).collect()
+		min_timestamps = [timestamp for timestamp in timestamps_df['min'] if timestamp is not None]
+		max_timestamps = [timestamp for timestamp in timestamps_df['max'] if timestamp is not None]
+
+	return {
+		'rows'          : metadata.num_rows,
+		'min_timestamp' : str(min(min_timestamps, key=Decimal)) if min_timestamps else None,
+		'max_timestamp' : str(max(max_timestamps, key=Decimal)) if max_timestamps else None,
+	}
+
+
+def read_file_entry(file_path, file_format):
+
+	if file_format == 'csv':
+		file_statistics = read_csv_file_statistics(file_path)
+
+	elif file_format == 'parquet':
+		file_statistics = read_parquet_file_statistics(file_path)
+
+	else:
+		raise NotImplementedError(f'Unknown format: {file_format}')
+
+	match = re.search(FILE_DATE_PATTERN, os.path.basename(file_path))
+
+	return {
+		**u.get_file_stat(file_path),
+		**file_statistics,
+		'date'   : match.group(1) if match else file_statistics['min_timestamp'] and get_timestamp_date(file_statistics['min_timestamp']),
+		'format' : file_format,
+	}
+
+
+def update_catalog(directory_path, file_format):
+
+	# Entries are kept while the size and mtime of their file match, so only new or changed files are inspected
+	catalog_file_path = os.path.join(directory_path, CATALOG_FILE_NAME)
+	catalog           = u.read_json_file(catalog_file_path, {})
+	file_paths        = sorted(glob.glob(os.path.join(directory_path, f'*.{file_format}')))
+
+	updated_catalog = {
+		file_name : catalog_entry
+		for file_name, catalog_entry in catalog.items()
+		if catalog_entry['format'] != file_format
+	}
+	for file_path in file_paths:
+		file_name     = os.path.basename(file_path)
+		catalog_entry = catalog.get(file_name)
+		file_stat     = u.get_file_stat(file_path)
+		if not catalog_entry or any(catalog_entry.get(key) != value for key, value in file_stat.items()):
+			catalog_entry = read_file_entry(file_path, file_format)
+		updated_catalog[file_name] = catalog_entry
+
+	if updated_catalog != catalog:
+		u.write_json_file(catalog_file_path, updated_catalog)
+
+	return [
+		{'file_path': file_path, **updated_catalog[os.path.basename(file_path)]}
+		for file_path in file_paths
+	]
+
+
+def locate_files(directory_path, file_format, date_begin=None, date_end=None):
+
+	return [
+		catalog_entry
+		for catalog_entry in update_catalog(directory_path, file_format)
+		if (date_begin is None or date_begin <= catalog_entry['date']) and (date_end is None or catalog_entry['date'] <= date_end)
+	]
+
+
+def group_files_by_date(catalog_entries):
+
+	# A file holding trades of a neighbouring day is a source of that day too
+	date_file_paths = {}
+	for catalog_entry in catalog_entries:
+		if catalog_entry['min_timestamp'] is None:
+			continue
+		date_begin = datetime.fromisoformat(get_timestamp_date(catalog_entry['min_timestamp']))
+		date_end   = datetime.fromisoformat(get_timestamp_date(catalog_entry['max_timestamp']))
+		for day in range((date_end - date_begin).days + 1):
+			date_file_paths.setdefault((date_begin + timedelta(days=day)).date().isoformat(), []).append(catalog_entry['file_path'])
+
+	return dict(sorted(date_file_paths.items()))
+
+
+def get_interval_info(catalog_entries):
+
+	min_timestamps  = [catalog_entry['min_timestamp'] for catalog_entry in catalog_entries if catalog_entry['min_timestamp'] is not None]
+	max_timestamps  = [catalog_entry['max_timestamp'] for catalog_entry in catalog_entries if catalog_entry['max_timestamp'] is not None]
+	if not min_timestamps:
+		return None, None
+
+	return get_timestamp_date(min(min_timestamps, key=Decimal)), get_timestamp_date(max(max_timestamps, key=Decimal))
@@ -4,9 +4,9 @@
 import os
 import sys
 import glob
-import duckdb
+import shutil
 import argparse
-import polars as pl
+from concurrent.futures import ThreadPoolExecutor
 
 REPO_ROOT_DIRECTORY_PATH = os.path.commonpath([os.getcwd(), os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))])
 LIBRARIES_DIRECTORY_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../libs/python'))
@@ -18,10 +18,17 @@ import data_config as dc
 import file_utils as fu
 import arg_utils as au
 import domain as d
+import instrumentation as i
+import utils as u
 
 
 ALLOWED_TIMEFRAMES = set(['tick'] + [tf for tf in dc.OHLCV_TIMEFRAMES if d.timeframe_to_seconds(tf) <= 24*60*60])
 
+TICK_DATETIME_FORMAT  = '%Y-%m-%d %H:%M:%S.%f'
+OHLCV_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+WATERMARK_FILE_SUFFIX = '.watermark.json'
+
 
 def locate_ohlcv_databases(input_directory_path, database_prefixes):
 
@@ -47,6 +54,181 @@ def get_table_names_to_query(timeframes):
 	return table_names_to_query
 
 
+def get_export_query(db_conn, table_name, export_format, where=''):
+
+	columns = [column[0] for column in db_conn.execute(f'DESCRIBE {table_name}').fetchall()]
+	if export_format == 'csv':
+		# Sizes are written without trailing zeros, like the preprocessed tick CSV files
+		datetime_format = TICK_DATETIME_FORMAT if table_name == 'tick' else OHLCV_DATETIME_FORMAT
+		csv_columns     = {
+			'datetime' : f"strftime(datetime, '{datetime_format}') AS datetime",
+			'size'     : r"regexp_replace(CAST(size AS VARCHAR), '\.?0+$', '') AS size",
+		}
+		columns         = [csv_columns.get(column, column) for column in columns]
+
+	return f'SELECT {", ".join(columns)} FROM {table_name} {where} ORDER BY datetime'
+
+
+def get_copy_options(export_format):
+
+	return 'FORMAT PARQUET, COMPRESSION ZSTD' if export_format == 'parquet' else 'FORMAT CSV, HEADER'
+
+
+def get_table_state(db_conn, table_name, where=''):
+
+	# Row hashes are summed, so the checksum tells changed rows apart from a mere count and does not depend on scan order
+	max_datetime, row_count, checksum = db_conn.execute(f"""
+		SELECT CAST(max(datetime) AS VARCHAR), count(*), CAST(sum(hash({table_name})) AS VARCHAR) FROM {table_name} {where}
+	""").fetchone()
+
+	return {'datetime': max_datetime, 'rows': row_count, 'checksum': checksum}
+
+
+def get_resume_datetime(db_conn, table_name, watermark):
+
+	# Rows up to the watermark must be unchanged to only export the rows past it
+	if not watermark or 'checksum' not in watermark:
+		return None
+
+	exported_state = get_table_state(db_conn, table_name, f"WHERE datetime <= TIMESTAMP '{watermark['datetime']}'")
+
+	return watermark['datetime'] if exported_state == watermark else None
+
+
+def export_table(db_conn, table_name, export_format, output_file_path):
+
+	watermark_file_path = f'{output_file_path}{WATERMARK_FILE_SUFFIX}'
+	watermark           = u.read_json_file(watermark_file_path) if fu.file_exists(output_file_path) else None
+
+	table_state = get_table_state(db_conn, table_name)
+	row_count   = table_state['rows']
+	if watermark == table_state:
+		return 'up to date'
+
+	# Parquet files are immutable, so they are always streamed again in full
+	resume_datetime     = get_resume_datetime(db_conn, table_name, watermark) if export_format == 'csv' else None
+	temporary_file_path = f'{output_file_path}.tmp'
+	with i.stage('write', table=table_name, format=export_format) as record:
+		if resume_datetime:
+			query = get_export_query(db_conn, table_name, export_format, f"WHERE datetime > TIMESTAMP '{resume_datetime}'")
+			record['rows_in'] = db_conn.execute(f"COPY ({query}) TO '{temporary_file_path}' (FORMAT CSV, HEADER false)").fetchone()[0]
+			record['bytes_written'] = i.get_file_size(temporary_file_path)
+			with open(temporary_file_path, 'rb') as in_file, open(output_file_path, 'ab') as out_file:
+				shutil.copyfileobj(in_file, out_file)
+			os.remove(temporary_file_path)
+			status = f'appended {row_count - watermark["rows"]} rows'
+
+		else:
+			query = get_export_query(db_conn, table_name, export_format)
+			record['rows_in'] = db_conn.execute(f"COPY ({query}) TO '{temporary_file_path}' ({get_copy_options(export_format)})").fetchone()[0]
+			os.replace(temporary_file_path, output_file_path)
+			record['bytes_written'] = i.get_file_size(output_file_path)
+			status = f'exported {row_count} rows'
+
+	u.write_json_file(watermark_file_path, table_state)
+
+	return status
+
+
+def export_partition(db_conn, table_name, export_format, date, file_path):
+
+	cursor              = db_conn.cursor()
+	temporary_file_path = f'{file_path}.tmp'
+	query               = get_export_query(cursor, table_name, export_format, f"WHERE datetime >= DATE '{date}' AND datetime < DATE '{date}' + INTERVAL 1 DAY")
+	os.makedirs(os.path.dirname(file_path), exist_ok=True)
+	with i.stage('write', table=table_name, format=export_format, layout='hive') as record:
+		record['rows_in'] = cursor.execute(f"COPY ({query}) TO '{temporary_file_path}' ({get_copy_options(export_format)})").fetchone()[0]
+		os.replace(temporary_file_path, file_path)
+		record['bytes_written'] = i.get_file_size(file_path)
+	cursor.close()
+
+
+def export_table_partitions(db_conn, table_name, export_format, output_base_path, symbol, timeframe):
+
+	watermark_file_path = os.path.join(output_base_path, f'symbol={symbol}', f'timeframe={timeframe}', f'watermark.{export_format}.json')
+	watermark           = u.read_json_file(watermark_file_path)
+
+	table_state = get_table_state(db_conn, table_name)
+	if watermark == table_state:
+		return 'up to date'
+
+	# The day of the watermark is exported again as a whole, the partitions before it are kept
+	resume_datetime = get_resume_datetime(db_conn, table_name, watermark)
+	where           = f"WHERE datetime >= CAST(TIMESTAMP '{resume_datetime}' AS DATE)" if resume_datetime else ''
+	dates           = [str(row[0]) for row in db_conn.execute(f'SELECT DISTINCT CAST(datetime AS DATE) FROM {table_name} {where} ORDER BY 1').fetchall()]
+	with ThreadPoolExecutor() as executor:
+		list(executor.map(
+			lambda date: export_partition(db_conn, table_name, export_format, date, u.get_hive_partition_path(output_base_path, symbol, timeframe, date, export_format)),
+			dates,
+		))
+
+	if dates:
+		u.write_json_file(watermark_file_path, table_state)
+
+	return f'exported {len(dates)} day partitions'
+
+
+def get_output_file_prefix(database_file):
+
+	return '.'.join(os.path.basename(database_file).split('.')[:2]).upper()
+
+
+def adopt_previous_exports(output_base_path, output_file_prefixes, database_prefixes):
+
+	# Databases are renamed when their date range grows, the export of a database that no longer exists
+	# is renamed along with it so its watermarks can be picked up. Adoption runs before the workers start,
+	# and a symbol with several databases missing an export adopts nothing, as the export fits none for sure
+	for symbol in sorted(set(output_file_prefix.split('.')[0] for output_file_prefix in output_file_prefixes)):
+		orphaned_dirs = [
+			path
+			for path in glob.glob(os.path.join(output_base_path, f'{symbol}.*'))
+			if os.path.isdir(path) and os.path.basename(path) not in database_prefixes
+		]
+		missing_prefixes = [
+			output_file_prefix
+			for output_file_prefix in output_file_prefixes
+			if output_file_prefix.split('.')[0] == symbol and not os.path.isdir(os.path.join(output_base_path, output_file_prefix))
+		]
+		if orphaned_dirs and len(missing_prefixes) == 1:
+			adopt_previous_export(output_base_path, max(orphaned_dirs, key=os.path.getmtime), missing_prefixes[0])
+
+
+def adopt_previous_export(output_base_path, previous_dir_path, output_file_prefix):
+
+	dir_path        = os.path.join(output_base_path, output_file_prefix)
+	previous_prefix = os.path.basename(previous_dir_path)
+	os.rename(previous_dir_path, dir_path)
+	for file_name in os.listdir(dir_path):
+		if file_name.startswith(f'{previous_prefix}.'):
+			os.rename(os.path.join(dir_path, file_name), os.path.join(dir_path, f'{output_file_prefix}{file_name[len(previous_prefix):]}'))
+	print(f'\tRenamed {previous_dir_path} to {dir_path}')
+
+
+def export_database(database_file, output_file_prefix, table_names_to_query, export_args, output_directory_path, layout):
+
+	export_formats = [export_format for export_format, is_allowed in export_args.items() if is_allowed]
+	if layout == 'hive':
+		db_conn = u.connect_duckdb(database_file, read_only=True)
+		symbol  = output_file_prefix.split('.')[0]
+		for timeframe, table_name in table_names_to_query.items():
+			for export_format in export_formats:
+				output_base_path = output_directory_path.get(export_format, output_directory_path.get('_'))
+				status           = export_table_partitions(db_conn, table_name, export_format, output_base_path, symbol, timeframe)
+				print(f'\t{timeframe:<4} : {os.path.join(output_base_path, f"symbol={symbol}", f"timeframe={timeframe}")} ({status})')
+		db_conn.close()
+		return
+
+	db_conn = u.connect_duckdb(database_file, read_only=True)
+	for timeframe, table_name in table_names_to_query.items():
+		for export_format in export_formats:
+			dir_path         = os.path.join(output_directory_path.get(export_format, output_directory_path.get('_')), output_file_prefix)
+			output_file_path = os.path.join(dir_path, f'{output_file_prefix}.{timeframe}.{export_format}')
+			fu.create_local_folder(dir_path)
+			status = export_table(db_conn, table_name, export_format, output_file_path)
+			print(f'\t{timeframe:<4} : {output_file_path} ({status})')
+	db_conn.close()
+
+
 def main():
 
 	input_directory_path = os.path.join(REPO_ROOT_DIRECTORY_PATH, dc.BASE_DIRECTORY__DATA, dc.DIRECTORY_NAME__AGGR_DB)
@@ -79,8 +261,21 @@ def main():
 		type    = au.supported_file_formats,
 		help    = f'Export output as any of the supported formats: {au.ALLOWED_FORMATS}'
 	)
+	parser.add_argument('-w', '--workers',
+		type    = int,
+		default = 1,
+		help    = 'Number of worker processes'
+	)
+	parser.add_argument('-l', '--layout',
+		default = 'file',
+		choices = u.OUTPUT_LAYOUTS,
+		help    = 'Write one file per timeframe, or symbol=/timeframe=/date=/part.<format> partitions overwriting whole days'
+	)
+
+	i.add_arguments(parser)
 
 	args                               = parser.parse_args()
+	i.configure(args, 'convert_duckdb_to_files')
 	output_formats                     = au.handle_formats_args(args.exports, 'parquet')
 	export_args, output_directory_path = au.handle_output_args(
 		args,
@@ -108,7 +303,7 @@ def main():
 	valid_db_files_to_process = []
 	for database_file in database_files:
 
-		tables_in_db = set([x[0] for x in duckdb.connect(database_file).execute(f"""
+		tables_in_db = set([x[0] for x in u.connect_duckdb(database_file, read_only=True).execute(f"""
 			SELECT table_name
 			FROM information_schema.tables
 			WHERE table_schema = 'main'
@@ -125,34 +320,27 @@ def main():
 
 		valid_db_files_to_process.append({
 			'database_file'      : database_file,
-			'output_file_prefix' : '.'.join(file_name_parts[:2]).upper(),
+			'output_file_prefix' : get_output_file_prefix(database_file),
 		})
 
 	for export_format, is_allowed in export_args.items():
 		if is_allowed:
 			fu.create_local_folder(output_directory_path[export_format])
 
-	for idx, db in enumerate(valid_db_files_to_process, start=1):
-		print(f'\n[{idx}/{len(valid_db_files_to_process)}] Processing {db["database_file"]}')
+	if args.layout == 'file':
+		database_prefixes = set(get_output_file_prefix(database_file) for database_file in glob.glob(os.path.join(args.input_directory_path, '*.duckdb')))
+		for output_base_path in set(output_directory_path.get(export_format, output_directory_path.get('_')) for export_format, is_allowed in export_args.items() if is_allowed):
+			adopt_previous_exports(output_base_path, [db['output_file_prefix'] for db in valid_db_files_to_process], database_prefixes)
 
-		for timeframe, table_name in table_names_to_query.items():
+	work_units = [{
+		'label'    : f'Processing {db["database_file"]}',
+		'weight'   : os.path.getsize(db['database_file']),
+		'function' : export_database,
+		'args'     : (db['database_file'], db['output_file_prefix'], table_names_to_query, export_args, output_directory_path, args.layout),
+	} for db in valid_db_files_to_process]
 
-			tf_data = duckdb.connect(db['database_file']).execute(f"""SELECT datetime, open, high, low, close, volume FROM {table_name}""").pl().sort('datetime')
-			infix   = db["output_file_prefix"]
-
-			if export_args['csv']:
-				dir_path_csv     = os.path.join(output_directory_path.get('csv', output_directory_path.get('_')), infix)
-				fu.create_local_folder(dir_path_csv)
-				output_file_path = os.path.join(dir_path_csv, f'{infix}.{timeframe}.csv')
-				tf_data.write_csv(output_file_path)
-				print(f'\t{timeframe:<4} : {output_file_path}')
-
-			if export_args['parquet']:
-				dir_path_parquet = os.path.join(output_directory_path.get('parquet', output_directory_path.get('_')), infix)
-				fu.create_local_folder(dir_path_parquet)
-				output_file_path = os.path.join(dir_path_parquet, f'{infix}.{timeframe}.parquet')
-				tf_data.write_parquet(output_file_path)
-				print(f'\t{timeframe:<4} : {output_file_path}')
+	for work_unit, result in u.run_work_units(work_units, args.workers):
+		pass
 
 if __name__ == '__main__':
 	main()
@@ -5,8 +5,6 @@ import os
 import sys
 import glob
 import argparse
-import polars as pl
-from decimal import Decimal
 
 REPO_ROOT_DIRECTORY_PATH = os.path.commonpath([os.getcwd(), os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))])
 LIBRARIES_DIRECTORY_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../libs/python'))
@@ -16,6 +14,63 @@ sys.path.append(LIBRARIES_DIRECTORY_PATH)
 
 import data_config as dc
 import file_utils as fu
+import instrumentation as i
+import utils as u
+
+
+MANIFEST_FILE_NAME = 'manifest.json'
+
+
+def get_parquet_file_path(parquet_directory_path, csv_file_path):
+
+	return os.path.join(parquet_directory_path, os.path.basename(csv_file_path).replace('.csv', '.parquet'))
+
+
+def plan_symbol_files(csv_file_paths, parquet_directory_path, settings, force):
+
+	manifest_file_path = os.path.join(parquet_directory_path, MANIFEST_FILE_NAME)
+	manifest           = u.read_json_file(manifest_file_path, default={'settings': settings, 'files': {}})
+	if force or manifest['settings'] != settings:
+		manifest = {'settings': settings, 'files': {}}
+
+	pending_file_paths = [
+		csv_file_path
+		for csv_file_path in csv_file_paths
+		if not u.is_manifest_entry_current(
+			manifest['files'].get(os.path.basename(csv_file_path)),
+			csv_file_path,
+			get_parquet_file_path(parquet_directory_path, csv_file_path),
+		)
+	]
+	u.write_json_file(manifest_file_path, manifest)
+
+	return manifest_file_path, manifest, pending_file_paths
+
+
+def convert_file(csv_file_path, parquet_file_path, batch_size, compression_level, row_group_size, statistics):
+
+	with i.stage('convert', format='parquet') as record:
+		row_count = u.write_tick_parquet_batches(
+			u.read_tick_csv_batches(csv_file_path, batch_size),
+			parquet_file_path,
+			compression_level,
+			row_group_size,
+			statistics,
+		)
+		record.update({
+			'rows_in'       : row_count,
+			'rows_out'      : row_count,
+			'bytes_read'    : i.get_file_size(csv_file_path),
+			'bytes_written' : i.get_file_size(parquet_file_path),
+		})
+	print(f'\tFile written: {parquet_file_path}')
+
+	return {
+		**u.get_file_stat(csv_file_path),
+		'sha256' : u.get_file_hash(csv_file_path),
+		'output' : os.path.basename(parquet_file_path),
+		'rows'   : row_count,
+	}
 
 
 def main():
@@ -40,29 +95,78 @@ def main():
 		type    = str,
 		help    = 'Output tick data Parquet directory path'
 	)
+	parser.add_argument('-z', '--compression_level',
+		default = u.PARQUET_COMPRESSION_LEVEL,
+		type    = int,
+		help    = f'Zstd compression level (default: {u.PARQUET_COMPRESSION_LEVEL})'
+	)
+	parser.add_argument('-r', '--row_group_size',
+		default = u.PARQUET_ROW_GROUP_SIZE,
+		type    = int,
+		help    = f'Max rows per Parquet row group (default: {u.PARQUET_ROW_GROUP_SIZE})'
+	)
+	parser.add_argument('--no_statistics',
+		dest   = 'statistics',
+		action = 'store_false',
+		help   = 'Do not write column statistics'
+	)
+	parser.add_argument('-b', '--batch_size',
+		default = u.TICK_CSV_BATCH_SIZE,
+		type    = int,
+		help    = f'Rows read from a CSV file per batch (default: {u.TICK_CSV_BATCH_SIZE})'
+	)
+	parser.add_argument('-w', '--workers',
+		type    = int,
+		default = 1,
+		help    = 'Number of worker processes'
+	)
+	parser.add_argument('--force',
+		action = 'store_true',
+		help   = 'Convert all files, even those with an up-to-date Parquet output'
+	)
+
+	i.add_arguments(parser)
 
 	args = parser.parse_args()
+	i.configure(args, 'convert_tick_data_csv2parquet')
 
 	print(f'input directory  : {args.input_directory_path}')
 	print(f'output directory : {args.output_directory_path}')
 	fu.create_local_folder(args.output_directory_path)
 
+	settings = {
+		'compression_level' : args.compression_level,
+		'row_group_size'    : args.row_group_size,
+		'statistics'        : args.statistics,
+	}
+	work_units = []
+	manifests  = {}
 	for symbol_idx, symbol in enumerate(args.symbols):
 		print(f'[{symbol_idx+1}/{len(args.symbols)}] Processing {symbol=}.')
 
 		csv_file_paths = fu.read_file_paths_by_extension(os.path.join(args.input_directory_path, symbol), '*.csv')
 		print(f'\tFound files: {len(csv_file_paths)}')
 
-		for csv_file_path in csv_file_paths:
-			parquet_directory_path = os.path.join(args.output_directory_path, symbol)
-			parquet_file_path      = os.path.join(parquet_directory_path, os.path.basename(csv_file_path).replace('.csv', '.parquet'))
-
-			fu.create_local_folder(parquet_directory_path)
-
-			df = pl.read_csv(csv_file_path, infer_schema=False)
-			df.write_parquet(parquet_file_path)
-
-			print(f'\tFile written: {parquet_file_path}')
+		parquet_directory_path = os.path.join(args.output_directory_path, symbol)
+		fu.create_local_folder(parquet_directory_path)
+
+		manifest_file_path, manifest, pending_file_paths = plan_symbol_files(csv_file_paths, parquet_directory_path, settings, args.force)
+		manifests[manifest_file_path] = manifest
+		print(f'\tUp to date : {len(csv_file_paths) - len(pending_file_paths)} files')
+
+		for csv_file_path in pending_file_paths:
+			work_units.append({
+				'label'         : f'Converting {symbol=}: {os.path.basename(csv_file_path)}',
+				'weight'        : os.path.getsize(csv_file_path),
+				'function'      : convert_file,
+				'args'          : (csv_file_path, get_parquet_file_path(parquet_directory_path, csv_file_path), args.batch_size, args.compression_level, args.row_group_size, args.statistics),
+				'manifest_path' : manifest_file_path,
+				'manifest_key'  : os.path.basename(csv_file_path),
+			})
+
+	for work_unit, result in u.run_work_units(work_units, args.workers):
+		manifests[work_unit['manifest_path']]['files'][work_unit['manifest_key']] = result
+		u.write_json_file(work_unit['manifest_path'], manifests[work_unit['manifest_path']])
 
 
 if __name__ == "__main__":
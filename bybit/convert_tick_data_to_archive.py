@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+
+import os
+import sys
+import argparse
+import numpy as np
+from decimal import Decimal
+
+REPO_ROOT_DIRECTORY_PATH = os.path.commonpath([os.getcwd(), os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))])
+LIBRARIES_DIRECTORY_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../libs/python'))
+
+sys.path.append(REPO_ROOT_DIRECTORY_PATH)
+sys.path.append(LIBRARIES_DIRECTORY_PATH)
+
+import data_config as dc
+import file_utils as fu
+import arg_utils as au
+import catalog as c
+import instrumentation as i
+import tick_archive as ta
+import utils as u
+
+
+INPUT_DIRECTORY_NAMES = {
+	'csv'     : dc.DIRECTORY_NAME__TICK_CSV,
+	'parquet' : dc.DIRECTORY_NAME__TICK_PARQUET,
+}
+
+
+def get_price_tick(symbol, input_file_paths, input_format):
+
+	# Only the prices are read, so one pass over every day finds a tick size that all of them are multiples of
+	price_tick = 0
+	max_price  = 0
+	for input_file_path in input_file_paths:
+		prices     = u.scan_symbol_ticks([input_file_path], symbol, input_format).select(u.to_fixed_point('price', u.PRICE_SCALE)).collect().get_column('price').to_numpy()
+		price_tick = int(np.gcd(price_tick, ta.get_price_tick(prices)))
+		max_price  = max(max_price, int(prices.max(initial=0)))
+
+	if price_tick and max_price // price_tick > np.iinfo(ta.ARCHIVE_COLUMN_DTYPES['price']).max:
+		raise ValueError(f'Prices of {symbol} in units of {price_tick} do not fit {ta.ARCHIVE_COLUMN_DTYPES["price"]}')
+
+	return price_tick
+
+
+def convert_symbol(symbol, input_file_paths, input_format, archive_directory_path, price_tick):
+
+	if not input_file_paths:
+		return None
+
+	archive_writer = ta.open_archive_writer(archive_directory_path, symbol, price_tick or get_price_tick(symbol, input_file_paths, input_format))
+	for input_file_path in input_file_paths:
+		with i.stage('convert', format='archive') as record:
+			df = u.read_and_concat_dataframes([input_file_path], symbol, input_format, fixed_point=True, native_datetime=True)
+			ta.write_archive_ticks(archive_writer, df)
+			record.update(rows_in=df.height, rows_out=df.height, bytes_read=i.get_file_size(input_file_path))
+		print(f'\tFile archived : {input_file_path}')
+
+	ta.close_archive_writer(archive_writer)
+	archive_file_paths = [os.path.join(archive_directory_path, file_name) for file_name in os.listdir(archive_directory_path)]
+	print(f'\tArchive       : {archive_directory_path}')
+	print(f'\tRows          : {archive_writer["rows"]} ({i.get_file_size(archive_file_paths)} bytes)')
+
+	return archive_writer['rows']
+
+
+def main():
+
+	parser = argparse.ArgumentParser(description='ByBit tick data converter (to a memory-mappable binary archive).')
+	parser.add_argument('-s', '--symbols',
+		nargs    = '+',
+		required = True,
+		type     = str,
+		help     = 'Symbols'
+	)
+	parser.add_argument('-i', '--input_directory_path',
+		type    = str,
+		help    = 'Tick data directory path (default: the tick directory of the input format)'
+	)
+	parser.add_argument('-f', '--format',
+		default = 'parquet',
+		choices = au.ALLOWED_FORMATS,
+		help    = 'Input tick data format'
+	)
+	parser.add_argument('-o', '--output_directory_path',
+		default = os.path.join(REPO_ROOT_DIRECTORY_PATH, dc.BASE_DIRECTORY__DATA, ta.ARCHIVE_DIRECTORY_NAME),
+		type    = str,
+		help    = 'Output archive directory path, each symbol is written to its own subdirectory'
+	)
+	parser.add_argument('-t', '--price_tick',
+		type    = Decimal,
+		help    = 'Instrument price tick size, prices are stored as multiples of it (default: greatest common divisor of all prices)'
+	)
+	parser.add_argument('-w', '--workers',
+		type    = int,
+		default = 1,
+		help    = 'Number of worker processes'
+	)
+	i.add_arguments(parser)
+
+	args = parser.parse_args()
+	i.configure(args, 'convert_tick_data_to_archive')
+
+	input_directory_path = args.input_directory_path or os.path.join(REPO_ROOT_DIRECTORY_PATH, dc.BASE_DIRECTORY__DATA, INPUT_DIRECTORY_NAMES[args.format])
+	price_tick           = int(args.price_tick * 10 ** u.PRICE_SCALE) if args.price_tick is not None else None
+	print(f'input directory  : {input_directory_path}')
+	print(f'output directory : {args.output_directory_path}')
+	fu.create_local_folder(args.output_directory_path)
+
+	work_units = []
+	for symbol_idx, symbol in enumerate(args.symbols):
+		print(f'[{symbol_idx+1}/{len(args.symbols)}] Processing {symbol=}.')
+
+		# Days are appended in time order, so files are ordered by their first trade rather than by name
+		catalog_entries  = c.locate_files(os.path.join(input_directory_path, symbol), args.format)
+		catalog_entries  = sorted(
+			[catalog_entry for catalog_entry in catalog_entries if catalog_entry['min_timestamp'] is not None],
+			key = lambda catalog_entry: Decimal(catalog_entry['min_timestamp']),
+		)
+		input_file_paths = [catalog_entry['file_path'] for catalog_entry in catalog_entries]
+		print(f'\tFound files: {len(input_file_paths)}')
+
+		work_units.append({
+			'label'    : f'Archiving {symbol=}',
+			'weight'   : sum(catalog_entry['size'] for catalog_entry in catalog_entries),
+			'function' : convert_symbol,
+			'args'     : (symbol, input_file_paths, args.format, os.path.join(args.output_directory_path, symbol), price_tick),
+		})
+
+	for _ in u.run_work_units(work_units, args.workers):
+		pass
+
+
+if __name__ == "__main__":
+	main()
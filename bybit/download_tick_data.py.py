@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 
 
+import urllib.error
 import urllib.request
+import http.client
 import os
 import re
 import sys
+import zlib
 import gzip
+import shutil
 import time
 import argparse
+import contextlib
 import requests
 from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
@@ -20,12 +25,18 @@ sys.path.append(LIBRARIES_DIRECTORY_PATH)
 
 import data_config as dc
 import file_utils as fu
+import arg_utils as au
+import instrumentation as i
+import utils as u
 
 
 BASE_URL     = 'https://public.bybit.com/trading/'
 TEMPLATE     = '{symbol}/{symbol}{date}'
 EXTENSION    = '.csv.gz'
 DATE_PATTERN = r'\d{4}-\d{2}-\d{2}'
+CHUNK_SIZE   = 1024 * 1024
+
+CONTENT_RANGE_PATTERN = r'^bytes (\d+)-\d+/(?:\d+|\*)$'
 
 
 def get_csv_details(url):
@@ -45,24 +56,72 @@ def get_formatted_csv_file_path(csvgz_file_path):
 	return f'{csv_file_path_base}.{csv_date}.csv'
 
 
+def get_content_range_start(content_range):
+	hit = re.match(CONTENT_RANGE_PATTERN, content_range or '')
+	return int(hit.group(1)) if hit else None
+
+
+@contextlib.contextmanager
+def decoding_csvgz_file(csvgz_file_path):
+	# Archives are verified by the one pass that decodes them, a truncated one goes back to .part to be resumed
+	try:
+		yield
+	except EOFError as e:
+		os.replace(csvgz_file_path, f'{csvgz_file_path}.part')
+		raise IOError(f'Truncated download: {csvgz_file_path}') from e
+	except (gzip.BadGzipFile, zlib.error) as e:
+		os.remove(csvgz_file_path)
+		raise IOError(f'Corrupt download: {csvgz_file_path}') from e
+
+
 def download_csvgz_file(url, local_path):
+	if fu.file_exists(local_path):
+		return
+
+	part_file_path = f'{local_path}.part'
+	offset         = os.path.getsize(part_file_path) if fu.file_exists(part_file_path) else 0
+	request        = urllib.request.Request(url, headers={'Range': f'bytes={offset}-'} if offset else {})
+	expected_size  = None
 	time.sleep(0.1)
-	with urllib.request.urlopen(url) as response, open(local_path, 'wb') as out_file:
-		data = response.read()
-		out_file.write(data)
+	try:
+		with urllib.request.urlopen(request) as response:
+			if response.status != 206:
+				offset = 0
+			elif (range_start := get_content_range_start(response.headers.get('Content-Range'))) != offset:
+				os.remove(part_file_path)
+				raise IOError(f'Unexpected range: {url} (requested {offset}, received {range_start})')
+			content_length = response.headers.get('Content-Length')
+			expected_size  = offset + int(content_length) if content_length is not None else None
+			with open(part_file_path, 'ab' if offset else 'wb') as out_file:
+				shutil.copyfileobj(response, out_file, CHUNK_SIZE)
+	except urllib.error.HTTPError as e:
+		if e.code != 416:
+			raise
+
+	actual_size = os.path.getsize(part_file_path)
+	if expected_size is not None and actual_size != expected_size:
+		raise IOError(f'Incomplete download: {url} ({actual_size}/{expected_size} bytes)')
+	os.replace(part_file_path, local_path)
 
 
 def unpack_csvgz_to_csv(csvgz_file_path, csv_file_path):
-	if fu.file_exists(csv_file_path):
-		os.remove(csv_file_path)
-
+	temporary_file_path = f'{csv_file_path}.tmp'
 	if csvgz_file_path.endswith('.gz'):
 		with gzip.open(csvgz_file_path, 'rb') as f_in:
-			with open(csv_file_path, 'wb') as f_out:
-				f_out.write(f_in.read())
+			with open(temporary_file_path, 'wb') as f_out:
+				shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
+		os.replace(temporary_file_path, csv_file_path)
 		os.remove(csvgz_file_path)
 	else:
-		os.rename(csvgz_file_path, csv_file_path)
+		os.replace(csvgz_file_path, csv_file_path)
+
+
+def convert_csvgz_to_parquet(csvgz_file_path, parquet_file_path):
+	if csvgz_file_path.endswith('.gz'):
+		with gzip.open(csvgz_file_path, 'rb') as f_in:
+			u.write_tick_parquet_batches(u.read_tick_csv_stream_batches(f_in), parquet_file_path)
+	else:
+		u.write_tick_parquet_batches(u.read_tick_csv_batches(csvgz_file_path), parquet_file_path)
 
 
 def get_prev_day(start_date):
@@ -72,21 +131,50 @@ def get_prev_day(start_date):
 		current_date -= timedelta(days=1)
 
 
-def handle_download(symbol_folder_path, filename, url):
-
-	csvgz_file_path = os.path.join(symbol_folder_path, filename)
-	csv_file_path   = get_formatted_csv_file_path(csvgz_file_path)
-	if not fu.file_exists(csv_file_path):
-		download_csvgz_file(url, csvgz_file_path)
-		unpack_csvgz_to_csv(csvgz_file_path, csv_file_path)
-		print(f"Downloaded '{url}' --> '{csv_file_path}'")
+def handle_download(symbol_folder_paths, filename, url):
+
+	csvgz_file_path   = os.path.join(symbol_folder_paths.get('csv', symbol_folder_paths.get('parquet')), filename)
+	csv_file_path     = get_formatted_csv_file_path(csvgz_file_path)
+	output_file_paths = {
+		export_format : os.path.join(symbol_folder_path, os.path.basename(csv_file_path).replace('.csv', f'.{export_format}'))
+		for export_format, symbol_folder_path in symbol_folder_paths.items()
+	}
+	if not all(fu.file_exists(output_file_path) for output_file_path in output_file_paths.values()):
+		# The archive is decoded once, Parquet is converted from the unpacked CSV when both are exported,
+		# and a CSV unpacked by an earlier run whose conversion failed is converted without a download
+		source_file_path = output_file_paths.get('csv')
+		if not source_file_path or not fu.file_exists(source_file_path):
+			with i.stage('download') as record:
+				download_csvgz_file(url, csvgz_file_path)
+				record['bytes_written'] = i.get_file_size(csvgz_file_path)
+			source_file_path = csvgz_file_path
+			if 'csv' in output_file_paths:
+				with i.stage('unpack', format='csv') as record, decoding_csvgz_file(csvgz_file_path):
+					record['bytes_read'] = i.get_file_size(csvgz_file_path)
+					unpack_csvgz_to_csv(csvgz_file_path, output_file_paths['csv'])
+					record['bytes_written'] = i.get_file_size(output_file_paths['csv'])
+				source_file_path = output_file_paths['csv']
+		if 'parquet' in output_file_paths and not fu.file_exists(output_file_paths['parquet']):
+			# A file with values outside the tick schema fails alone, its download or CSV is kept for a later run
+			try:
+				with i.stage('convert', format='parquet') as record, decoding_csvgz_file(source_file_path):
+					convert_csvgz_to_parquet(source_file_path, output_file_paths['parquet'])
+					record['bytes_read']    = i.get_file_size(source_file_path)
+					record['bytes_written'] = i.get_file_size(output_file_paths['parquet'])
+			except ValueError as e:
+				print(f"Failed '{url}': {e}")
+				return
+		if source_file_path == csvgz_file_path:
+			os.remove(csvgz_file_path)
+		print(f"Downloaded '{url}' --> {list(output_file_paths.values())}")
 	else:
-		print(f"Skipped '{url}'. Already exists: '{csv_file_path}'")
+		print(f"Skipped '{url}'. Already exists: {list(output_file_paths.values())}")
 
 
 def main():
 
-	default_output_directory_base = os.path.join(REPO_ROOT_DIRECTORY_PATH, dc.BASE_DIRECTORY__DATA, dc.DIRECTORY_NAME__TICK_CSV)
+	default_output_directory_base  = os.path.join(REPO_ROOT_DIRECTORY_PATH, dc.BASE_DIRECTORY__DATA, dc.DIRECTORY_NAME__TICK_CSV)
+	default_parquet_directory_base = os.path.join(REPO_ROOT_DIRECTORY_PATH, dc.BASE_DIRECTORY__DATA, dc.DIRECTORY_NAME__TICK_PARQUET)
 
 	parser = argparse.ArgumentParser(
 		description='ByBit tick data downloader.'
@@ -101,6 +189,17 @@ def main():
 		type    = str,
 		help    = 'Download directory path',
 	)
+	parser.add_argument('-p', '--parquet_directory_path',
+		default = default_parquet_directory_base,
+		type    = str,
+		help    = 'Typed Parquet output directory path',
+	)
+	parser.add_argument('-e', '--exports',
+		nargs   = '+',
+		default = ['csv'],
+		type    = au.supported_file_formats,
+		help    = f'Store downloads as any of the supported formats: {au.ALLOWED_FORMATS}',
+	)
 	parser.add_argument('-b', '--backfill',
 		action = 'store_true',
 		help   = 'Backfill hidden',
@@ -110,7 +209,10 @@ def main():
 		help = 'Skips downloads by the dates of file names from the specified directory <TICKER>.<YYYY-MM-DD>.<format>.',
 	)
 
+	i.add_arguments(parser)
+
 	args     = parser.parse_args()
+	i.configure(args, 'download_tick_data')
 	response = requests.get(BASE_URL)
 	soup     = BeautifulSoup(response.text, 'html.parser')
 	links    = soup.find_all('a')
@@ -119,8 +221,14 @@ def main():
 	if args.symbols:
 		symbols = [t for t in symbols if t in args.symbols]
 
+	output_directory_paths = {
+		'csv'     : args.output_directory_path,
+		'parquet' : args.parquet_directory_path,
+	}
+	output_directory_paths = {export_format : output_directory_paths[export_format] for export_format in args.exports}
 	if symbols:
-		fu.create_local_folder(args.output_directory_path)
+		for output_directory_path in output_directory_paths.values():
+			fu.create_local_folder(output_directory_path)
 
 	for symbol_idx, symbol in enumerate(symbols, start=1):
 
@@ -148,12 +256,16 @@ def main():
 			print('\tDone.')
 			continue
 
-		symbol_folder_path  = os.path.join(args.output_directory_path, symbol)
-		fu.create_local_folder(symbol_folder_path)
+		symbol_folder_paths = {export_format : os.path.join(output_directory_path, symbol) for export_format, output_directory_path in output_directory_paths.items()}
+		for symbol_folder_path in symbol_folder_paths.values():
+			fu.create_local_folder(symbol_folder_path)
 
 		for file_idx, detail in enumerate(details, start=1):
 			print(f'\t[{file_idx}/{len(details)}] ', end='')
-			handle_download(symbol_folder_path, detail['file'], detail['url'])
+			try:
+				handle_download(symbol_folder_paths, detail['file'], detail['url'])
+			except (IOError, http.client.HTTPException) as e:
+				print(f"Failed '{detail['url']}': {e}")
 
 		if not args.backfill:
 			continue
@@ -166,7 +278,7 @@ def main():
 				print(f'\t[{hidden_date}] ', end='')
 				filename = '{symbol}{date}{ext}'.format(symbol=symbol, date=hidden_date, ext=EXTENSION)
 				url      = f'{BASE_URL}{TEMPLATE}{EXTENSION}'.format(symbol=symbol, date=hidden_date)
-				handle_download(symbol_folder_path, filename, url)
+				handle_download(symbol_folder_paths, filename, url)
 			except:
 				print('Not Found.')
 				tolerance -= 1
@@ -4,8 +4,11 @@
 import os
 import re
 import sys
+import zlib
 import gzip
+import shutil
 import argparse
+import contextlib
 import requests
 import asyncio
 from aiohttp import ClientSession
@@ -19,10 +22,16 @@ sys.path.append(LIBRARIES_DIRECTORY_PATH)
 
 import data_config as dc
 import file_utils as fu
+import arg_utils as au
+import instrumentation as i
+import utils as u
 
 
 BASE_URL     = 'https://public.bybit.com/trading/'
 DATE_PATTERN = r'\d{4}-\d{2}-\d{2}'
+CHUNK_SIZE   = 1024 * 1024
+
+CONTENT_RANGE_PATTERN = r'^bytes (\d+)-\d+/(?:\d+|\*)$'
 
 
 async def get_csv_details(url):
@@ -43,43 +52,118 @@ def get_formatted_csv_file_path(csvgz_file_path):
 	return f'{csv_file_path_base}.{csv_date}.csv'
 
 
+def get_content_range_start(content_range):
+	hit = re.match(CONTENT_RANGE_PATTERN, content_range or '')
+	return int(hit.group(1)) if hit else None
+
+
+@contextlib.contextmanager
+def decoding_csvgz_file(csvgz_file_path):
+	# Archives are verified by the one pass that decodes them, a truncated one goes back to .part to be resumed
+	try:
+		yield
+	except EOFError as e:
+		os.replace(csvgz_file_path, f'{csvgz_file_path}.part')
+		raise IOError(f'Truncated download: {csvgz_file_path}') from e
+	except (gzip.BadGzipFile, zlib.error) as e:
+		os.remove(csvgz_file_path)
+		raise IOError(f'Corrupt download: {csvgz_file_path}') from e
+
+
 async def download_csvgz_file(session, url, local_path, semaphore):
-	async with session.get(url) as response:
-		data = await response.read()
-		with open(local_path, 'wb') as out_file:
-			out_file.write(data)
+	if fu.file_exists(local_path):
+		return
+
+	part_file_path = f'{local_path}.part'
+	offset         = os.path.getsize(part_file_path) if fu.file_exists(part_file_path) else 0
+	headers        = {'Range': f'bytes={offset}-'} if offset else {}
+	expected_size  = None
+	async with session.get(url, headers=headers) as response:
+		if response.status != 416:
+			response.raise_for_status()
+			if response.status != 206:
+				offset = 0
+			elif (range_start := get_content_range_start(response.headers.get('Content-Range'))) != offset:
+				os.remove(part_file_path)
+				raise IOError(f'Unexpected range: {url} (requested {offset}, received {range_start})')
+			if response.content_length is not None:
+				expected_size = offset + response.content_length
+			with open(part_file_path, 'ab' if offset else 'wb') as out_file:
+				async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+					out_file.write(chunk)
+
+	actual_size = os.path.getsize(part_file_path)
+	if expected_size is not None and actual_size != expected_size:
+		raise IOError(f'Incomplete download: {url} ({actual_size}/{expected_size} bytes)')
+	os.replace(part_file_path, local_path)
 
 
 def unpack_csvgz_to_csv(csvgz_file_path, csv_file_path):
-	if fu.file_exists(csv_file_path):
-		os.remove(csv_file_path)
-
+	temporary_file_path = f'{csv_file_path}.tmp'
 	if csvgz_file_path.endswith('.gz'):
 		with gzip.open(csvgz_file_path, 'rb') as f_in:
-			with open(csv_file_path, 'wb') as f_out:
-				f_out.write(f_in.read())
+			with open(temporary_file_path, 'wb') as f_out:
+				shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
+		os.replace(temporary_file_path, csv_file_path)
 		os.remove(csvgz_file_path)
 	else:
-		os.rename(csvgz_file_path, csv_file_path)
+		os.replace(csvgz_file_path, csv_file_path)
+
+
+def convert_csvgz_to_parquet(csvgz_file_path, parquet_file_path):
+	if csvgz_file_path.endswith('.gz'):
+		with gzip.open(csvgz_file_path, 'rb') as f_in:
+			u.write_tick_parquet_batches(u.read_tick_csv_stream_batches(f_in), parquet_file_path)
+	else:
+		u.write_tick_parquet_batches(u.read_tick_csv_batches(csvgz_file_path), parquet_file_path)
 
 
-async def process_urls(session, semaphore, symbol_folder_path, csvgz_file_name, url, file_idx, url_count):
+async def process_urls(session, semaphore, symbol_folder_paths, csvgz_file_name, url, file_idx, url_count):
 
-	prefix          = f'\t[{file_idx}/{url_count}]'
-	csvgz_file_path = os.path.join(symbol_folder_path, csvgz_file_name)
-	csv_file_path   = get_formatted_csv_file_path(csvgz_file_path)
-	if not fu.file_exists(csv_file_path):
+	prefix            = f'\t[{file_idx}/{url_count}]'
+	csvgz_file_path   = os.path.join(symbol_folder_paths.get('csv', symbol_folder_paths.get('parquet')), csvgz_file_name)
+	csv_file_path     = get_formatted_csv_file_path(csvgz_file_path)
+	output_file_paths = {
+		export_format : os.path.join(symbol_folder_path, os.path.basename(csv_file_path).replace('.csv', f'.{export_format}'))
+		for export_format, symbol_folder_path in symbol_folder_paths.items()
+	}
+	if not all(fu.file_exists(output_file_path) for output_file_path in output_file_paths.values()):
 		async with semaphore:
-			await download_csvgz_file(session, url, csvgz_file_path, semaphore)
-			unpack_csvgz_to_csv(csvgz_file_path, csv_file_path)
-			print(f"{prefix} Downloaded '{url}' --> '{csv_file_path}'")
+			# The archive is decoded once, Parquet is converted from the unpacked CSV when both are exported,
+			# and a CSV unpacked by an earlier run whose conversion failed is converted without a download
+			source_file_path = output_file_paths.get('csv')
+			if not source_file_path or not fu.file_exists(source_file_path):
+				with i.stage('download') as record:
+					await download_csvgz_file(session, url, csvgz_file_path, semaphore)
+					record['bytes_written'] = i.get_file_size(csvgz_file_path)
+				source_file_path = csvgz_file_path
+				if 'csv' in output_file_paths:
+					with i.stage('unpack', format='csv') as record, decoding_csvgz_file(csvgz_file_path):
+						record['bytes_read'] = i.get_file_size(csvgz_file_path)
+						unpack_csvgz_to_csv(csvgz_file_path, output_file_paths['csv'])
+						record['bytes_written'] = i.get_file_size(output_file_paths['csv'])
+					source_file_path = output_file_paths['csv']
+			if 'parquet' in output_file_paths and not fu.file_exists(output_file_paths['parquet']):
+				# A file with values outside the tick schema fails alone, its download or CSV is kept for a later run
+				try:
+					with i.stage('convert', format='parquet') as record, decoding_csvgz_file(source_file_path):
+						await asyncio.to_thread(convert_csvgz_to_parquet, source_file_path, output_file_paths['parquet'])
+						record['bytes_read']    = i.get_file_size(source_file_path)
+						record['bytes_written'] = i.get_file_size(output_file_paths['parquet'])
+				except ValueError as e:
+					print(f"{prefix} Failed '{url}': {e}")
+					return
+			if source_file_path == csvgz_file_path:
+				os.remove(csvgz_file_path)
+			print(f"{prefix} Downloaded '{url}' --> {list(output_file_paths.values())}")
 	else:
-		print(f"{prefix} Skipped '{url}'. Already exists: '{csv_file_path}'")
+		print(f"{prefix} Skipped '{url}'. Already exists: {list(output_file_paths.values())}")
 
 
 async def main():
 
-	default_output_directory_base = os.path.join(REPO_ROOT_DIRECTORY_PATH, dc.BASE_DIRECTORY__DATA, dc.DIRECTORY_NAME__TICK_CSV)
+	default_output_directory_base  = os.path.join(REPO_ROOT_DIRECTORY_PATH, dc.BASE_DIRECTORY__DATA, dc.DIRECTORY_NAME__TICK_CSV)
+	default_parquet_directory_base = os.path.join(REPO_ROOT_DIRECTORY_PATH, dc.BASE_DIRECTORY__DATA, dc.DIRECTORY_NAME__TICK_PARQUET)
 
 	parser = argparse.ArgumentParser(
 		description='ByBit tick data downloader.'
@@ -94,6 +178,17 @@ async def main():
 		type    = str,
 		help    = 'Download directory path',
 	)
+	parser.add_argument('-p', '--parquet_directory_path',
+		default = default_parquet_directory_base,
+		type    = str,
+		help    = 'Typed Parquet output directory path',
+	)
+	parser.add_argument('-e', '--exports',
+		nargs   = '+',
+		default = ['csv'],
+		type    = au.supported_file_formats,
+		help    = f'Store downloads as any of the supported formats: {au.ALLOWED_FORMATS}',
+	)
 	parser.add_argument('-i', '--ignore_downloads_by_directory',
 		type = str,
 		help = 'Skips downloads by the dates of file names from the specified directory <TICKER>.<YYYY-MM-DD>.<format>.',
@@ -104,7 +199,10 @@ async def main():
 		help    = 'Max concurrent downloads',
 	)
 
+	i.add_arguments(parser)
+
 	args     = parser.parse_args()
+	i.configure(args, 'download_tick_data_async')
 	response = requests.get(BASE_URL)
 	soup     = BeautifulSoup(response.text, 'html.parser')
 	links    = soup.find_all('a')
@@ -113,8 +211,14 @@ async def main():
 	if args.symbols:
 		symbols = [t for t in symbols if t in args.symbols]
 
+	output_directory_paths = {
+		'csv'     : args.output_directory_path,
+		'parquet' : args.parquet_directory_path,
+	}
+	output_directory_paths = {export_format : output_directory_paths[export_format] for export_format in args.exports}
 	if symbols:
-		fu.create_local_folder(args.output_directory_path)
+		for output_directory_path in output_directory_paths.values():
+			fu.create_local_folder(output_directory_path)
 
 	for symbol_idx, symbol in enumerate(symbols, start=1):
 
@@ -142,16 +246,21 @@ async def main():
 			print('\tDone.')
 			continue
 
-		symbol_folder_path  = os.path.join(args.output_directory_path, symbol)
-		fu.create_local_folder(symbol_folder_path)
+		symbol_folder_paths = {export_format : os.path.join(output_directory_path, symbol) for export_format, output_directory_path in output_directory_paths.items()}
+		for symbol_folder_path in symbol_folder_paths.values():
+			fu.create_local_folder(symbol_folder_path)
 
 		semaphore = asyncio.Semaphore(args.concurrency)
-		async with ClientSession() as session:
+		async with ClientSession(auto_decompress=False) as session:
 			tasks = []
 			for file_idx, detail in enumerate(details, start=1):
-				coro = process_urls(session, semaphore, symbol_folder_path, detail['file'], detail['url'], file_idx, len(details))
+				coro = process_urls(session, semaphore, symbol_folder_paths, detail['file'], detail['url'], file_idx, len(details))
 				tasks.append(asyncio.create_task(coro))
-			await asyncio.gather(*tasks)
+			# One failed day is reported without cancelling the others, a later run picks it up again
+			results = await asyncio.gather(*tasks, return_exceptions=True)
+			for detail, result in zip(details, results):
+				if isinstance(result, Exception):
+					print(f"\tFailed '{detail['url']}': {result!r}")
 
 
 if __name__ == '__main__':
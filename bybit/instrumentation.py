@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import atexit
+import contextlib
+import polars as pl
+from datetime import datetime, timezone
+
+
+METRICS_ENABLED_ENVIRONMENT_VARIABLE = 'BYBIT_METRICS_ENABLED'
+
+PROMETHEUS_FILE_EXTENSION = '.prom'
+PROMETHEUS_METRIC_PREFIX  = 'bybit_stage'
+
+COUNTER_FIELDS = ['seconds', 'rows_in', 'rows_out', 'bytes_read', 'bytes_written']
+LABEL_FIELDS   = ['script', 'stage', 'timeframe', 'format', 'table', 'layout']
+
+PLAN_NODE_STAGES = [
+	('parquet(', 'scan'),
+	('csv(', 'scan'),
+	('filter', 'filter'),
+	('sort', 'sort'),
+]
+PLAN_NODE_DEFAULT_STAGE = 'convert'
+
+STATE = {
+	'script'            : None,
+	'started_at'        : None,
+	'profile'           : False,
+	'metrics_file_path' : None,
+	'records'           : [],
+}
+
+
+def is_enabled():
+
+	return os.environ.get(METRICS_ENABLED_ENVIRONMENT_VARIABLE) == '1'
+
+
+def get_peak_rss_bytes():
+
+	try:
+		import resource
+	except ImportError:
+		try:
+			import psutil
+			return psutil.Process().memory_info().peak_wset
+		except (ImportError, AttributeError):
+			return None
+
+	peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+	return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def get_file_size(file_paths):
+
+	file_paths = [file_paths] if isinstance(file_paths, str) else file_paths
+
+	return sum(os.path.getsize(file_path) for file_path in file_paths if os.path.isfile(file_path))
+
+
+def add_record(stage_name, seconds, **fields):
+
+	if not is_enabled():
+		return
+
+	STATE['records'].append({
+		'stage'          : stage_name,
+		**fields,
+		'seconds'        : seconds,
+		'peak_rss_bytes' : get_peak_rss_bytes(),
+		'pid'            : os.getpid(),
+	})
+
+
+@contextlib.contextmanager
+def stage(stage_name, **fields):
+
+	# The caller fills rows and bytes into the yielded record, which is dropped when metrics are off
+	record = dict(fields)
+	if not is_enabled():
+		yield record
+		return
+
+	started = time.perf_counter()
+	try:
+		yield record
+	finally:
+		add_record(stage_name, time.perf_counter() - started, **record)
+
+
+def get_plan_node_stage(node):
+
+	return next((stage_name for prefix, stage_name in PLAN_NODE_STAGES if node.startswith(prefix)), PLAN_NODE_DEFAULT_STAGE)
+
+
+def collect(lf, stage_name, **fields):
+
+	if not is_enabled():
+		return lf.collect()
+
+	# Filter, sort and conversions are fused into one plan, so their share is taken from its profile
+	df, profile_df = lf.profile()
+	profile_df     = profile_df.filter(pl.col('node') != 'optimization').with_columns(
+		pl.col('node').map_elements(get_plan_node_stage, return_dtype=pl.Utf8).alias('stage'),
+		((pl.col('end') - pl.col('start')) / 1_000_000).alias('seconds'),
+	)
+	for node_stage, seconds in profile_df.group_by('stage', maintain_order=True).agg(pl.col('seconds').sum()).iter_rows():
+		add_record(f'{stage_name}.{node_stage}', seconds, **fields)
+
+	return df
+
+
+def pop_records():
+
+	records, STATE['records'] = STATE['records'], []
+
+	return records
+
+
+def add_records(records):
+
+	STATE['records'].extend(records)
+
+
+def add_arguments(parser):
+
+	parser.add_argument('--profile',
+		action  = 'store_true',
+		help    = 'Print time, rows, bytes and peak RSS of every stage at exit',
+	)
+	parser.add_argument('--metrics_file',
+		type    = str,
+		help    = f'Append stage metrics as JSON lines, or write a Prometheus textfile if the name ends with {PROMETHEUS_FILE_EXTENSION}',
+	)
+
+
+def configure(args, script_name):
+
+	if not (args.profile or args.metrics_file):
+		return
+
+	# Worker processes inherit the environment, so they record their stages too
+	os.environ[METRICS_ENABLED_ENVIRONMENT_VARIABLE] = '1'
+	STATE.update({
+		'script'            : script_name,
+		'started_at'        : datetime.now(timezone.utc).isoformat(timespec='seconds'),
+		'profile'           : args.profile,
+		'metrics_file_path' : args.metrics_file,
+	})
+	atexit.register(report)
+
+
+def summarize_records(records):
+
+	summaries = {}
+	for record in records:
+		labels  = tuple((field, str(record[field])) for field in LABEL_FIELDS if record.get(field) is not None)
+		summary = summaries.setdefault(labels, {'count': 0, 'peak_rss_bytes': 0, **dict.fromkeys(COUNTER_FIELDS, 0)})
+		summary['count'] += 1
+		summary['peak_rss_bytes'] = max(summary['peak_rss_bytes'], record.get('peak_rss_bytes') or 0)
+		for field in COUNTER_FIELDS:
+			summary[field] += record.get(field) or 0
+
+	return summaries
+
+
+def write_json_lines(file_path, records):
+
+	with open(file_path, 'a') as out_file:
+		for record in records:
+			out_file.write(json.dumps(record, sort_keys=True, default=str) + '\n')
+
+
+def write_prometheus_textfile(file_path, records):
+
+	lines = []
+	for field in [*COUNTER_FIELDS, 'peak_rss_bytes', 'count']:
+		metric_name = f'{PROMETHEUS_METRIC_PREFIX}_{field}'
+		lines.append(f'# TYPE {metric_name} gauge')
+		for labels, summary in summarize_records(records).items():
+			label_text = ','.join(f'{name}="{value}"' for name, value in labels)
+			lines.append(f'{metric_name}{{{label_text}}} {summary[field]}')
+
+	# The textfile collector may read at any time, so the file is replaced in one step
+	temporary_file_path = f'{file_path}.tmp'
+	with open(temporary_file_path, 'w') as out_file:
+		out_file.write('\n'.join(lines) + '\n')
+	os.replace(temporary_file_path, file_path)
+
+
+def print_summary(records):
+
+	print(f'\n{"stage":<44} {"count":>6} {"seconds":>10} {"rows in":>12} {"rows out":>12} {"MB read":>10} {"MB written":>10} {"peak RSS MB":>12}')
+	for labels, summary in summarize_records(records).items():
+		name = ' '.join(value for field, value in labels if field != 'script')
+		print(
+			f'{name:<44} {summary["count"]:>6} {summary["seconds"]:>10.3f} {summary["rows_in"]:>12} {summary["rows_out"]:>12}'
+			f' {summary["bytes_read"] / 1024 / 1024:>10.1f} {summary["bytes_written"] / 1024 / 1024:>10.1f} {summary["peak_rss_bytes"] / 1024 / 1024:>12.1f}'
+		)
+
+
+def report():
+
+	records = [
+		{'script': STATE['script'], 'started_at': STATE['started_at'], **record}
+		for record in pop_records()
+	]
+
+	if STATE['metrics_file_path']:
+		if STATE['metrics_file_path'].endswith(PROMETHEUS_FILE_EXTENSION):
+			write_prometheus_textfile(STATE['metrics_file_path'], records)
+		else:
+			write_json_lines(STATE['metrics_file_path'], records)
+
+	if STATE['profile']:
+		print_summary(records)
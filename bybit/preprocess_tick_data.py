@@ -18,27 +18,132 @@ import data_config as dc
 import file_utils as fu
 import arg_utils as au
 import errors as e
+import catalog as c
+import instrumentation as i
 import utils as u
 
 
-def write_files(symbol, df, date_info, export_args, output_paths):
+INCREMENTAL_DIRECTORY_SUFFIX = 'incremental'
+MANIFEST_FILE_NAME           = 'manifest.{export_format}.json'
+FILE_FORMAT_LABELS           = {
+	'csv'     : 'CSV files     ',
+	'parquet' : 'Parquet files ',
+}
 
-	print(f'\tDimensions    : {df.shape}')
 
-	if export_args['csv']:
-		output_directory_path = os.path.join(output_paths.get('csv', output_paths.get('_')), f'{symbol}.{date_info}')
-		output_file_name      = os.path.join(output_directory_path, f'{symbol}.{date_info}.csv')
-		fu.create_local_folder(output_directory_path)
-		df.write_csv(output_file_name)
-		print(f'\tFile written  : {output_file_name}')
+def write_files(symbol, lf, date_info, export_args, output_paths):
+
+	written_file_path = None
 
 	if export_args['parquet']:
 		output_directory_path = os.path.join(output_paths.get('parquet', output_paths.get('_')), f'{symbol}.{date_info}')
 		output_file_name      = os.path.join(output_directory_path, f'{symbol}.{date_info}.parquet')
 		fu.create_local_folder(output_directory_path)
-		df.write_parquet(output_file_name)
+		with i.stage('write', timeframe='tick', format='parquet') as record:
+			lf.sink_parquet(output_file_name)
+			record['bytes_written'] = i.get_file_size(output_file_name)
+		written_file_path     = output_file_name
+		print(f'\tFile written  : {output_file_name}')
+
+	if export_args['csv']:
+		if written_file_path:
+			lf = pl.scan_parquet(written_file_path)
+		output_directory_path = os.path.join(output_paths.get('csv', output_paths.get('_')), f'{symbol}.{date_info}')
+		output_file_name      = os.path.join(output_directory_path, f'{symbol}.{date_info}.csv')
+		fu.create_local_folder(output_directory_path)
+		with i.stage('write', timeframe='tick', format='csv') as record:
+			u.format_output_columns(lf).sink_csv(output_file_name)
+			record['bytes_written'] = i.get_file_size(output_file_name)
+		written_file_path     = written_file_path or output_file_name
 		print(f'\tFile written  : {output_file_name}')
 
+	row_count = None
+	if written_file_path:
+		row_count = u.scan_polars_dataframe(written_file_path, written_file_path.split('.')[-1]).select(pl.len()).collect().item()
+		print(f'\tRows          : {row_count}')
+
+	return row_count
+
+
+def process_symbol(symbol, input_file_paths, input_format, export_args, output_paths, fixed_point, native_datetime, interval_info):
+
+	print(f'\t{FILE_FORMAT_LABELS[input_format]}: {len(input_file_paths)}')
+	lf                 = u.scan_and_concat_dataframes(input_file_paths, symbol, input_format, fixed_point, native_datetime)
+	min_date, max_date = interval_info
+	date_info          = f'{min_date}_{len(input_file_paths)}_{max_date}'.replace('-', '')
+	with i.stage('preprocess', format=input_format) as record:
+		record['rows_out']   = write_files(symbol, lf, date_info, export_args, output_paths)
+		record['bytes_read'] = i.get_file_size(input_file_paths)
+
+
+def get_incremental_file_name(input_file_path, export_format):
+
+	return f'{os.path.splitext(os.path.basename(input_file_path))[0]}.{export_format}'
+
+
+def plan_incremental_files(symbol, input_file_paths, export_format, output_paths, fixed_point, native_datetime):
+
+	output_directory_path = os.path.join(output_paths.get(export_format, output_paths.get('_')), f'{symbol}.{INCREMENTAL_DIRECTORY_SUFFIX}')
+	manifest_file_path    = os.path.join(output_directory_path, MANIFEST_FILE_NAME.format(export_format=export_format))
+	fu.create_local_folder(output_directory_path)
+
+	settings = {'fixed_point': fixed_point, 'native_datetime': native_datetime}
+	manifest = u.read_json_file(manifest_file_path, default={'settings': settings, 'files': {}})
+	if manifest['settings'] != settings:
+		manifest = {'settings': settings, 'files': {}}
+
+	pending_file_paths = [
+		input_file_path
+		for input_file_path in input_file_paths
+		if not u.is_manifest_entry_current(
+			manifest['files'].get(os.path.basename(input_file_path)),
+			input_file_path,
+			os.path.join(output_directory_path, get_incremental_file_name(input_file_path, export_format)),
+		)
+	]
+	u.write_json_file(manifest_file_path, manifest)
+	print(f'\tUp to date    : {len(input_file_paths) - len(pending_file_paths)} {export_format} files of {symbol}')
+
+	return manifest_file_path, manifest, output_directory_path, pending_file_paths
+
+
+def write_incremental_file(symbol, input_file_path, input_format, export_format, output_directory_path, fixed_point, native_datetime):
+
+	output_file_name    = get_incremental_file_name(input_file_path, export_format)
+	output_file_path    = os.path.join(output_directory_path, output_file_name)
+	temporary_file_path = f'{output_file_path}.tmp'
+
+	lf = u.scan_and_concat_dataframes([input_file_path], symbol, input_format, fixed_point, native_datetime)
+	with i.stage('write', timeframe='tick', format=export_format) as record:
+		if export_format == 'csv':
+			u.format_output_columns(lf).sink_csv(temporary_file_path)
+		else:
+			lf.sink_parquet(temporary_file_path)
+		os.replace(temporary_file_path, output_file_path)
+		record.update(bytes_read=i.get_file_size(input_file_path), bytes_written=i.get_file_size(output_file_path))
+	print(f'\tFile written  : {output_file_path}')
+
+	return {
+		**u.get_file_stat(input_file_path),
+		'sha256' : u.get_file_hash(input_file_path),
+		'output' : output_file_name,
+		'rows'   : u.scan_polars_dataframe(output_file_path, export_format).select(pl.len()).collect().item(),
+	}
+
+
+def write_hive_date(symbol, date, input_file_paths, input_format, export_args, output_paths, fixed_point, native_datetime):
+
+	# Every source of the day is read, so the partition is replaced by all of its ticks in one write
+	df = u.read_and_concat_dataframes(input_file_paths, symbol, input_format, fixed_point, native_datetime)
+	df = df.filter(u.get_partition_date(df.schema['datetime']) == date)
+	if df.is_empty():
+		return
+
+	for export_format in [export_format for export_format, is_allowed in export_args.items() if is_allowed]:
+		file_path = u.get_hive_partition_path(output_paths.get(export_format, output_paths.get('_')), symbol, 'tick', date, export_format)
+		print(f'\tFile written  : {u.write_hive_partition(df, file_path, export_format)}')
+	print(f'\tRows          : {df.height}')
+
 
 def main():
 
@@ -69,8 +174,32 @@ def main():
 		type    = au.supported_file_formats,
 		help    = f'Export output as any of the supported formats: {au.ALLOWED_FORMATS}'
 	)
+	parser.add_argument('-q', '--fixed_point',
+		action  = 'store_true',
+		help    = 'Keep timestamp, price and size as scaled integers (formatted only in CSV exports)'
+	)
+	parser.add_argument('-d', '--native_datetime',
+		action  = 'store_true',
+		help    = 'Keep datetime as a native temporal column (formatted only in CSV exports)'
+	)
+	parser.add_argument('-n', '--incremental',
+		action  = 'store_true',
+		help    = f'Process only new or changed input files into per-day partitions of the <SYMBOL>.{INCREMENTAL_DIRECTORY_SUFFIX} directory'
+	)
+	parser.add_argument('-w', '--workers',
+		type    = int,
+		default = 1,
+		help    = 'Number of worker processes'
+	)
+	parser.add_argument('-l', '--layout',
+		default = 'file',
+		choices = u.OUTPUT_LAYOUTS,
+		help    = 'Write one file per run, or symbol=/timeframe=tick/date=/part.<format> partitions overwriting whole days'
+	)
+	i.add_arguments(parser)
 
 	args                                = parser.parse_args()
+	i.configure(args, 'preprocess_tick_data')
 	import_args, input_directory_path   = au.handle_input_args(
 		args,
 		repo_root_directory    = REPO_ROOT_DIRECTORY_PATH,
@@ -86,40 +215,56 @@ def main():
 		base_directory_parquet = dc.DIRECTORY_NAME__PREP_PARQUET,
 	)
 
-	for idx, process_data in enumerate(itertools.product(args.symbols, [input_directory_path], [output_directory_path])):
-		symbol, input_paths, output_paths = process_data
+	work_units = []
+	manifests  = {}
+	for symbol, input_format in itertools.product(args.symbols, [fmt for fmt in au.ALLOWED_FORMATS if fmt in import_args]):
 
-		print(f'\n[{idx+1}/{len(args.symbols)}] Processing {symbol=}.')
+		symbol_directory_path = os.path.join(input_directory_path.get(input_format, input_directory_path.get('_')), symbol)
+		catalog_entries       = c.locate_files(symbol_directory_path, input_format)
+		input_file_paths      = [catalog_entry['file_path'] for catalog_entry in catalog_entries]
+		if not input_file_paths:
+			print(f'No input {input_format} files were found for {symbol=}')
+			continue
 
-		if 'csv' in import_args:
-			symbol_directory_path = os.path.join(input_paths.get('csv', input_paths.get('_')), symbol)
-			csv_file_paths        = fu.read_file_paths_by_extension(symbol_directory_path, '*.csv')
+		if args.layout == 'hive':
+			work_units.extend({
+				'label'    : f'Processing {symbol=} into the {date} partition from {len(date_file_paths)} {input_format} files',
+				'weight'   : sum(os.path.getsize(input_file_path) for input_file_path in date_file_paths),
+				'function' : write_hive_date,
+				'args'     : (symbol, date, date_file_paths, input_format, export_args, output_directory_path, args.fixed_point, args.native_datetime),
+			} for date, date_file_paths in c.group_files_by_date(catalog_entries).items())
+			continue
 
-			if csv_file_paths:
-				print(f'\tCSV files     : {len(csv_file_paths)}')
-				df                 = u.read_and_concat_dataframes(csv_file_paths, symbol, 'csv')
-				min_date, max_date = u.get_interval_info(df)
-				date_info          = f'{min_date}_{len(csv_file_paths)}_{max_date}'.replace('-', '')
-				write_files(symbol, df, date_info, export_args, output_paths)
+		if not args.incremental:
+			work_units.append({
+				'label'    : f'Processing {symbol=} from {len(input_file_paths)} {input_format} files.',
+				'weight'   : sum(os.path.getsize(input_file_path) for input_file_path in input_file_paths),
+				'function' : process_symbol,
+				'args'     : (symbol, input_file_paths, input_format, export_args, output_directory_path, args.fixed_point, args.native_datetime, c.get_interval_info(catalog_entries)),
+			})
+			continue
 
-			else:
-				print(f'\tNo input CSV files were found')
-				return
+		for export_format in [export_format for export_format, is_allowed in export_args.items() if is_allowed]:
 
-		if 'parquet' in import_args:
-			symbol_directory_path = os.path.join(input_paths.get('parquet', input_paths.get('_')), symbol)
-			parquet_file_paths    = fu.read_file_paths_by_extension(symbol_directory_path, '*.parquet')
+			manifest_file_path, manifest, output_subdirectory_path, pending_file_paths = plan_incremental_files(
+				symbol, input_file_paths, export_format, output_directory_path, args.fixed_point, args.native_datetime,
+			)
+			manifests[manifest_file_path] = manifest
 
-			if parquet_file_paths:
-				print(f'\tParquet files : {len(parquet_file_paths)}')
-				df                 = u.read_and_concat_dataframes(parquet_file_paths, symbol, 'parquet')
-				min_date, max_date = u.get_interval_info(df)
-				date_info          = f'{min_date}_{len(parquet_file_paths)}_{max_date}'.replace('-', '')
-				write_files(symbol, df, date_info, export_args, output_paths)
+			for input_file_path in pending_file_paths:
+				work_units.append({
+					'label'         : f'Processing {symbol=} to {export_format}: {os.path.basename(input_file_path)}',
+					'weight'        : os.path.getsize(input_file_path),
+					'function'      : write_incremental_file,
+					'args'          : (symbol, input_file_path, input_format, export_format, output_subdirectory_path, args.fixed_point, args.native_datetime),
+					'manifest_path' : manifest_file_path,
+					'manifest_key'  : os.path.basename(input_file_path),
+				})
 
-			else:
-				print(f'\tNo input Parquet files were found')
-				return
+	for work_unit, result in u.run_work_units(work_units, args.workers):
+		if 'manifest_path' in work_unit:
+			manifests[work_unit['manifest_path']]['files'][work_unit['manifest_key']] = result
+			u.write_json_file(work_unit['manifest_path'], manifests[work_unit['manifest_path']])
 
 
 if __name__ == "__main__":
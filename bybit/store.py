@@ -0,0 +1,340 @@
+import os
+import re
+import sys
+import glob
+import polars as pl
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+
+REPO_ROOT_DIRECTORY_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+LIBRARIES_DIRECTORY_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../libs/python'))
+
+sys.path.append(LIBRARIES_DIRECTORY_PATH)
+
+import data_config as dc
+import utils as u
+
+
+DEFAULT_CACHE_BYTES = 1024 * 1024 * 1024
+
+INCREMENTAL_DIRECTORY_SUFFIX = 'incremental'
+
+RUN_DIRECTORY_PATTERN = r'^{symbol}\.(\d{{8}})_\d+_(\d{{8}})$'
+FILE_DATE_PATTERN     = r'(\d{4}-\d{2}-\d{2})'
+
+
+def to_datetime(value):
+
+	if value is None or isinstance(value, datetime):
+		return value
+
+	if isinstance(value, date):
+		return datetime.combine(value, time())
+
+	return datetime.fromisoformat(value)
+
+
+def get_date_range(start, end):
+
+	# End is exclusive, so a range ending at midnight does not touch the following day
+	date_begin = start.date().isoformat() if start is not None else None
+	date_end   = (end - timedelta(microseconds=1)).date().isoformat() if end is not None else None
+
+	return date_begin, date_end
+
+
+def get_datetime_filter(dtype, start, end):
+
+	# Formatted datetimes sort like the datetimes they represent, so bounds are compared as strings
+	bounds = [
+		bound if bound is None or dtype.is_temporal() else bound.isoformat(sep=' ')
+		for bound in [start, end]
+	]
+
+	predicate = pl.lit(True)
+	if bounds[0] is not None:
+		predicate = predicate & (pl.col('datetime') >= bounds[0])
+	if bounds[1] is not None:
+		predicate = predicate & (pl.col('datetime') < bounds[1])
+
+	return predicate
+
+
+def is_range_covering(start, end, chunk):
+
+	chunk_start = datetime.fromisoformat(chunk['date_begin'])
+	chunk_end   = datetime.fromisoformat(chunk['date_end']) + timedelta(days=1)
+
+	return (start is None or start <= chunk_start) and (end is None or chunk_end <= end)
+
+
+def is_range_overlapping(date_begin, date_end, chunk):
+
+	return (date_begin is None or date_begin <= chunk['date_end']) and (date_end is None or chunk['date_begin'] <= date_end)
+
+
+def get_chunk_bounds(chunk, start, end):
+
+	# Chunks inside the range are read whole, clipped chunks only for the days no newer run covers
+	if not chunk.get('clipped'):
+		return (None, None) if is_range_covering(start, end, chunk) else (start, end)
+
+	chunk_start = datetime.fromisoformat(chunk['date_begin'])
+	chunk_end   = datetime.fromisoformat(chunk['date_end']) + timedelta(days=1)
+
+	return max(chunk_start, start or chunk_start), min(chunk_end, end or chunk_end)
+
+
+def clip_chunk(chunk, covered_dates):
+
+	chunk_begin = date.fromisoformat(chunk['date_begin'])
+	chunk_dates = [chunk_begin + timedelta(days=day) for day in range((date.fromisoformat(chunk['date_end']) - chunk_begin).days + 1)]
+	dates       = [chunk_date for chunk_date in chunk_dates if chunk_date not in covered_dates]
+	covered_dates.update(chunk_dates)
+
+	# Uncovered days are split into consecutive ranges, each one a chunk of the same file
+	ranges = []
+	for chunk_date in dates:
+		if ranges and chunk_date - ranges[-1][1] == timedelta(days=1):
+			ranges[-1][1] = chunk_date
+		else:
+			ranges.append([chunk_date, chunk_date])
+
+	return [
+		{**chunk, 'date_begin': date_begin.isoformat(), 'date_end': date_end.isoformat(), 'clipped': len(dates) < len(chunk_dates)}
+		for date_begin, date_end in ranges
+	]
+
+
+def locate_hive_chunks(base_path, symbol, timeframe, file_format):
+
+	return [
+		{'file_path': file_path, 'date_begin': date, 'date_end': date}
+		for file_path in u.locate_hive_partitions(base_path, symbol, timeframe, file_format)
+		for date in [u.get_hive_partition_value(file_path, 'date')]
+	]
+
+
+def locate_incremental_chunks(base_path, symbol, file_format):
+
+	chunks = []
+	for file_path in sorted(glob.glob(os.path.join(base_path, f'{symbol}.{INCREMENTAL_DIRECTORY_SUFFIX}', f'*.{file_format}'))):
+		if match := re.search(FILE_DATE_PATTERN, os.path.basename(file_path)):
+			chunks.append({'file_path': file_path, 'date_begin': match.group(1), 'date_end': match.group(1)})
+
+	return chunks
+
+
+def locate_run_chunks(base_path, symbol, timeframe, file_format):
+
+	chunks = []
+	for directory_path in glob.glob(os.path.join(base_path, f'{symbol}.*')):
+		match = re.match(RUN_DIRECTORY_PATTERN.format(symbol=re.escape(symbol)), os.path.basename(directory_path))
+		if not match:
+			continue
+		file_names = [f'{os.path.basename(directory_path)}.{timeframe}.{file_format}']
+		if timeframe == 'tick':
+			file_names.append(f'{os.path.basename(directory_path)}.{file_format}')
+		for file_path in [os.path.join(directory_path, file_name) for file_name in file_names]:
+			if os.path.isfile(file_path):
+				date_begin, date_end = [f'{value[:4]}-{value[4:6]}-{value[6:]}' for value in match.groups()]
+				chunks.append({'file_path': file_path, 'date_begin': date_begin, 'date_end': date_end})
+				break
+
+	# Runs may overlap each other, so the newest run wins every day it covers and older runs keep the rest
+	accepted_chunks = []
+	covered_dates   = set()
+	for chunk in sorted(chunks, key=lambda chunk: os.path.getmtime(chunk['file_path']), reverse=True):
+		accepted_chunks.extend(clip_chunk(chunk, covered_dates))
+
+	return sorted(accepted_chunks, key=lambda chunk: chunk['date_begin'])
+
+
+def locate_chunks(base_path, symbol, timeframe, file_format):
+
+	# Day partitions are overwritten in place, so they take precedence over whole-run files
+	for chunks in [
+		locate_hive_chunks(base_path, symbol, timeframe, file_format),
+		locate_incremental_chunks(base_path, symbol, file_format) if timeframe == 'tick' else [],
+		locate_run_chunks(base_path, symbol, timeframe, file_format),
+	]:
+		if chunks:
+			return chunks
+
+	return []
+
+
+def locate_symbol_database(base_path, symbol):
+
+	database_file_paths = glob.glob(os.path.join(base_path, f'{symbol}.*.duckdb'))
+
+	return max(database_file_paths, key=os.path.getmtime) if database_file_paths else None
+
+
+def query_database(database_path, timeframe, start, end):
+
+	table_name = 'tick' if timeframe == 'tick' else f'aggr_{timeframe}'
+	conditions = [
+		condition
+		for condition, bound in [('datetime >= ?', start), ('datetime < ?', end)]
+		if bound is not None
+	]
+
+	with u.connect_duckdb(database_path, read_only=True) as db_conn:
+		return db_conn.execute(f"""
+			SELECT *
+			FROM {table_name}
+			{'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+			ORDER BY datetime
+		""", [bound for bound in [start, end] if bound is not None]).pl()
+
+
+class ChunkCache:
+
+	def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+
+		self.max_bytes  = max_bytes
+		self.size_bytes = 0
+		self.hits       = 0
+		self.misses     = 0
+		self.entries    = OrderedDict()
+
+	def get(self, key, load):
+
+		if key in self.entries:
+			self.hits += 1
+			self.entries.move_to_end(key)
+			return self.entries[key]
+
+		self.misses += 1
+		df = load()
+		self.put(key, df)
+
+		return df
+
+	def put(self, key, df):
+
+		size_bytes = df.estimated_size()
+		if size_bytes > self.max_bytes:
+			return
+
+		if key in self.entries:
+			self.size_bytes -= self.entries.pop(key).estimated_size()
+		self.entries[key]  = df
+		self.size_bytes   += size_bytes
+		while self.size_bytes > self.max_bytes:
+			_, evicted_df    = self.entries.popitem(last=False)
+			self.size_bytes -= evicted_df.estimated_size()
+
+	def clear(self):
+
+		self.entries.clear()
+		self.size_bytes = 0
+
+
+class Store:
+
+	def __init__(self, base_path, file_format='parquet', cache_bytes=None):
+
+		self.base_path   = base_path
+		self.file_format = file_format
+		# Caching collects every chunk a load touches, so it is opt-in and loads stay lazy scans by default
+		self.cache       = ChunkCache(cache_bytes) if cache_bytes else None
+
+	def load(self, symbol, timeframe, start=None, end=None):
+
+		start, end = to_datetime(start), to_datetime(end)
+
+		database_path = locate_symbol_database(self.base_path, symbol)
+		if database_path:
+			return self.load_database(database_path, timeframe, start, end)
+
+		date_begin, date_end = get_date_range(start, end)
+		chunks = [
+			chunk
+			for chunk in locate_chunks(self.base_path, symbol, timeframe, self.file_format)
+			if is_range_overlapping(date_begin, date_end, chunk)
+		]
+		if not chunks:
+			return None
+
+		if self.cache is None and not any(chunk.get('clipped') for chunk in chunks):
+			return self.scan_chunks([chunk['file_path'] for chunk in chunks], start, end)
+
+		return pl.concat([
+			self.load_chunk(chunk, *get_chunk_bounds(chunk, start, end))
+			for chunk in chunks
+		])
+
+	def scan_chunks(self, file_paths, start, end):
+
+		lf = u.scan_polars_dataframe(file_paths, self.file_format)
+
+		return lf.filter(get_datetime_filter(lf.collect_schema()['datetime'], start, end))
+
+	def load_chunk(self, chunk, start, end):
+
+		# Only a cache collects chunks, and files larger than its whole budget stay lazy scans
+		file_stat = u.get_file_stat(chunk['file_path'])
+		if self.cache is None or file_stat['size'] > self.cache.max_bytes:
+			return self.scan_chunks(chunk['file_path'], start, end)
+
+		# Chunks inside the requested range are cached whole, so overlapping ranges share them
+		cache_key = (chunk['file_path'], file_stat['size'], file_stat['mtime_ns'], start, end)
+
+		return self.cache.get(cache_key, lambda: self.scan_chunks(chunk['file_path'], start, end).collect()).lazy()
+
+	def load_database(self, database_path, timeframe, start, end):
+
+		if self.cache is None:
+			return query_database(database_path, timeframe, start, end).lazy()
+
+		file_stat = u.get_file_stat(database_path)
+		cache_key = (database_path, file_stat['size'], file_stat['mtime_ns'], timeframe, start, end)
+
+		return self.cache.get(cache_key, lambda: query_database(database_path, timeframe, start, end)).lazy()
+
+
+class TickStore(Store):
+
+	def __init__(self, base_path=None, file_format='parquet', cache_bytes=None):
+
+		base_directory = dc.DIRECTORY_NAME__PREP_CSV if file_format == 'csv' else dc.DIRECTORY_NAME__PREP_PARQUET
+		super().__init__(base_path or os.path.join(REPO_ROOT_DIRECTORY_PATH, dc.BASE_DIRECTORY__DATA, base_directory), file_format, cache_bytes)
+
+	def load_ticks(self, symbol, start=None, end=None):
+
+		return self.load(symbol, 'tick', start, end)
+
+
+class BarStore(Store):
+
+	def __init__(self, base_path=None, file_format='parquet', cache_bytes=None):
+
+		base_directory = dc.DIRECTORY_NAME__AGGR_CSV if file_format == 'csv' else dc.DIRECTORY_NAME__AGGR_PARQUET
+		super().__init__(base_path or os.path.join(REPO_ROOT_DIRECTORY_PATH, dc.BASE_DIRECTORY__DATA, base_directory), file_format, cache_bytes)
+
+	def load_bars(self, symbol, timeframe, start=None, end=None):
+
+		return self.load(symbol, timeframe, start, end)
+
+
+DEFAULT_STORES = {}
+
+
+def get_default_store(store_class):
+
+	if store_class not in DEFAULT_STORES:
+		DEFAULT_STORES[store_class] = store_class()
+
+	return DEFAULT_STORES[store_class]
+
+
+def load_ticks(symbol, start=None, end=None):
+
+	return get_default_store(TickStore).load_ticks(symbol, start, end)
+
+
+def load_bars(symbol, timeframe, start=None, end=None):
+
+	return get_default_store(BarStore).load_bars(symbol, timeframe, start, end)
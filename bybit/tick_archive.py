@@ -0,0 +1,245 @@
+import os
+import sys
+import shutil
+import numpy as np
+import polars as pl
+from datetime import datetime, timedelta
+
+LIBRARIES_DIRECTORY_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../libs/python'))
+
+sys.path.append(LIBRARIES_DIRECTORY_PATH)
+
+import utils as u
+
+
+ARCHIVE_VERSION = 1
+
+ARCHIVE_DIRECTORY_NAME = '2-PREP_ARCHIVE'
+
+HEADER_FILE_NAME     = 'header.json'
+HOUR_INDEX_FILE_NAME = 'hour_index.bin'
+COLUMN_FILE_NAME     = '{column}.bin'
+
+EPOCH           = datetime(1970, 1, 1)
+SECONDS_IN_HOUR = 60 * 60
+HOUR_UNITS      = SECONDS_IN_HOUR * 10 ** u.TIMESTAMP_SCALE
+
+# Timestamps are stored as offsets from the start of their hour, so any hour decodes without a running sum
+ARCHIVE_COLUMN_DTYPES = {
+	'timestamp_offset' : np.dtype('<u4') if HOUR_UNITS < 2 ** 32 else np.dtype('<u8'),
+	'price'            : np.dtype('<i4'),
+	'size'             : np.dtype('<i8'),
+	'flags'            : np.dtype('u1'),
+}
+HOUR_INDEX_DTYPE = np.dtype([('hour', '<i8'), ('offset', '<i8')])
+
+SIDE_FLAG_MASK       = 0b001
+DIRECTION_FLAG_SHIFT = 1
+
+
+def get_hour(moment, round_up=False):
+
+	hour, remainder = divmod(moment - EPOCH, timedelta(hours=1))
+
+	return hour + int(round_up and bool(remainder))
+
+
+def get_hour_date(hour):
+
+	return (EPOCH + timedelta(hours=int(hour))).date().isoformat()
+
+
+def get_price_tick(prices):
+
+	return int(np.gcd.reduce(prices)) if len(prices) else 0
+
+
+def to_archive_columns(ticks_df, price_tick):
+
+	ticks_df  = ticks_df.select([
+		pl.col('timestamp') if ticks_df.schema['timestamp'].is_integer() else u.to_fixed_point('timestamp', u.TIMESTAMP_SCALE),
+		pl.col('price') if ticks_df.schema['price'].is_integer() else u.to_fixed_point('price', u.PRICE_SCALE),
+		pl.col('size') if ticks_df.schema['size'].is_integer() else u.to_fixed_point('size', u.VOLUME_SCALE),
+		pl.col('side').cast(pl.Enum(u.TICK_SIDES)).to_physical().alias('side'),
+		pl.col('direction').cast(pl.Enum(u.TICK_DIRECTIONS)).to_physical().alias('direction'),
+	])
+	timestamps = ticks_df.get_column('timestamp').to_numpy()
+	prices     = ticks_df.get_column('price').to_numpy()
+	if np.any(prices % price_tick):
+		raise ValueError(f'Prices are not multiples of the price tick {price_tick}')
+	price_ticks = prices // price_tick
+	if price_ticks.max(initial=0) > np.iinfo(ARCHIVE_COLUMN_DTYPES['price']).max:
+		raise ValueError(f'Prices in units of {price_tick} do not fit {ARCHIVE_COLUMN_DTYPES["price"]}')
+
+	return timestamps // HOUR_UNITS, {
+		'timestamp_offset' : (timestamps % HOUR_UNITS).astype(ARCHIVE_COLUMN_DTYPES['timestamp_offset']),
+		'price'            : price_ticks.astype(ARCHIVE_COLUMN_DTYPES['price']),
+		'size'             : ticks_df.get_column('size').to_numpy().astype(ARCHIVE_COLUMN_DTYPES['size']),
+		'flags'            : (
+			ticks_df.get_column('side').to_numpy().astype(np.uint8)
+			| (ticks_df.get_column('direction').to_numpy().astype(np.uint8) << DIRECTION_FLAG_SHIFT)
+		),
+	}
+
+
+def open_archive_writer(directory_path, symbol, price_tick):
+
+	# Columns are appended to a temporary directory, which replaces the archive once every chunk is written
+	temporary_directory_path = f'{directory_path}.tmp'
+	shutil.rmtree(temporary_directory_path, ignore_errors=True)
+	os.makedirs(temporary_directory_path)
+
+	return {
+		'directory_path'           : directory_path,
+		'temporary_directory_path' : temporary_directory_path,
+		'symbol'                   : symbol,
+		'price_tick'               : price_tick,
+		'rows'                     : 0,
+		'last_timestamp'           : None,
+		'hour_index'               : [],
+		'files'                    : {
+			column : open(os.path.join(temporary_directory_path, COLUMN_FILE_NAME.format(column=column)), 'wb')
+			for column in ARCHIVE_COLUMN_DTYPES
+		},
+	}
+
+
+def write_archive_ticks(archive_writer, ticks_df):
+
+	if ticks_df.is_empty():
+		return
+
+	# Chunks must follow each other in time, an hour split between two chunks keeps its first offset
+	hours, columns = to_archive_columns(ticks_df, archive_writer['price_tick'])
+	timestamps     = hours * HOUR_UNITS + columns['timestamp_offset']
+	if np.any(timestamps[1:] < timestamps[:-1]):
+		raise ValueError(f'Ticks of {archive_writer["symbol"]} are not in timestamp order')
+	if archive_writer['last_timestamp'] is not None and timestamps[0] < archive_writer['last_timestamp']:
+		raise ValueError(f'Ticks of {archive_writer["symbol"]} overlap the previous chunk: {timestamps[0]} after {archive_writer["last_timestamp"]}')
+
+	hour_starts = np.flatnonzero(np.diff(hours, prepend=hours[0] - 1))
+	for hour_start in hour_starts:
+		if archive_writer['hour_index'] and archive_writer['hour_index'][-1][0] == hours[hour_start]:
+			continue
+		archive_writer['hour_index'].append((int(hours[hour_start]), archive_writer['rows'] + int(hour_start)))
+
+	for column, values in columns.items():
+		values.tofile(archive_writer['files'][column])
+	archive_writer['rows']          += ticks_df.height
+	archive_writer['last_timestamp'] = int(timestamps[-1])
+
+
+def close_archive_writer(archive_writer):
+
+	for out_file in archive_writer['files'].values():
+		out_file.close()
+
+	hour_index = np.array(archive_writer['hour_index'], dtype=HOUR_INDEX_DTYPE)
+	hour_index.tofile(os.path.join(archive_writer['temporary_directory_path'], HOUR_INDEX_FILE_NAME))
+	u.write_json_file(os.path.join(archive_writer['temporary_directory_path'], HEADER_FILE_NAME), {
+		'version'         : ARCHIVE_VERSION,
+		'symbol'          : archive_writer['symbol'],
+		'rows'            : archive_writer['rows'],
+		'hours'           : len(hour_index),
+		'price_tick'      : archive_writer['price_tick'],
+		'price_scale'     : u.PRICE_SCALE,
+		'volume_scale'    : u.VOLUME_SCALE,
+		'timestamp_scale' : u.TIMESTAMP_SCALE,
+		'columns'         : {column: dtype.str for column, dtype in ARCHIVE_COLUMN_DTYPES.items()},
+		'sides'           : u.TICK_SIDES,
+		'directions'      : u.TICK_DIRECTIONS,
+		'date_begin'      : get_hour_date(hour_index['hour'][0]) if len(hour_index) else None,
+		'date_end'        : get_hour_date(hour_index['hour'][-1]) if len(hour_index) else None,
+	})
+
+	shutil.rmtree(archive_writer['directory_path'], ignore_errors=True)
+	os.replace(archive_writer['temporary_directory_path'], archive_writer['directory_path'])
+
+	return archive_writer['directory_path']
+
+
+def open_tick_archive(directory_path):
+
+	header = u.read_json_file(os.path.join(directory_path, HEADER_FILE_NAME))
+	if header is None:
+		raise FileNotFoundError(f'No tick archive in {directory_path}')
+
+	# Empty files cannot be mapped, so empty columns are plain empty arrays
+	def map_file(file_name, dtype, length):
+		if not length:
+			return np.empty(0, dtype=dtype)
+		return np.memmap(os.path.join(directory_path, file_name), dtype=dtype, mode='r', shape=(length,))
+
+	return {
+		'directory_path' : directory_path,
+		'header'         : header,
+		'hour_index'     : map_file(HOUR_INDEX_FILE_NAME, HOUR_INDEX_DTYPE, header['hours']),
+		'columns'        : {
+			column : map_file(COLUMN_FILE_NAME.format(column=column), np.dtype(dtype), header['rows'])
+			for column, dtype in header['columns'].items()
+		},
+	}
+
+
+def get_archive_rows(archive, start=None, end=None):
+
+	# Bounds are rounded out to whole hours, rows of the hour holding end are excluded only if end is on the hour
+	hour_index = archive['hour_index']
+	row_begin  = 0
+	row_end    = archive['header']['rows']
+	if start is not None:
+		hour_idx  = np.searchsorted(hour_index['hour'], get_hour(start), side='left')
+		row_begin = int(hour_index['offset'][hour_idx]) if hour_idx < len(hour_index) else row_end
+	if end is not None:
+		hour_idx  = np.searchsorted(hour_index['hour'], get_hour(end, round_up=True), side='left')
+		row_end   = int(hour_index['offset'][hour_idx]) if hour_idx < len(hour_index) else row_end
+
+	return row_begin, max(row_begin, row_end)
+
+
+def get_archive_timestamps(archive, row_begin, row_end):
+
+	hour_index = archive['hour_index']
+	hour_begin = np.searchsorted(hour_index['offset'], row_begin, side='right') - 1
+	hour_end   = np.searchsorted(hour_index['offset'], row_end, side='left')
+	offsets    = np.append(np.clip(hour_index['offset'][hour_begin:hour_end], row_begin, row_end), row_end)
+	hours      = np.repeat(hour_index['hour'][hour_begin:hour_end], np.diff(offsets))
+
+	return hours * HOUR_UNITS + archive['columns']['timestamp_offset'][row_begin:row_end]
+
+
+def read_archive_columns(archive, row_begin, row_end):
+
+	# Everything but the timestamps is a view of the mapped files
+	columns = archive['columns']
+	flags   = columns['flags'][row_begin:row_end]
+
+	return {
+		'timestamp' : get_archive_timestamps(archive, row_begin, row_end),
+		'price'     : columns['price'][row_begin:row_end],
+		'size'      : columns['size'][row_begin:row_end],
+		'side'      : flags & SIDE_FLAG_MASK,
+		'direction' : flags >> DIRECTION_FLAG_SHIFT,
+	}
+
+
+def read_archive_ticks(archive, start=None, end=None):
+
+	header = archive['header']
+	df     = pl.DataFrame(read_archive_columns(archive, *get_archive_rows(archive, start, end)))
+
+	predicate = pl.lit(True)
+	if start is not None:
+		predicate = predicate & (pl.col('datetime') >= start)
+	if end is not None:
+		predicate = predicate & (pl.col('datetime') < end)
+
+	# Same columns as read_and_concat_dataframes with fixed point and native datetime
+	return df.select([
+		(pl.col('timestamp') * 10 ** (6 - header['timestamp_scale'])).cast(pl.Datetime('us')).alias('datetime'),
+		pl.col('timestamp').cast(pl.Int64),
+		(pl.col('price').cast(pl.Int64) * header['price_tick']).alias('price'),
+		pl.col('side').cast(pl.UInt32).cast(pl.Enum(header['sides'])),
+		pl.col('size').cast(pl.Int64),
+		pl.col('direction').cast(pl.UInt32).cast(pl.Enum(header['directions'])),
+	]).filter(predicate)
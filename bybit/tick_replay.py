@@ -0,0 +1,304 @@
+import os
+import sys
+import math
+import itertools
+import queue
+import threading
+import numpy as np
+import polars as pl
+import pyarrow as pa
+import pyarrow.dataset as ds
+from datetime import timedelta
+
+REPO_ROOT_DIRECTORY_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+LIBRARIES_DIRECTORY_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../libs/python'))
+
+sys.path.append(LIBRARIES_DIRECTORY_PATH)
+
+import data_config as dc
+import store as s
+import tick_archive as ta
+import utils as u
+
+
+DEFAULT_BATCH_SIZE = 64 * 1024
+DEFAULT_READ_AHEAD = 4
+
+REPLAY_COLUMNS = ['symbol', 'timestamp', 'price', 'size', 'side', 'direction']
+REPLAY_DTYPES  = {
+	'symbol'    : np.dtype(np.uint16),
+	'timestamp' : np.dtype(np.int64),
+	'price'     : np.dtype(np.int64),
+	'size'      : np.dtype(np.int64),
+	'side'      : np.dtype(np.uint8),
+	'direction' : np.dtype(np.uint8),
+}
+
+DEFAULT_BASE_PATHS = [
+	os.path.join(REPO_ROOT_DIRECTORY_PATH, dc.BASE_DIRECTORY__DATA, ta.ARCHIVE_DIRECTORY_NAME),
+	os.path.join(REPO_ROOT_DIRECTORY_PATH, dc.BASE_DIRECTORY__DATA, dc.DIRECTORY_NAME__PREP_PARQUET),
+]
+
+END_OF_BATCHES = object()
+
+
+def get_timestamp_bound(moment):
+
+	# First fixed point timestamp at or after the moment, so bounds compare like datetimes do
+	if moment is None:
+		return None
+
+	microseconds = (moment - ta.EPOCH) // timedelta(microseconds=1)
+
+	return math.ceil(microseconds * 10 ** u.TIMESTAMP_SCALE / 1_000_000) if u.TIMESTAMP_SCALE < 6 else microseconds * 10 ** (u.TIMESTAMP_SCALE - 6)
+
+
+def slice_batch(batch, row_begin, row_end):
+
+	return {column: values[row_begin:row_end] for column, values in batch.items()}
+
+
+def trim_batch(batch, timestamp_begin, timestamp_end):
+
+	# Batches are sorted by timestamp, so the range is a slice and no copy is made
+	timestamps = batch['timestamp']
+	row_begin  = np.searchsorted(timestamps, timestamp_begin, side='left') if timestamp_begin is not None else 0
+	row_end    = np.searchsorted(timestamps, timestamp_end, side='left') if timestamp_end is not None else len(timestamps)
+
+	return batch if (row_begin, row_end) == (0, len(timestamps)) else slice_batch(batch, row_begin, row_end)
+
+
+def iter_archive_batches(directory_path, start, end, batch_size):
+
+	archive    = ta.open_tick_archive(directory_path)
+	price_tick = archive['header']['price_tick']
+	row_begin, row_end = ta.get_archive_rows(archive, start, end)
+	for batch_begin in range(row_begin, row_end, batch_size):
+		columns = ta.read_archive_columns(archive, batch_begin, min(batch_begin + batch_size, row_end))
+		yield {
+			'timestamp' : columns['timestamp'],
+			'price'     : columns['price'] * np.int64(price_tick),
+			'size'      : columns['size'],
+			'side'      : columns['side'],
+			'direction' : columns['direction'],
+		}
+
+
+def get_parquet_filter(schema, start, end):
+
+	# Preprocessed files keep datetime either native or formatted, and formatted datetimes sort like native ones
+	is_temporal = pa.types.is_timestamp(schema.field('datetime').type)
+	predicate   = None
+	for bound, compare in [(start, lambda field, value: field >= value), (end, lambda field, value: field < value)]:
+		if bound is None:
+			continue
+		condition = compare(ds.field('datetime'), bound if is_temporal else bound.isoformat(sep=' '))
+		predicate = condition if predicate is None else predicate & condition
+
+	return predicate
+
+
+def get_category_codes(array, categories):
+
+	# Dictionary columns are remapped through their few distinct values instead of comparing strings per row
+	if pa.types.is_dictionary(array.type):
+		lookup = np.array([categories.index(value) for value in array.dictionary.to_pylist()], dtype=np.uint8)
+		return lookup[array.indices.to_numpy(zero_copy_only=False)]
+
+	return pl.from_arrow(array).cast(pl.Utf8).cast(pl.Enum(categories)).to_physical().cast(pl.UInt8).to_numpy()
+
+
+def to_replay_columns(record_batch):
+
+	columns = {}
+	for column, scale in [('timestamp', u.TIMESTAMP_SCALE), ('price', u.PRICE_SCALE), ('size', u.VOLUME_SCALE)]:
+		array = record_batch.column(column)
+		if pa.types.is_integer(array.type):
+			columns[column] = array.to_numpy(zero_copy_only=False)
+		else:
+			columns[column] = pl.DataFrame({column: pl.from_arrow(array)}).select(u.to_fixed_point(column, scale)).to_series().to_numpy()
+	columns['side']      = get_category_codes(record_batch.column('side'), u.TICK_SIDES)
+	columns['direction'] = get_category_codes(record_batch.column('direction'), u.TICK_DIRECTIONS)
+
+	return columns
+
+
+def iter_parquet_batches(file_paths, start, end, batch_size):
+
+	dataset = ds.dataset(file_paths, format='parquet')
+	scanner = dataset.scanner(
+		columns    = ['datetime', 'timestamp', 'price', 'side', 'size', 'direction'],
+		filter     = get_parquet_filter(dataset.schema, start, end),
+		batch_size = batch_size,
+	)
+	for record_batch in scanner.to_batches():
+		if record_batch.num_rows:
+			yield to_replay_columns(record_batch)
+
+
+def iter_chunk_batches(chunks, start, end, batch_size):
+
+	# Whole files are scanned as one dataset, a run clipped by a newer one is scanned alone for the days it keeps
+	for clipped, chunk_group in itertools.groupby(chunks, key=lambda chunk: bool(chunk.get('clipped'))):
+		if not clipped:
+			yield from iter_parquet_batches([chunk['file_path'] for chunk in chunk_group], start, end, batch_size)
+			continue
+		for chunk in chunk_group:
+			yield from iter_parquet_batches([chunk['file_path']], *s.get_chunk_bounds(chunk, start, end), batch_size)
+
+
+def iter_symbol_batches(base_paths, symbol, start, end, batch_size):
+
+	date_begin, date_end = s.get_date_range(start, end)
+	for base_path in base_paths:
+		if os.path.isfile(os.path.join(base_path, symbol, ta.HEADER_FILE_NAME)):
+			return iter_archive_batches(os.path.join(base_path, symbol), start, end, batch_size)
+
+		chunks = [
+			chunk
+			for chunk in s.locate_chunks(base_path, symbol, 'tick', 'parquet')
+			if s.is_range_overlapping(date_begin, date_end, chunk)
+		]
+		if chunks:
+			return iter_chunk_batches(chunks, start, end, batch_size)
+
+	raise FileNotFoundError(f'No tick archive or preprocessed Parquet files of {symbol} in {base_paths}')
+
+
+def merge_symbol_batches(symbol_batches, timestamp_begin, timestamp_end):
+
+	# Rows up to the earliest last timestamp of the pending batches cannot be preceded by rows still unread
+	iterators = dict(enumerate(symbol_batches))
+	pending   = {}
+	while iterators or pending:
+		for symbol_idx in [symbol_idx for symbol_idx in iterators if symbol_idx not in pending]:
+			for batch in iterators[symbol_idx]:
+				batch = trim_batch(batch, timestamp_begin, timestamp_end)
+				if len(batch['timestamp']):
+					pending[symbol_idx] = {'symbol': np.full(len(batch['timestamp']), symbol_idx, dtype=REPLAY_DTYPES['symbol']), **batch}
+					break
+			else:
+				del iterators[symbol_idx]
+
+		if not pending:
+			break
+
+		if len(pending) == 1:
+			_, batch = pending.popitem()
+			yield batch
+			continue
+
+		live_last_timestamps = [pending[symbol_idx]['timestamp'][-1] for symbol_idx in iterators]
+		horizon              = min(live_last_timestamps) if live_last_timestamps else None
+
+		parts = []
+		for symbol_idx in sorted(pending):
+			batch   = pending[symbol_idx]
+			row_end = np.searchsorted(batch['timestamp'], horizon, side='right') if horizon is not None else len(batch['timestamp'])
+			parts.append(slice_batch(batch, 0, row_end))
+			if row_end == len(batch['timestamp']):
+				del pending[symbol_idx]
+			else:
+				pending[symbol_idx] = slice_batch(batch, row_end, len(batch['timestamp']))
+
+		# Parts are concatenated in symbol order, so a stable sort breaks timestamp ties by symbol
+		merged = {column: np.concatenate([part[column] for part in parts]) for column in REPLAY_COLUMNS}
+		order  = np.argsort(merged['timestamp'], kind='stable')
+		yield {column: values[order] for column, values in merged.items()}
+
+
+def rebatch(batches, batch_size):
+
+	# Whole batches pass through as views, only rows straddling a batch boundary are copied
+	buffered      = []
+	buffered_rows = 0
+	for batch in batches:
+		row_count = len(batch['timestamp'])
+		row_begin = 0
+		if buffered_rows:
+			row_begin      = min(row_count, batch_size - buffered_rows)
+			buffered.append(slice_batch(batch, 0, row_begin))
+			buffered_rows += row_begin
+			if buffered_rows < batch_size:
+				continue
+			yield {column: np.concatenate([part[column] for part in buffered]) for column in REPLAY_COLUMNS}
+			buffered, buffered_rows = [], 0
+
+		while row_count - row_begin >= batch_size:
+			yield slice_batch(batch, row_begin, row_begin + batch_size)
+			row_begin += batch_size
+
+		if row_begin < row_count:
+			buffered.append(slice_batch(batch, row_begin, row_count))
+			buffered_rows = row_count - row_begin
+
+	if buffered_rows:
+		yield {column: np.concatenate([part[column] for part in buffered]) for column in REPLAY_COLUMNS}
+
+
+def read_ahead(batches, queue_size):
+
+	if queue_size <= 0:
+		yield from batches
+		return
+
+	# Decoding and merging run in a thread while the consumer works on earlier batches, numpy and Arrow release the GIL
+	batch_queue = queue.Queue(maxsize=queue_size)
+	stopped     = threading.Event()
+
+	def put(item):
+		while not stopped.is_set():
+			try:
+				batch_queue.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				continue
+		return False
+
+	def produce():
+		try:
+			for batch in batches:
+				if not put(batch):
+					return
+		except BaseException as error:
+			put(error)
+		finally:
+			put(END_OF_BATCHES)
+
+	producer = threading.Thread(target=produce, name='tick-replay-read-ahead', daemon=True)
+	producer.start()
+	try:
+		while (item := batch_queue.get()) is not END_OF_BATCHES:
+			if isinstance(item, BaseException):
+				raise item
+			yield item
+	finally:
+		stopped.set()
+		producer.join()
+
+
+def replay_ticks(symbols, start=None, end=None, base_paths=None, batch_size=DEFAULT_BATCH_SIZE, queue_size=DEFAULT_READ_AHEAD):
+
+	# Symbol is the index into symbols, side and direction index u.TICK_SIDES and u.TICK_DIRECTIONS, the rest is fixed point
+	start, end = s.to_datetime(start), s.to_datetime(end)
+	base_paths = [base_paths] if isinstance(base_paths, str) else base_paths or DEFAULT_BASE_PATHS
+
+	# Small output batches are cut from larger reads, so the scan cost per row does not grow
+	read_size      = max(batch_size, DEFAULT_BATCH_SIZE)
+	symbol_batches = [iter_symbol_batches(base_paths, symbol, start, end, read_size) for symbol in symbols]
+	batches        = merge_symbol_batches(symbol_batches, get_timestamp_bound(start), get_timestamp_bound(end))
+
+	return read_ahead(rebatch(batches, batch_size), queue_size)
+
+
+def to_record_batch(batch, symbols):
+
+	# Numeric numpy arrays are wrapped without a copy, symbols and categories become dictionary columns
+	return pa.RecordBatch.from_arrays([
+		pa.DictionaryArray.from_arrays(pa.array(batch['symbol']), pa.array(symbols)),
+		pa.array(batch['timestamp']),
+		pa.array(batch['price']),
+		pa.array(batch['size']),
+		pa.DictionaryArray.from_arrays(pa.array(batch['side']), pa.array(u.TICK_SIDES)),
+		pa.DictionaryArray.from_arrays(pa.array(batch['direction']), pa.array(u.TICK_DIRECTIONS)),
+	], names=REPLAY_COLUMNS)
@@ -1,16 +1,40 @@
 
+import io
 import os
+import re
 import sys
+import glob
+import json
+import time
+import duckdb
+import hashlib
+import itertools
+import contextlib
+import multiprocessing
+import numpy as np
 import polars as pl
+import pyarrow.parquet as pq
 from decimal import Decimal
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 LIBRARIES_DIRECTORY_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../libs/python'))
 
 sys.path.append(LIBRARIES_DIRECTORY_PATH)
 
 import data_config as dc
+import domain as d
+import instrumentation as i
 
 
+INPUT_COLUMNS = [
+	'timestamp',
+	'symbol',
+	'side',
+	'size',
+	'price',
+	'tickDirection',
+]
+
 OUTPUT_COLUMN_ORDER = [
 	'datetime',
 	'timestamp',
@@ -20,6 +44,232 @@ OUTPUT_COLUMN_ORDER = [
 	'direction',
 ]
 
+TICK_SIDES      = ['Buy', 'Sell']
+TICK_DIRECTIONS = ['PlusTick', 'ZeroPlusTick', 'MinusTick', 'ZeroMinusTick']
+
+TICK_SCHEMA = {
+	'timestamp'       : pl.Float64,
+	'symbol'          : pl.Categorical,
+	'side'            : pl.Enum(TICK_SIDES),
+	'size'            : pl.Float64,
+	'price'           : pl.Float64,
+	'tickDirection'   : pl.Enum(TICK_DIRECTIONS),
+	'trdMatchID'      : pl.Utf8,
+	'grossValue'      : pl.Float64,
+	'homeNotional'    : pl.Float64,
+	'foreignNotional' : pl.Float64,
+}
+
+TICK_SORTING_COLUMN = 'timestamp'
+
+PARQUET_COMPRESSION       = 'zstd'
+PARQUET_COMPRESSION_LEVEL = 3
+PARQUET_ROW_GROUP_SIZE    = 1024 * 1024
+
+TICK_CSV_BATCH_SIZE = 1024 * 1024
+
+FIXED_POINT_GUARD_DIGITS = 2
+
+SECONDS_IN_DAY = 24*60*60
+
+DUCKDB_THREADS_ENVIRONMENT_VARIABLE = 'DUCKDB_THREADS'
+
+OUTPUT_LAYOUTS            = ['file', 'hive']
+HIVE_PARTITION_FILE_NAME  = 'part.{file_format}'
+
+TICK_DATETIME_FORMAT  = '%Y-%m-%d %H:%M:%S%.6f'
+OHLCV_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+INFORMATION_BAR_TYPES   = ['tick', 'volume', 'dollar', 'imbalance']
+INFORMATION_BAR_PATTERN = rf'^({"|".join(INFORMATION_BAR_TYPES)})_(\d+(?:\.\d+)?)$'
+
+IMBALANCE_MIN_WINDOW = 1024
+UP_TICK_DIRECTIONS   = ['PlusTick', 'ZeroPlusTick']
+
+
+def get_precision_scale(precision):
+
+	return max(0, -Decimal(precision).as_tuple().exponent)
+
+
+PRICE_SCALE     = get_precision_scale(dc.PRICE_PRECISION)
+VOLUME_SCALE    = get_precision_scale(dc.VOLUME_PRECISION)
+TIMESTAMP_SCALE = get_precision_scale(dc.TIMESTAMP_PRECISION)
+
+FIXED_POINT_SCALES = {
+	'timestamp' : TIMESTAMP_SCALE,
+	'price'     : PRICE_SCALE,
+	'size'      : VOLUME_SCALE,
+	'open'      : PRICE_SCALE,
+	'high'      : PRICE_SCALE,
+	'low'       : PRICE_SCALE,
+	'close'     : PRICE_SCALE,
+	'volume'    : VOLUME_SCALE,
+}
+
+
+def to_fixed_point(column, scale):
+
+	guard     = 10 ** FIXED_POINT_GUARD_DIGITS
+	value     = (pl.col(column).cast(pl.Decimal(None, scale + FIXED_POINT_GUARD_DIGITS)) * 10 ** (scale + FIXED_POINT_GUARD_DIGITS)).cast(pl.Int64)
+	quotient  = value // guard
+	remainder = value % guard
+
+	# Rounds half to even like Decimal.quantize does
+	return (quotient + ((remainder > guard // 2) | ((remainder == guard // 2) & (quotient % 2 == 1))).cast(pl.Int64)).alias(column)
+
+
+def from_fixed_point(column, scale):
+
+	value = pl.col(column)
+	if scale == 0:
+		return value.cast(pl.Utf8).alias(column)
+
+	return pl.concat_str([
+		pl.when(value < 0).then(pl.lit('-')).otherwise(pl.lit('')),
+		(value.abs() // 10 ** scale).cast(pl.Utf8),
+		pl.lit('.'),
+		(value.abs() % 10 ** scale).cast(pl.Utf8).str.zfill(scale),
+	]).alias(column)
+
+
+def format_float(column):
+
+	# Floats are written as the plain decimal text the CSV files hold, without exponent or trailing zeros
+	return pl.col(column).cast(pl.Decimal(None, 9)).cast(pl.Utf8).str.replace(r'\.?0+$', '').alias(column)
+
+
+def format_fixed_point_columns(df):
+
+	return df.with_columns([
+		from_fixed_point(column, FIXED_POINT_SCALES[column])
+		for column, dtype in df.collect_schema().items()
+		if column in FIXED_POINT_SCALES and dtype.is_integer()
+	])
+
+
+def to_epoch_microseconds(column, dtype):
+
+	if dtype.is_float():
+		return (pl.col(column) * 1_000_000).round().cast(pl.Int64)
+
+	return (pl.col(column).cast(pl.Decimal(None, 9)) * 1_000_000_000).cast(pl.Int64) // 1_000
+
+
+def format_datetime_columns(df):
+
+	schema          = df.collect_schema()
+	datetime_format = TICK_DATETIME_FORMAT if 'price' in schema else OHLCV_DATETIME_FORMAT
+
+	return df.with_columns([
+		pl.col(column).dt.strftime(datetime_format)
+		for column, dtype in schema.items()
+		if dtype.is_temporal()
+	])
+
+
+def format_output_columns(df):
+
+	return format_datetime_columns(format_fixed_point_columns(df))
+
+
+def get_file_stat(file_path):
+
+	file_stat = os.stat(file_path)
+
+	return {
+		'size'     : file_stat.st_size,
+		'mtime_ns' : file_stat.st_mtime_ns,
+	}
+
+
+def get_file_hash(file_path, chunk_size=1024*1024):
+
+	file_hash = hashlib.sha256()
+	with open(file_path, 'rb') as in_file:
+		while chunk := in_file.read(chunk_size):
+			file_hash.update(chunk)
+
+	return file_hash.hexdigest()
+
+
+def is_manifest_entry_current(manifest_entry, input_file_path, output_file_path):
+
+	if not manifest_entry or not os.path.exists(output_file_path):
+		return False
+
+	file_stat = get_file_stat(input_file_path)
+	if all(manifest_entry.get(key) == value for key, value in file_stat.items()):
+		return True
+
+	if manifest_entry.get('sha256') == get_file_hash(input_file_path):
+		manifest_entry.update(file_stat)
+		return True
+
+	return False
+
+
+def read_json_file(file_path, default=None):
+
+	if not os.path.exists(file_path):
+		return default
+
+	with open(file_path, 'r') as in_file:
+		return json.load(in_file)
+
+
+def write_json_file(file_path, content):
+
+	temporary_file_path = f'{file_path}.tmp'
+	with open(temporary_file_path, 'w') as out_file:
+		json.dump(content, out_file, indent='\t', sort_keys=True)
+	os.replace(temporary_file_path, file_path)
+
+
+def connect_duckdb(database_path, read_only=False):
+
+	config = {}
+	if thread_count := os.environ.get(DUCKDB_THREADS_ENVIRONMENT_VARIABLE):
+		config['threads'] = int(thread_count)
+
+	return duckdb.connect(database_path, read_only=read_only, config=config)
+
+
+def run_captured_work_unit(function, args):
+
+	output = io.StringIO()
+	with contextlib.redirect_stdout(output):
+		result = function(*args)
+
+	return result, output.getvalue(), i.pop_records()
+
+
+def run_work_units(work_units, workers):
+
+	if workers <= 1:
+		for idx, work_unit in enumerate(work_units, start=1):
+			print(f'\n[{idx}/{len(work_units)}] {work_unit["label"]}')
+			yield work_unit, work_unit['function'](*work_unit['args'])
+		return
+
+	thread_count = str(max(1, (os.cpu_count() or 1) // workers))
+	os.environ['POLARS_MAX_THREADS']                = thread_count
+	os.environ[DUCKDB_THREADS_ENVIRONMENT_VARIABLE] = thread_count
+
+	ordered_work_units = sorted(work_units, key=lambda work_unit: work_unit['weight'], reverse=True)
+	with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+		futures = {
+			executor.submit(run_captured_work_unit, work_unit['function'], work_unit['args']) : work_unit
+			for work_unit in ordered_work_units
+		}
+		for idx, future in enumerate(as_completed(futures), start=1):
+			work_unit               = futures[future]
+			result, output, records = future.result()
+			i.add_records(records)
+			print(f'\n[{idx}/{len(work_units)}] {work_unit["label"]}')
+			print(output, end='', flush=True)
+			yield work_unit, result
+
 
 def read_polars_dataframe(file_path, file_format):
 
@@ -36,65 +286,603 @@ def read_polars_dataframe(file_path, file_format):
 	return df
 
 
-def read_and_concat_dataframes(file_paths, symbol, file_format):
+def cast_tick_columns(df):
+
+	# Checked before the cast, whose own error cannot name the values of a chunked frame
+	for column, categories in [('side', TICK_SIDES), ('tickDirection', TICK_DIRECTIONS)]:
+		if column not in df.columns:
+			continue
+		unknown_values = df.select(pl.col(column).filter(~pl.col(column).is_in(categories)).unique()).get_column(column).to_list()
+		if unknown_values:
+			raise ValueError(f'Unknown {column} values: {unknown_values}')
+
+	return df.cast({column: dtype for column, dtype in TICK_SCHEMA.items() if column in df.columns})
+
+
+def read_tick_csv(source):
+
+	return cast_tick_columns(pl.read_csv(source, infer_schema=False))
+
+
+def read_tick_csv_batches(file_path, batch_size=TICK_CSV_BATCH_SIZE):
+
+	reader = pl.read_csv_batched(file_path, infer_schema_length=0, batch_size=batch_size)
+	if not (batches := reader.next_batches(1)):
+		yield read_tick_csv(file_path)
+		return
+
+	while batches:
+		for batch in batches:
+			yield cast_tick_columns(batch)
+		batches = reader.next_batches(1)
+
+
+def read_tick_csv_stream_batches(csv_file, batch_size=TICK_CSV_BATCH_SIZE):
+
+	# Decompressed streams cannot be read by read_csv_batched, so lines are cut into batches under the header here
+	header = csv_file.readline()
+	lines  = list(itertools.islice(csv_file, batch_size))
+	if not lines:
+		yield read_tick_csv(io.BytesIO(header))
+		return
+
+	while lines:
+		yield read_tick_csv(io.BytesIO(header + b''.join(lines)))
+		lines = list(itertools.islice(csv_file, batch_size))
+
+
+def write_tick_parquet_row_group(writer, df, file_path, compression_level, statistics):
+
+	sorting_columns = None
+	if TICK_SORTING_COLUMN in df.columns:
+		df              = df.sort(TICK_SORTING_COLUMN, maintain_order=True)
+		sorting_columns = [pq.SortingColumn(df.get_column_index(TICK_SORTING_COLUMN))]
+
+	table = df.to_arrow()
+	if writer is None:
+		writer = pq.ParquetWriter(file_path, table.schema,
+			compression       = PARQUET_COMPRESSION,
+			compression_level = compression_level,
+			write_statistics  = statistics,
+			sorting_columns   = sorting_columns,
+		)
+	writer.write_table(table, row_group_size=max(df.height, 1))
+
+	return writer
+
+
+def split_tick_row_group(df, row_group_size):
+
+	row_group_df = df.head(row_group_size)
+	if TICK_SORTING_COLUMN not in df.columns or df.height <= row_group_size:
+		return row_group_df, df.slice(row_group_size)
+
+	# Trades of the last timestamp move on to the next row group, so that ties never span two row groups
+	timestamps   = row_group_df.get_column(TICK_SORTING_COLUMN)
+	other_rows   = (timestamps != timestamps[-1]).arg_true()
+	row_count    = other_rows[-1] + 1 if other_rows.len() else row_group_size
+
+	return df.head(row_count), df.slice(row_count)
+
+
+def get_row_group_bounds(df):
+
+	if TICK_SORTING_COLUMN not in df.columns or df.is_empty():
+		return None
+
+	timestamps = df.get_column(TICK_SORTING_COLUMN)
+
+	return timestamps.min(), timestamps.max()
+
+
+def sort_tick_parquet_row_groups(file_path, output_file_path, row_group_bounds, compression_level, row_group_size, statistics):
+
+	# Row groups are sorted one by one, so those of a newest-first input are written again oldest-first,
+	# one at a time, and those of an unordered input are sorted again as a whole
+	parquet_file = pq.ParquetFile(file_path)
+	if all(previous_bounds[0] > bounds[1] for previous_bounds, bounds in zip(row_group_bounds, row_group_bounds[1:])):
+		row_group_dfs = (pl.from_arrow(parquet_file.read_row_group(idx)) for idx in reversed(range(parquet_file.num_row_groups)))
+	else:
+		row_group_dfs = pl.read_parquet(file_path).sort(TICK_SORTING_COLUMN, maintain_order=True).iter_slices(row_group_size)
+
+	writer = None
+	try:
+		for row_group_df in row_group_dfs:
+			writer = write_tick_parquet_row_group(writer, row_group_df, output_file_path, compression_level, statistics)
+	finally:
+		if writer is not None:
+			writer.close()
+
+
+def write_tick_parquet_row_groups(batches, file_path, compression_level, row_group_size, statistics):
+
+	row_count        = 0
+	pending_dfs      = []
+	row_group_bounds = []
+	writer           = None
+	try:
+		for df in batches:
+			pending_dfs.append(df)
+			row_count += df.height
+			while sum(pending_df.height for pending_df in pending_dfs) >= row_group_size:
+				row_group_df, pending_df = split_tick_row_group(pl.concat(pending_dfs), row_group_size)
+				pending_dfs              = [pending_df] if pending_df.height else []
+				writer                   = write_tick_parquet_row_group(writer, row_group_df, file_path, compression_level, statistics)
+				row_group_bounds.append(get_row_group_bounds(row_group_df))
+		if pending_dfs or writer is None:
+			row_group_df = pl.concat(pending_dfs)
+			writer       = write_tick_parquet_row_group(writer, row_group_df, file_path, compression_level, statistics)
+			row_group_bounds.append(get_row_group_bounds(row_group_df))
+	finally:
+		if writer is not None:
+			writer.close()
+
+	return row_count, [bounds for bounds in row_group_bounds if bounds is not None]
+
+
+def write_tick_parquet_batches(batches, file_path, compression_level=PARQUET_COMPRESSION_LEVEL, row_group_size=PARQUET_ROW_GROUP_SIZE, statistics=True):
+
+	temporary_file_path = f'{file_path}.tmp'
+	sorted_file_path    = f'{file_path}.sorted.tmp'
+	try:
+		row_count, row_group_bounds = write_tick_parquet_row_groups(batches, temporary_file_path, compression_level, row_group_size, statistics)
+		if not all(previous_bounds[1] <= bounds[0] for previous_bounds, bounds in zip(row_group_bounds, row_group_bounds[1:])):
+			sort_tick_parquet_row_groups(temporary_file_path, sorted_file_path, row_group_bounds, compression_level, row_group_size, statistics)
+			os.replace(sorted_file_path, temporary_file_path)
+		os.replace(temporary_file_path, file_path)
+
+	except:
+		# A failed write leaves no partial file behind
+		for partial_file_path in [temporary_file_path, sorted_file_path]:
+			with contextlib.suppress(FileNotFoundError):
+				os.remove(partial_file_path)
+		raise
+
+	return row_count
+
+
+def write_tick_parquet(df, file_path, compression_level=PARQUET_COMPRESSION_LEVEL, row_group_size=PARQUET_ROW_GROUP_SIZE, statistics=True):
 
-	dfs = []
-	for idx, file_path in enumerate(file_paths):
+	return write_tick_parquet_batches([df], file_path, compression_level, row_group_size, statistics)
 
-		df = read_polars_dataframe(file_path, file_format)
-		df = df.drop(['trdMatchID', 'grossValue', 'homeNotional', 'foreignNotional'])
-		df = df.filter(pl.col('symbol') == symbol)
-		dfs.append(df)
 
-	data_df = pl.concat(dfs, how='vertical')
-	data_df = data_df.sort('timestamp')
-	data_df = data_df.with_columns([
-		(pl.col('timestamp').cast(pl.Decimal(None, 9)) * 1_000_000_000).cast(pl.Int64).cast(pl.Datetime('ns')).cast(pl.Utf8).map_elements(lambda x: x[:-3], return_dtype=pl.Utf8).alias('datetime'),
-		pl.col('price').map_elements(lambda x: str(Decimal(x).quantize(Decimal(dc.PRICE_PRECISION))), return_dtype=pl.Utf8),
-		pl.col('timestamp').map_elements(lambda x: str(Decimal(x).quantize(Decimal(dc.TIMESTAMP_PRECISION))), return_dtype=pl.Utf8),
+def open_frame_writer(file_path, file_format, row_group_size=PARQUET_ROW_GROUP_SIZE, timeframe=None):
+
+	return {
+		'file_path'           : file_path,
+		'temporary_file_path' : f'{file_path}.tmp',
+		'file_format'         : file_format,
+		'row_group_size'      : row_group_size,
+		'timeframe'           : timeframe,
+		'writer'              : None,
+		'buffer'              : [],
+		'buffer_rows'         : 0,
+		'rows'                : 0,
+		'seconds'             : 0.0,
+	}
+
+
+def flush_frame_writer(frame_writer):
+
+	if not frame_writer['buffer']:
+		return
+
+	table = pl.concat(frame_writer['buffer']).to_arrow()
+	if frame_writer['writer'] is None:
+		frame_writer['writer'] = pq.ParquetWriter(frame_writer['temporary_file_path'], table.schema, compression=PARQUET_COMPRESSION)
+	frame_writer['writer'].write_table(table, row_group_size=table.num_rows)
+	frame_writer['buffer']      = []
+	frame_writer['buffer_rows'] = 0
+
+
+def write_frame_rows(frame_writer, df):
+
+	started = time.perf_counter()
+
+	# Frames are appended as they are produced, so only one row group per file is held in memory
+	if frame_writer['file_format'] == 'csv':
+		if frame_writer['writer'] is None:
+			frame_writer['writer'] = open(frame_writer['temporary_file_path'], 'wb')
+		format_output_columns(df).write_csv(frame_writer['writer'], include_header=frame_writer['rows'] == 0)
+
+	elif frame_writer['file_format'] == 'parquet':
+		frame_writer['buffer'].append(df)
+		frame_writer['buffer_rows'] += df.height
+		if frame_writer['buffer_rows'] >= frame_writer['row_group_size']:
+			flush_frame_writer(frame_writer)
+
+	else:
+		raise NotImplementedError(f'Unknown format: {frame_writer["file_format"]}')
+
+	frame_writer['rows']    += df.height
+	frame_writer['seconds'] += time.perf_counter() - started
+
+
+def close_frame_writer(frame_writer):
+
+	started = time.perf_counter()
+	if frame_writer['file_format'] == 'parquet':
+		flush_frame_writer(frame_writer)
+	if frame_writer['writer'] is None:
+		return None
+
+	frame_writer['writer'].close()
+	os.replace(frame_writer['temporary_file_path'], frame_writer['file_path'])
+	i.add_record(
+		'write',
+		frame_writer['seconds'] + time.perf_counter() - started,
+		timeframe     = frame_writer['timeframe'],
+		format        = frame_writer['file_format'],
+		rows_in       = frame_writer['rows'],
+		bytes_written = i.get_file_size(frame_writer['file_path']),
+	)
+
+	return frame_writer['file_path']
+
+
+def scan_polars_dataframe(file_paths, file_format):
+
+	lf = None
+	if file_format == 'csv':
+		lf = pl.scan_csv(file_paths, infer_schema=False)
+
+	elif file_format == 'parquet':
+		lf = pl.scan_parquet(file_paths)
+
+	else:
+		raise NotImplementedError(f'Unknown format: {file_format}')
+
+	return lf
+
+
+def scan_symbol_ticks(file_paths, symbol, file_format):
+
+	lf = scan_polars_dataframe(file_paths, file_format)
+	lf = lf.select(INPUT_COLUMNS)
+	lf = lf.cast({
+		column : TICK_SCHEMA[column]
+		for column, dtype in lf.collect_schema().items()
+		if dtype == pl.Categorical and isinstance(TICK_SCHEMA[column], pl.Enum)
+	})
+	lf = lf.filter(pl.col('symbol') == symbol)
+
+	return lf
+
+
+def scan_and_concat_dataframes(file_paths, symbol, file_format, fixed_point=False, native_datetime=False, maintain_order=False):
+
+	data_lf = scan_symbol_ticks(file_paths, symbol, file_format)
+	schema  = data_lf.collect_schema()
+	data_lf = data_lf.with_columns([
+		to_epoch_microseconds('timestamp', schema['timestamp']).cast(pl.Datetime('us')).alias('datetime'),
+		to_fixed_point('price', PRICE_SCALE),
+		to_fixed_point('timestamp', TIMESTAMP_SCALE),
+		to_fixed_point('size', VOLUME_SCALE) if fixed_point else pl.col('size') if schema['size'] == pl.Utf8 else format_float('size'),
 		pl.col('tickDirection').alias('direction'),
 	])
-	data_df  = data_df.select(OUTPUT_COLUMN_ORDER)
+	# An ordered sort keeps trades of equal timestamps in file order, but polars can only collect it and not sink it
+	data_lf = data_lf.sort('timestamp', maintain_order=maintain_order)
+	data_lf = data_lf.select(OUTPUT_COLUMN_ORDER)
+	if not fixed_point:
+		data_lf = format_fixed_point_columns(data_lf)
+	if not native_datetime:
+		data_lf = format_datetime_columns(data_lf)
+
+	return data_lf
+
+
+def read_and_concat_dataframes(file_paths, symbol, file_format, fixed_point=False, native_datetime=False):
+
+	with i.stage('read', format=file_format) as record:
+		df = i.collect(scan_and_concat_dataframes(file_paths, symbol, file_format, fixed_point, native_datetime, maintain_order=True), 'read', format=file_format)
+		record.update(rows_out=df.height, bytes_read=i.get_file_size(file_paths))
+
+	return df
+
+
+def get_hive_partition_path(base_path, symbol, timeframe, date, file_format):
+
+	return os.path.join(
+		base_path,
+		f'symbol={symbol}',
+		f'timeframe={timeframe}',
+		f'date={date}',
+		HIVE_PARTITION_FILE_NAME.format(file_format=file_format),
+	)
+
+
+def get_hive_partition_value(file_path, key):
+
+	return next(part.split('=', 1)[1] for part in file_path.split(os.sep) if part.startswith(f'{key}='))
+
+
+def write_hive_partition(df, file_path, file_format):
+
+	os.makedirs(os.path.dirname(file_path), exist_ok=True)
+	temporary_file_path = f'{file_path}.tmp'
+	with i.stage('write', timeframe=get_hive_partition_value(file_path, 'timeframe'), format=file_format, layout='hive') as record:
+		if file_format == 'csv':
+			format_output_columns(df).write_csv(temporary_file_path)
+		else:
+			df.write_parquet(temporary_file_path)
+		os.replace(temporary_file_path, file_path)
+		record.update(rows_in=df.height, bytes_written=i.get_file_size(file_path))
+
+	return file_path
+
+
+def get_partition_date(dtype):
+
+	return pl.col('datetime').dt.strftime('%Y-%m-%d') if dtype.is_temporal() else pl.col('datetime').str.slice(0, 10)
+
+
+def write_hive_partitions(df, base_path, symbol, timeframe, file_format):
+
+	partitions = df.with_columns(get_partition_date(df.schema['datetime']).alias('date')).partition_by('date', as_dict=True, include_key=False, maintain_order=True)
+
+	with ThreadPoolExecutor() as executor:
+		return list(executor.map(
+			lambda item: write_hive_partition(item[1], get_hive_partition_path(base_path, symbol, timeframe, item[0][0], file_format), file_format),
+			partitions.items(),
+		))
+
+
+def locate_hive_partitions(base_path, symbol, timeframe, file_format, date_begin=None, date_end=None):
+
+	file_paths = sorted(glob.glob(get_hive_partition_path(base_path, symbol, timeframe, '*', file_format)))
+
+	return [
+		file_path
+		for file_path in file_paths
+		if (date_begin is None or date_begin <= get_hive_partition_value(file_path, 'date'))
+		and (date_end is None or get_hive_partition_value(file_path, 'date') <= date_end)
+	]
 
-	return data_df
+
+def scan_hive_partitions(base_path, symbol, timeframe, file_format, date_begin=None, date_end=None):
+
+	file_paths = locate_hive_partitions(base_path, symbol, timeframe, file_format, date_begin, date_end)
+	if not file_paths:
+		return None
+
+	return scan_polars_dataframe(file_paths, file_format)
 
 
 def get_interval_info(data_df):
 
-	aggregated_df = pl.concat([
-		data_df.head(1).clone(),
-		data_df.tail(1).clone(),
-	], how='vertical')
-	aggregated_df = aggregated_df.with_columns([
-		(pl.col('timestamp').cast(pl.Decimal(None, 9)) * 1_000_000_000).cast(pl.Int64).cast(pl.Datetime('ns')).cast(pl.Utf8).map_elements(lambda x: x[:10], return_dtype=pl.Utf8).alias('date'),
+	dates_df = data_df.select([
+		pl.col('datetime').first().cast(pl.Utf8).str.slice(0, 10).alias('min_date'),
+		pl.col('datetime').last().cast(pl.Utf8).str.slice(0, 10).alias('max_date'),
 	])
-	min_date = aggregated_df.select(pl.col('date').first()).get_column('date').item()
-	max_date = aggregated_df.select(pl.col('date').last()).get_column('date').item()
+	min_date = dates_df.get_column('min_date').item()
+	max_date = dates_df.get_column('max_date').item()
 
 	return min_date, max_date
 
 
-def aggregate_ohlcv(df, interval, symbol):
+def scan_interval_info(file_paths, symbol, file_format):
+
+	dates_df = scan_symbol_ticks(file_paths, symbol, file_format).select([
+		pl.col('timestamp').cast(pl.Float64).min().alias('min_timestamp'),
+		pl.col('timestamp').cast(pl.Float64).max().alias('max_timestamp'),
+	]).collect()
+	dates_df = dates_df.select([
+		(pl.col(column) * 1_000_000).cast(pl.Int64).cast(pl.Datetime('us')).dt.strftime('%Y-%m-%d').alias(column)
+		for column in dates_df.columns
+	])
+	min_date = dates_df.get_column('min_timestamp').item()
+	max_date = dates_df.get_column('max_timestamp').item()
+
+	return min_date, max_date
+
+
+def get_rollup_sources(intervals):
+
+	ordered_intervals = sorted(set(intervals), key=d.timeframe_to_seconds)
+
+	rollup_sources = {}
+	for idx, interval in enumerate(ordered_intervals):
+		interval_seconds = d.timeframe_to_seconds(interval)
+		finer_intervals  = [
+			finer_interval
+			for finer_interval in ordered_intervals[:idx]
+			if interval_seconds % d.timeframe_to_seconds(finer_interval) == 0
+			and (interval_seconds <= SECONDS_IN_DAY or SECONDS_IN_DAY % d.timeframe_to_seconds(finer_interval) == 0)
+		]
+		rollup_sources[interval] = finer_intervals[-1] if finer_intervals else None
+
+	return rollup_sources
+
+
+def parse_information_bar(bar_name):
+
+	match = re.match(INFORMATION_BAR_PATTERN, bar_name)
+	if not match:
+		return None
+
+	# Thresholds are applied in the units of their column, and one that rounds to zero would never close a bar
+	bar_type, threshold = match.group(1), Decimal(match.group(2))
+	threshold_units     = threshold if bar_type == 'dollar' else int(threshold * 10 ** VOLUME_SCALE) if bar_type == 'volume' else int(threshold)
+
+	return (bar_type, threshold) if threshold_units > 0 else None
+
+
+def is_information_bar(bar_name):
+
+	return parse_information_bar(bar_name) is not None
+
+
+def get_bar_ids(bar_ends, tick_count):
+
+	bar_ids = np.zeros(tick_count, dtype=np.int64)
+	bar_ids[np.array(bar_ends[:-1], dtype=np.int64) + 1] = 1
+
+	return pl.Series(np.cumsum(bar_ids))
+
+
+def get_threshold_bar_ends(totals, threshold):
+
+	if threshold <= 0:
+		raise ValueError(f'Bar thresholds must be positive: {threshold}')
+
+	# Running totals only grow, so the tick closing each bar is found by bisection, one step per bar
+	bar_ends = []
+	end      = -1
+	while end < len(totals) - 1:
+		base = totals[end] if end >= 0 else 0
+		end  = min(int(np.searchsorted(totals, base + threshold, side='left')), len(totals) - 1)
+		bar_ends.append(end)
+
+	return bar_ends
+
+
+def get_imbalance_bar_ends(signs, threshold):
 
-	precision_price  = Decimal(dc.PRICE_PRECISION)
-	precision_volume = Decimal(dc.VOLUME_PRECISION)
+	# Signed tick counts go up and down, so each bar scans a window sized after the previous bar instead
+	levels   = np.cumsum(signs, dtype=np.int64)
+	bar_ends = []
+	start    = 0
+	base     = 0
+	window   = IMBALANCE_MIN_WINDOW
+	while start < len(levels):
+		end      = len(levels) - 1
+		position = start
+		while position < len(levels):
+			crossed = np.abs(levels[position:position + window] - base) >= threshold
+			if crossed.any():
+				end = position + int(crossed.argmax())
+				break
+			position += window
+			window   *= 2
+		bar_ends.append(end)
+		window = max(IMBALANCE_MIN_WINDOW, 2 * (end - start + 1))
+		start  = end + 1
+		base   = levels[end]
 
-	df_aggr = df.sort('datetime')
-	df_aggr = df.with_columns(
-		pl.col("datetime").str.strptime(pl.Datetime).dt.truncate(interval).alias("datetime"),
-        pl.col("price").cast(pl.Float64),
-        pl.col("size").cast(pl.Float64),
+	return bar_ends
+
+
+def get_information_bar_ids(ticks_df, bar_name):
+
+	# A bar closes with the tick that reaches its threshold and the next bar starts again from zero
+	bar_type, threshold = parse_information_bar(bar_name)
+	if bar_type == 'tick':
+		return pl.int_range(pl.len(), dtype=pl.Int64) // int(threshold)
+
+	if bar_type == 'volume':
+		totals = ticks_df.get_column('size').cum_sum().to_numpy()
+		return get_bar_ids(get_threshold_bar_ends(totals, int(threshold * 10 ** VOLUME_SCALE)), ticks_df.height)
+
+	if bar_type == 'dollar':
+		notional = pl.col('price').cast(pl.Float64) * pl.col('size').cast(pl.Float64) / 10 ** (PRICE_SCALE + VOLUME_SCALE)
+		totals   = ticks_df.select(notional.cum_sum()).to_series().to_numpy()
+		return get_bar_ids(get_threshold_bar_ends(totals, float(threshold)), ticks_df.height)
+
+	signs = ticks_df.select(pl.when(pl.col('direction').cast(pl.Enum(TICK_DIRECTIONS)).is_in(UP_TICK_DIRECTIONS)).then(1).otherwise(-1)).to_series().to_numpy()
+
+	return get_bar_ids(get_imbalance_bar_ends(signs, int(threshold)), ticks_df.height)
+
+
+def aggregate_information_bars(ticks_df, bar_name):
+
+	bars_lf = ticks_df.lazy().with_columns(get_information_bar_ids(ticks_df, bar_name).alias('bar_id'))
+
+	return bars_lf.group_by('bar_id', maintain_order=True).agg([
+		pl.col("datetime").first(),
+		pl.col("price").first().alias("open"),
+		pl.col("price").max().alias("high"),
+		pl.col("price").min().alias("low"),
+		pl.col("price").last().alias("close"),
+		pl.col("size").sum().alias("volume"),
+	]).drop('bar_id')
+
+
+def to_native_ticks(df):
+
+	schema = df.lazy().collect_schema()
+
+	return df.lazy().with_columns(
+		pl.col("datetime") if schema['datetime'].is_temporal() else pl.col("datetime").str.strptime(pl.Datetime('us')),
+		pl.col("price") if schema['price'].is_integer() else to_fixed_point("price", PRICE_SCALE),
+		pl.col("size") if schema['size'].is_integer() else to_fixed_point("size", VOLUME_SCALE),
 	)
-	df_aggr = df_aggr.group_by("datetime").agg([
-		pl.col("price").first().map_elements(lambda x: str(Decimal(x).quantize(precision_price)), return_dtype=pl.Utf8).alias("open"),
-		pl.col("price").max().map_elements(lambda x: str(Decimal(x).quantize(precision_price)), return_dtype=pl.Utf8).alias("high"),
-		pl.col("price").min().map_elements(lambda x: str(Decimal(x).quantize(precision_price)), return_dtype=pl.Utf8).alias("low"),
-		pl.col("price").last().map_elements(lambda x: str(Decimal(x).quantize(precision_price)), return_dtype=pl.Utf8).alias("close"),
-		pl.col("size").sum().map_elements(lambda x: str(Decimal(x).quantize(precision_volume)), return_dtype=pl.Utf8).alias("volume"),
-	])
-	df_aggr = df_aggr.sort('datetime')
-	df_aggr = df_aggr.with_columns(
-		pl.col("datetime").dt.strftime("%Y-%m-%d %H:%M:%S").alias("datetime")
+
+
+def to_native_bars(df):
+
+	schema = df.lazy().collect_schema()
+
+	return df.lazy().with_columns(
+		pl.col("datetime") if schema['datetime'].is_temporal() else pl.col("datetime").str.strptime(pl.Datetime('us')),
+		*[
+			pl.col(column) if schema[column].is_integer() else to_fixed_point(column, FIXED_POINT_SCALES[column])
+			for column in ['open', 'high', 'low', 'close', 'volume']
+		],
 	)
 
-	return df_aggr
+
+def aggregate_ohlcv_timeframes(df, intervals, symbol, bars_dfs=None):
+
+	# Bars aggregated before, like cached ones, are rolled up instead of the ticks,
+	# which may be None when every interval has such a source
+	bars_dfs = bars_dfs or {}
+	if df is not None:
+		fixed_point     = df.schema['price'].is_integer()
+		native_datetime = df.schema['datetime'].is_temporal()
+		ticks_lf        = to_native_ticks(df)
+	else:
+		bars_df         = next(iter(bars_dfs.values()))
+		fixed_point     = bars_df.schema['open'].is_integer()
+		native_datetime = bars_df.schema['datetime'].is_temporal()
+		ticks_lf        = None
+
+	bars_lfs = {interval: to_native_bars(bars_df) for interval, bars_df in bars_dfs.items()}
+	if information_bars := [interval for interval in intervals if is_information_bar(interval)]:
+		ticks_df = ticks_lf.collect()
+		for information_bar in information_bars:
+			bars_lfs[information_bar] = aggregate_information_bars(ticks_df, information_bar)
+
+	for interval, rollup_source in get_rollup_sources([*bars_dfs, *[interval for interval in intervals if not is_information_bar(interval)]]).items():
+		if interval in bars_dfs:
+			continue
+		elif rollup_source is None:
+			bars_lf = ticks_lf.group_by(pl.col("datetime").dt.truncate(interval)).agg([
+				pl.col("price").first().alias("open"),
+				pl.col("price").max().alias("high"),
+				pl.col("price").min().alias("low"),
+				pl.col("price").last().alias("close"),
+				pl.col("size").sum().alias("volume"),
+			])
+		else:
+			bars_lf = bars_lfs[rollup_source].group_by(pl.col("datetime").dt.truncate(interval)).agg([
+				pl.col("open").first(),
+				pl.col("high").max(),
+				pl.col("low").min(),
+				pl.col("close").last(),
+				pl.col("volume").sum(),
+			])
+		bars_lfs[interval] = bars_lf.sort('datetime')
+
+	output_lfs = {}
+	for interval in dict.fromkeys(intervals):
+		output_lf = bars_lfs[interval]
+		if not fixed_point:
+			output_lf = format_fixed_point_columns(output_lf)
+		if not native_datetime and is_information_bar(interval):
+			# Information bars open at the time of a tick, which seconds alone cannot tell apart
+			output_lf = output_lf.with_columns(pl.col('datetime').dt.strftime(TICK_DATETIME_FORMAT))
+		elif not native_datetime:
+			output_lf = format_datetime_columns(output_lf)
+		output_lfs[interval] = output_lf
+
+	# Timeframes are collected together to share the rollups, so their time is one aggregate stage
+	with i.stage('aggregate', timeframe=','.join(output_lfs.keys())) as record:
+		output_dfs = dict(zip(output_lfs.keys(), pl.collect_all(list(output_lfs.values()))))
+		record.update(rows_in=df.height if df is not None else 0, rows_out=sum(output_df.height for output_df in output_dfs.values()))
+
+	return output_dfs
+
+
+def aggregate_ohlcv(df, interval, symbol):
+
+	return aggregate_ohlcv_timeframes(df, [interval], symbol)[interval]